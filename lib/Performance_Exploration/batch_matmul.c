@@ -4,6 +4,9 @@
 #include <assert.h>
 #include <time.h>
 #include <stdbool.h>
+#include <string.h>
+
+#include "perf_counters.h"
 
 // #define DEBUG
 #define REPS 10
@@ -198,6 +201,64 @@ void print_statistics(double times[]) {
     // printf("Standard deviation: %f second(s)\n", stddev_time);
 }
 
+// Achieved GFLOP/s of a batch matmul taking `seconds`, and the fraction of
+// the peak of the host if it is given with --peak-gflops.
+void print_performance(double seconds, double peak_gflops) {
+    double gflops = 2.0 * Batch * M * N * K / seconds / 1e9;
+    printf("GFLOP/s: %f\n", gflops);
+    if (peak_gflops > 0)
+        printf("Fraction of peak: %f\n", gflops / peak_gflops);
+}
+
+// Operands of both kernels
+typedef struct {
+    DTYPE (*A)[M][K];
+    DTYPE (*B)[K][N];
+    DTYPE (*C)[M][N];
+    MemRefDescriptor *memref_a;
+    MemRefDescriptor *memref_b;
+    MemRefDescriptor *memref_c;
+} Operands;
+
+void call_mlir(Operands *operands) {
+    _mlir_ciface_matmul_mlir(operands->memref_c, operands->memref_a, operands->memref_b);
+}
+
+void call_omp(Operands *operands) {
+    batch_mat_mul_omp(operands->A, K, operands->B, N, operands->C, N);
+}
+
+// Calls of a kernel counted with --counters, the counts are averaged
+#define COUNTER_REPS 3
+
+// Counts hardware events of a few more calls of `kernel`, after the timed
+// ones so that counting does not disturb them.
+void print_counters(void (*kernel)(Operands *), Operands *operands, CounterSettings settings) {
+    Counters counters;
+    if (!counters_open(&counters, settings)) {
+        printf("Counters: unavailable\n");
+        return;
+    }
+    double totals[MAX_COUNTERS] = {0};
+    for (int idx = 0; idx < COUNTER_REPS; ++idx) {
+        init_mat((DTYPE *)operands->C, Batch, M, N, 0.0);
+        counters_start(&counters);
+        kernel(operands);
+        counters_stop(&counters, totals);
+    }
+    printf("Counters per call:");
+    double cycles = 0, instructions = 0;
+    for (int i = 0; i < counters.count; ++i) {
+        printf(" %s=%.0f", counters.names[i], totals[i] / COUNTER_REPS);
+        if (strcmp(counters.names[i], "cycles") == 0) cycles = totals[i];
+        if (strcmp(counters.names[i], "instructions") == 0) instructions = totals[i];
+    }
+    printf("\n");
+    if (cycles > 0 && instructions > 0)
+        printf("IPC: %f\n", instructions / cycles);
+    counters_close(&counters);
+}
+
 int check_match(DTYPE (*gold)[M][N], DTYPE (*computed)[M][N]) {
     for (int b = 0; b < Batch; b++) {
         for (int i = 0; i < M; i++) {
@@ -215,6 +276,23 @@ int check_match(DTYPE (*gold)[M][N], DTYPE (*computed)[M][N]) {
 
 int main(int argc, char *argv[])
 {
+    // --counters adds hardware counters of both kernels (--vector-event=<raw>),
+    // --peak-gflops=<GFLOP/s> the fraction of the peak of the host they reach.
+    CounterSettings counters = {false, default_vector_event()};
+    double peak_gflops = 0.0;
+    for (int i = 1; i < argc; ++i) {
+        if (strcmp(argv[i], "--counters") == 0) {
+            counters.enabled = true;
+        } else if (strncmp(argv[i], "--vector-event=", 15) == 0) {
+            counters.vector_event = strtoull(argv[i] + 15, NULL, 0);
+        } else if (strncmp(argv[i], "--peak-gflops=", 14) == 0) {
+            peak_gflops = atof(argv[i] + 14);
+        } else {
+            fprintf(stderr, "Invalid argument: %s\n", argv[i]);
+            return EXIT_FAILURE;
+        }
+    }
+
     // init
     const int loop_times = 10;
 
@@ -280,7 +358,12 @@ int main(int argc, char *argv[])
     }
     printf("Transform runtimes:\n");
     print_statistics(mlir_times);
+    // print_statistics sorts the times
+    print_performance(mlir_times[REPS / 2], peak_gflops);
     printf("matches gold: %i\n", check_match(gold, memref_c.aligned));
+    Operands operands = {A, B, C, &memref_a, &memref_b, &memref_c};
+    if (counters.enabled)
+        print_counters(call_mlir, &operands, counters);
 
     printf("---------------------------------------\n");
 
@@ -296,7 +379,10 @@ int main(int argc, char *argv[])
     }
     printf("OpenMP runtimes:\n");
     print_statistics(omp_times);
+    print_performance(omp_times[REPS / 2], peak_gflops);
     printf("matches gold: %i\n", check_match(gold, C));
+    if (counters.enabled)
+        print_counters(call_omp, &operands, counters);
 
 
     free(A);
@@ -0,0 +1,143 @@
+#ifndef MEASURE_H
+#define MEASURE_H
+
+#include <math.h>
+#include <omp.h>
+#include <stdbool.h>
+#include <stdlib.h>
+#include <string.h>
+
+// Adaptive measurement: after a few warm-up runs, keep sampling until the
+// confidence interval of the median is narrower than `target_width` (relative
+// to the median) or the time budget is used up. Outliers are rejected with the
+// median absolute deviation before the interval is computed.
+//
+// Racing: with an incumbent runtime, sampling stops as soon as the candidate is
+// clearly slower: n samples that are all slower than the incumbent by more
+// than `race_margin`. If the median of the candidate were within the margin,
+// the probability of that would be below 2^-n; the margin keeps noise and
+// drift of the incumbent's own measurement from censoring kernels that are
+// as fast as it. Such a result is flagged as censored: its median only
+// bounds the runtime.
+
+typedef struct {
+    int warmup;
+    int min_samples;
+    int max_samples;
+    double target_width;   // relative width of the confidence interval
+    double time_budget;    // seconds, including warm-up
+    double outlier_cutoff; // in scaled MADs
+    double incumbent;      // seconds, best runtime so far, 0 disables racing
+    int race_samples;      // samples that must all be slower than the incumbent
+    double race_margin;    // relative to the incumbent
+} MeasureSettings;
+
+typedef struct {
+    double median;
+    double ci_low;
+    double ci_high;
+    int samples;
+    int rejected;
+    bool censored;
+} Measurement;
+
+static const MeasureSettings default_measure_settings = {
+    .warmup = 2,
+    .min_samples = 5,
+    .max_samples = 200,
+    .target_width = 0.02,
+    .time_budget = 10.0,
+    .outlier_cutoff = 3.5,
+    .incumbent = 0.0,
+    .race_samples = 3,
+    .race_margin = 0.05,
+};
+
+static int compare_doubles(const void *a, const void *b) {
+    double arg1 = *(const double *)a;
+    double arg2 = *(const double *)b;
+    if (arg1 < arg2) return -1;
+    if (arg1 > arg2) return 1;
+    return 0;
+}
+
+static double sorted_median(const double *sorted, int n) {
+    return n % 2 ? sorted[n / 2] : 0.5 * (sorted[n / 2 - 1] + sorted[n / 2]);
+}
+
+// Summarizes `times` (reordered in place): rejects outliers and computes the
+// median with a distribution-free 95% confidence interval from order statistics.
+static Measurement summarize_samples(double *times, int n, double outlier_cutoff) {
+    Measurement result = {0};
+    qsort(times, n, sizeof(double), compare_doubles);
+    double median = sorted_median(times, n);
+
+    double *deviations = malloc(n * sizeof(double));
+    for (int i = 0; i < n; ++i) deviations[i] = fabs(times[i] - median);
+    qsort(deviations, n, sizeof(double), compare_doubles);
+    // 1.4826 scales the MAD to the standard deviation of a normal distribution
+    double mad = 1.4826 * sorted_median(deviations, n);
+    free(deviations);
+    // Timer resolution makes the MAD of stable kernels tiny, deviations below
+    // 0.1% of the median are never outliers.
+    if (mad < 1e-3 * median) mad = 1e-3 * median;
+
+    int kept = 0;
+    for (int i = 0; i < n; ++i) {
+        if (mad > 0 && fabs(times[i] - median) > outlier_cutoff * mad) continue;
+        times[kept++] = times[i];
+    }
+
+    result.samples = kept;
+    result.rejected = n - kept;
+    result.median = sorted_median(times, kept);
+    double half_width = 1.96 * sqrt((double)kept) / 2.0;
+    int low = (int)floor(kept / 2.0 - half_width);
+    int high = (int)ceil(kept / 2.0 + half_width);
+    result.ci_low = times[low < 0 ? 0 : low];
+    result.ci_high = times[high > kept - 1 ? kept - 1 : high];
+    return result;
+}
+
+// Calls `timed_run` until the settings are satisfied, `timed_run` returns the
+// duration of one sample in seconds. Unless NULL, `samples` (room for
+// `max_samples`) receives every sample taken in order, including outliers:
+// `samples` + `rejected` of the result.
+static Measurement measure_adaptive(double (*timed_run)(void *), void *arg,
+                                    MeasureSettings settings, double *samples) {
+    double start = omp_get_wtime();
+    for (int i = 0; i < settings.warmup; ++i) {
+        timed_run(arg);
+    }
+
+    double *times = malloc(settings.max_samples * sizeof(double));
+    double *scratch = malloc(settings.max_samples * sizeof(double));
+    Measurement result = {0};
+    int n = 0;
+    double fastest = INFINITY;
+    while (n < settings.max_samples) {
+        times[n] = timed_run(arg);
+        if (times[n] < fastest) fastest = times[n];
+        ++n;
+        if (settings.incumbent > 0 && n >= settings.race_samples &&
+            fastest > settings.incumbent * (1 + settings.race_margin)) {
+            memcpy(scratch, times, n * sizeof(double));
+            result = summarize_samples(scratch, n, settings.outlier_cutoff);
+            result.censored = true;
+            break;
+        }
+        bool over_budget = omp_get_wtime() - start > settings.time_budget;
+        if (n < settings.min_samples && !over_budget && n < settings.max_samples) continue;
+
+        memcpy(scratch, times, n * sizeof(double));
+        result = summarize_samples(scratch, n, settings.outlier_cutoff);
+        if (over_budget) break;
+        if (result.ci_high - result.ci_low <= settings.target_width * result.median) break;
+    }
+    if (samples) memcpy(samples, times, n * sizeof(double));
+    free(times);
+    free(scratch);
+    return result;
+}
+
+#endif // MEASURE_H
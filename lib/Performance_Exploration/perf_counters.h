@@ -0,0 +1,110 @@
+#ifndef PERF_COUNTERS_H
+#define PERF_COUNTERS_H
+
+#include <linux/perf_event.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include <string.h>
+#include <sys/ioctl.h>
+#include <sys/syscall.h>
+#include <unistd.h>
+#if defined(__x86_64__) || defined(__i386__)
+#include <cpuid.h>
+#endif
+
+// Hardware performance counters of the kernel calls, read with perf_event_open.
+// Only user space is counted, which perf_event_paranoid <= 2 allows. Counters
+// the host does not support are left out. With more counters than the PMU has,
+// the kernel multiplexes them and the counts are scaled to the full time.
+
+typedef struct {
+    bool enabled;
+    uint64_t vector_event; // raw event counting vector instructions, 0 for none
+} CounterSettings;
+
+// FP_ARITH_INST_RETIRED with the umasks of 128, 256 and 512 bit packed single
+// precision operations, on Intel since Skylake.
+#define INTEL_PACKED_SINGLE_EVENT 0xa8c7
+
+#define MAX_COUNTERS 8
+
+typedef struct {
+    int count;
+    int fds[MAX_COUNTERS];
+    const char *names[MAX_COUNTERS];
+} Counters;
+
+static uint64_t cache_miss_event(uint64_t cache) {
+    return cache | (PERF_COUNT_HW_CACHE_OP_READ << 8) | (PERF_COUNT_HW_CACHE_RESULT_MISS << 16);
+}
+
+// The raw vector event is model specific, it is only used on Intel hosts.
+static uint64_t default_vector_event(void) {
+#if defined(__x86_64__) || defined(__i386__)
+    unsigned int eax, ebx, ecx, edx;
+    if (__get_cpuid(0, &eax, &ebx, &ecx, &edx) &&
+        ebx == 0x756e6547 && edx == 0x49656e69 && ecx == 0x6c65746e) // GenuineIntel
+        return INTEL_PACKED_SINGLE_EVENT;
+#endif
+    return 0;
+}
+
+static void counters_add(Counters *counters, const char *name, uint32_t type, uint64_t config) {
+    struct perf_event_attr attr;
+    memset(&attr, 0, sizeof(attr));
+    attr.size = sizeof(attr);
+    attr.type = type;
+    attr.config = config;
+    attr.disabled = 1;
+    attr.inherit = 1;
+    attr.exclude_kernel = 1;
+    attr.exclude_hv = 1;
+    attr.read_format = PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING;
+    int fd = syscall(SYS_perf_event_open, &attr, 0, -1, -1, 0);
+    if (fd < 0 || counters->count == MAX_COUNTERS) {
+        if (fd >= 0) close(fd);
+        return;
+    }
+    counters->fds[counters->count] = fd;
+    counters->names[counters->count] = name;
+    counters->count++;
+}
+
+// Opens the counters of the calling process, returns false if none is available.
+static bool counters_open(Counters *counters, CounterSettings settings) {
+    counters->count = 0;
+    counters_add(counters, "cycles", PERF_TYPE_HARDWARE, PERF_COUNT_HW_CPU_CYCLES);
+    counters_add(counters, "instructions", PERF_TYPE_HARDWARE, PERF_COUNT_HW_INSTRUCTIONS);
+    counters_add(counters, "l1d_misses", PERF_TYPE_HW_CACHE, cache_miss_event(PERF_COUNT_HW_CACHE_L1D));
+    counters_add(counters, "llc_misses", PERF_TYPE_HW_CACHE, cache_miss_event(PERF_COUNT_HW_CACHE_LL));
+    if (settings.vector_event)
+        counters_add(counters, "vector_instructions", PERF_TYPE_RAW, settings.vector_event);
+    return counters->count > 0;
+}
+
+static void counters_start(Counters *counters) {
+    for (int i = 0; i < counters->count; ++i) {
+        ioctl(counters->fds[i], PERF_EVENT_IOC_RESET, 0);
+        ioctl(counters->fds[i], PERF_EVENT_IOC_ENABLE, 0);
+    }
+}
+
+// Stops counting and adds the counts to `totals`.
+static void counters_stop(Counters *counters, double totals[]) {
+    for (int i = 0; i < counters->count; ++i)
+        ioctl(counters->fds[i], PERF_EVENT_IOC_DISABLE, 0);
+    for (int i = 0; i < counters->count; ++i) {
+        uint64_t values[3] = {0, 0, 0}; // count, time enabled, time running
+        if (read(counters->fds[i], values, sizeof(values)) != sizeof(values) || !values[2])
+            continue;
+        totals[i] += (double)values[0] * values[1] / values[2];
+    }
+}
+
+static void counters_close(Counters *counters) {
+    for (int i = 0; i < counters->count; ++i)
+        close(counters->fds[i]);
+    counters->count = 0;
+}
+
+#endif // PERF_COUNTERS_H
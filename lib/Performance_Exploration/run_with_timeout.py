@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 
+import json
+import os
+import resource
 import subprocess
 import sys
+import threading
 import time
 import psutil
 
@@ -11,13 +15,61 @@ def kill_process_tree(pid):
         child.kill()
     parent.kill()
 
+def tree_rss(pid):
+    """Returns the summed RSS of a process and its descendants in KiB."""
+    try:
+        parent = psutil.Process(pid)
+        processes = [parent] + parent.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    rss = 0
+    for process in processes:
+        try:
+            rss += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss // 1024
+
+def sample_memory(pid, stopped, trace, interval=0.01):
+    start = time.perf_counter()
+    while not stopped.is_set():
+        trace.append((round(time.perf_counter() - start, 4), tree_rss(pid)))
+        stopped.wait(interval)
+
+def write_memory_record(path, command, trace, before, after):
+    # The faults of all descendants, the shell waits for them
+    record = {
+        "command": command,
+        "peak_rss_kb": max((rss for _, rss in trace), default=0),
+        "minor_faults": after.ru_minflt - before.ru_minflt,
+        "major_faults": after.ru_majflt - before.ru_majflt,
+        "rss_trace": trace,
+    }
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
 def run_command_with_timeout(command, timeout):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
     proc = subprocess.Popen(command, shell=True)
+    # Memory of the command and its children, only sampled if it is logged to
+    # RUN_MEMORY_LOG
+    trace = []
+    stopped = threading.Event()
+    sampler = threading.Thread(target=sample_memory, args=(proc.pid, stopped, trace))
+    if os.environ.get("RUN_MEMORY_LOG"):
+        sampler.start()
     try:
         proc.wait(timeout=timeout)
     except subprocess.TimeoutExpired:
         kill_process_tree(proc.pid)
         sys.exit("Command timed out")
+    finally:
+        stopped.set()
+        if sampler.is_alive():
+            sampler.join()
+    if os.environ.get("RUN_MEMORY_LOG"):
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        write_memory_record(os.environ["RUN_MEMORY_LOG"], command, trace, before, after)
 
 
 if __name__ == "__main__":
@@ -4,6 +4,10 @@
 #include <assert.h>
 #include <time.h>
 #include <stdbool.h>
+#include <string.h>
+
+#include "measure.h"
+#include "perf_counters.h"
 
 // #define DEBUG
 #define REPS 15
@@ -31,6 +35,16 @@ DTYPE *mat_mult(const int m, const int n, const int k,
 extern void _mlir_ciface_matmul_mlir(MemRefDescriptor* arg1, MemRefDescriptor* arg2, MemRefDescriptor* arg3);
 extern void _mlir_ciface_print(MemRefDescriptor* arg1);
 
+#ifdef MEASURE_SERVER
+// Built as the measurement server, the kernel is loaded from a shared object
+// for every request instead of being linked in.
+#include <dlfcn.h>
+typedef void (*KernelFunction)(MemRefDescriptor*, MemRefDescriptor*, MemRefDescriptor*);
+static KernelFunction matmul_mlir = NULL;
+#else
+#define matmul_mlir _mlir_ciface_matmul_mlir
+#endif
+
 MemRefDescriptor get_memref(DTYPE *mem, int b, int m, int n, int lda) {
     MemRefDescriptor descriptor;
 
@@ -120,14 +134,6 @@ DTYPE *rand_mat(DTYPE *mat, const int b, const int r, const int c, const DTYPE m
     return mat;
 }
 
-int compare(const void *a, const void *b) {
-    double arg1 = *(const double *)a;
-    double arg2 = *(const double *)b;
-    if (arg1 < arg2) return -1;
-    if (arg1 > arg2) return 1;
-    return 0;
-}
-
 void print_statistics(double times[]) {
     // Calculate statistics
     // double min_time = times[0];
@@ -152,27 +158,250 @@ void print_statistics(double times[]) {
     // printf("Standard deviation: %f second(s)\n", stddev_time);
 
 
-    qsort(times, REPS, sizeof(double), compare);
+    qsort(times, REPS, sizeof(double), compare_doubles);
     // Calculate the median
     double median_time = times[REPS / 2];
 
     // Print the median
-    printf("%f\n", median_time);
+    printf("%f", median_time);
     // printf("%f", avg_time);
 }
 
+// Prints every sample as times=t1,t2,... so that runs can be compared with
+// the whole distribution rather than one median.
+void print_samples(const double times[], int n) {
+    printf(" times=");
+    for (int i = 0; i < n; ++i)
+        printf(i ? ",%f" : "%f", times[i]);
+}
+
+// Problem size, the kernel computes B matmuls of (m x k) * (k x n)
+typedef struct {
+    int B;
+    int m;
+    int n;
+    int k;
+} Shape;
+
+static const Shape full_shape = {6, 196, 256, 2304};
+
+typedef struct {
+    MemRefDescriptor *a;
+    MemRefDescriptor *b;
+    MemRefDescriptor *c;
+    int B;
+    int m;
+    int ldc;
+} KernelArgs;
+
+// One timed call of the kernel, resetting the output beforehand.
+double timed_matmul(void *arg) {
+    KernelArgs *kernel = arg;
+    init_mat(kernel->c->aligned, kernel->B, kernel->m, kernel->ldc, 0);
+    double start_time = omp_get_wtime();
+    matmul_mlir(kernel->c, kernel->a, kernel->b);
+    return omp_get_wtime() - start_time;
+}
+
+// Calls of the kernel counted with --counters, the counts are averaged
+#define COUNTER_REPS 3
+
+// Parses one measurement option, returns false for unknown ones.
+bool parse_argument(const char *arg, MeasureSettings *settings, bool *adaptive, Shape *shape,
+                    CounterSettings *counters) {
+    if (strcmp(arg, "--counters") == 0) {
+        counters->enabled = true;
+    } else if (strncmp(arg, "--vector-event=", 15) == 0) {
+        counters->vector_event = strtoull(arg + 15, NULL, 0);
+    } else if (strncmp(arg, "--shape=", 8) == 0) {
+        return sscanf(arg + 8, "%d,%d,%d,%d", &shape->B, &shape->m, &shape->n, &shape->k) == 4 &&
+               shape->B > 0 && shape->m > 0 && shape->n > 0 && shape->k > 0;
+    } else if (strcmp(arg, "--adaptive") == 0) {
+        *adaptive = true;
+    } else if (strncmp(arg, "--target-width=", 15) == 0) {
+        settings->target_width = atof(arg + 15);
+    } else if (strncmp(arg, "--time-budget=", 14) == 0) {
+        settings->time_budget = atof(arg + 14);
+    } else if (strncmp(arg, "--warmup=", 9) == 0) {
+        settings->warmup = atoi(arg + 9);
+    } else if (strncmp(arg, "--incumbent=", 12) == 0) {
+        settings->incumbent = atof(arg + 12);
+    } else if (strncmp(arg, "--race-margin=", 14) == 0) {
+        settings->race_margin = atof(arg + 14);
+    } else {
+        return false;
+    }
+    return true;
+}
+
+// Counts hardware events of a few more calls of the kernel, after the timed
+// ones so that counting does not disturb them. Prints name=value per call.
+void print_counters(KernelArgs *kernel, CounterSettings settings) {
+    Counters counters;
+    if (!counters_open(&counters, settings)) {
+        printf(" counters=unavailable");
+        return;
+    }
+    double totals[MAX_COUNTERS] = {0};
+    for (int idx = 0; idx < COUNTER_REPS; ++idx) {
+        init_mat(kernel->c->aligned, kernel->B, kernel->m, kernel->ldc, 0);
+        counters_start(&counters);
+        matmul_mlir(kernel->c, kernel->a, kernel->b);
+        counters_stop(&counters, totals);
+    }
+    for (int i = 0; i < counters.count; ++i)
+        printf(" %s=%.0f", counters.names[i], totals[i] / COUNTER_REPS);
+    counters_close(&counters);
+}
+
+// Measures the kernel and prints the result on one line, followed by the
+// samples taken and the hardware counters if enabled.
+void run_measurement(KernelArgs *kernel, MeasureSettings settings, bool adaptive,
+                     CounterSettings counters) {
+    if (!adaptive && settings.incumbent > 0) {
+        // Racing with the fixed number of samples
+        settings.warmup = 0;
+        settings.min_samples = REPS;
+        settings.max_samples = REPS;
+        settings.target_width = 0.0;
+        settings.time_budget = INFINITY;
+        settings.outlier_cutoff = INFINITY;
+        adaptive = true;
+    }
+
+    if (adaptive) {
+        // median, confidence interval of the median, samples used, outliers
+        // rejected and whether sampling stopped early against the incumbent
+        double *samples = malloc(settings.max_samples * sizeof(double));
+        Measurement result = measure_adaptive(timed_matmul, kernel, settings, samples);
+        printf("%f %f %f %d %d %d", result.median, result.ci_low, result.ci_high,
+               result.samples, result.rejected, result.censored);
+        print_samples(samples, result.samples + result.rejected);
+        free(samples);
+    } else {
+        double mlir_times[REPS];
+        double sorted_times[REPS];
+        int taken = REPS;
+
+        for(int idx=0; idx<REPS; ++idx) {
+            mlir_times[idx] = timed_matmul(kernel);
+            // printf("mlir: idx:%d time:%f second(s)\n", idx, mlir_times[idx]);
+
+            // Dont perform all repetitions if the time is too high
+            if (mlir_times[idx] > 1.0) {
+                // printf("Time too high, aborting this configuration\n");
+                for (int i = idx; i < REPS; ++i) {
+                    mlir_times[i] = mlir_times[idx];
+                }
+                taken = idx + 1;
+                break;
+            }
+        }
+        // print_statistics sorts its argument
+        memcpy(sorted_times, mlir_times, sizeof(mlir_times));
+        print_statistics(sorted_times);
+        print_samples(mlir_times, taken);
+    }
+    if (counters.enabled)
+        print_counters(kernel, counters);
+    printf("\n");
+}
+
+// Measures the kernel for `shape` on the first elements of the inputs.
+void measure_shape(DTYPE *a, DTYPE *b, DTYPE *c, Shape shape, MeasureSettings settings, bool adaptive,
+                   CounterSettings counters) {
+    MemRefDescriptor memref_a = get_memref(a, shape.B, shape.m, shape.k, shape.k);
+    MemRefDescriptor memref_b = get_memref(b, shape.B, shape.k, shape.n, shape.n);
+    MemRefDescriptor memref_c = get_memref(c, shape.B, shape.m, shape.n, shape.n);
+    KernelArgs kernel = {&memref_a, &memref_b, &memref_c, shape.B, shape.m, shape.n};
+    run_measurement(&kernel, settings, adaptive, counters);
+}
+
+// Whether the inputs allocated for `capacity` are large enough for `shape`.
+bool fits(Shape shape, Shape capacity) {
+    return (long)shape.B * shape.m * shape.k <= (long)capacity.B * capacity.m * capacity.k &&
+           (long)shape.B * shape.k * shape.n <= (long)capacity.B * capacity.k * capacity.n &&
+           (long)shape.B * shape.m * shape.n <= (long)capacity.B * capacity.m * capacity.n;
+}
+
+#ifdef MEASURE_SERVER
+// Serves requests from stdin until it is closed. Every request is a line with
+// the path of a shared object exporting _mlir_ciface_matmul_mlir, optionally
+// followed by measurement options overriding those of the command line. The
+// answer is the line run_measurement prints, or a line starting with "error".
+// The inputs are allocated and initialized once for all requests, smaller
+// shapes given with --shape run on a part of them.
+void serve(DTYPE *a, DTYPE *b, DTYPE *c, Shape capacity, MeasureSettings defaults,
+           bool adaptive_default, CounterSettings counters_default) {
+    char line[4096];
+    while (fgets(line, sizeof(line), stdin)) {
+        char *path = strtok(line, " \t\n");
+        if (!path) continue;
+
+        MeasureSettings settings = defaults;
+        bool adaptive = adaptive_default;
+        Shape shape = capacity;
+        CounterSettings counters = counters_default;
+        char *arg = NULL;
+        while ((arg = strtok(NULL, " \t\n")) && parse_argument(arg, &settings, &adaptive, &shape, &counters));
+        if (arg) {
+            printf("error: invalid argument %s\n", arg);
+            fflush(stdout);
+            continue;
+        }
+        if (!fits(shape, capacity)) {
+            printf("error: shape exceeds the allocated inputs\n");
+            fflush(stdout);
+            continue;
+        }
+
+        void *library = dlopen(path, RTLD_NOW | RTLD_LOCAL);
+        if (!library) {
+            printf("error: %s\n", dlerror());
+            fflush(stdout);
+            continue;
+        }
+        matmul_mlir = (KernelFunction)dlsym(library, "_mlir_ciface_matmul_mlir");
+        if (matmul_mlir) {
+            measure_shape(a, b, c, shape, settings, adaptive, counters);
+        } else {
+            printf("error: %s\n", dlerror());
+        }
+        fflush(stdout);
+        matmul_mlir = NULL;
+        dlclose(library);
+    }
+}
+#endif
+
 int main(int argc, char *argv[])
 {
     // init
     // const int loop_times = 10;
 
-    double start_time = 0.0;
-    double end_time   = 0.0;
+    // Without arguments a fixed number of REPS samples is taken. --adaptive
+    // samples until the confidence interval of the median is narrow enough.
+    // --incumbent=<seconds> stops early once the kernel is clearly slower,
+    // by more than --race-margin=<fraction> (default 0.05).
+    // --shape=B,m,n,k measures a kernel compiled for another problem size.
+    // --counters adds hardware counters of the kernel (--vector-event=<raw>).
+    // Built with -DMEASURE_SERVER these are the defaults of every request,
+    // and --shape sizes the inputs allocated for all requests.
+    bool adaptive = false;
+    MeasureSettings settings = default_measure_settings;
+    Shape shape = full_shape;
+    CounterSettings counters = {false, default_vector_event()};
+    for (int i = 1; i < argc; ++i) {
+        if (!parse_argument(argv[i], &settings, &adaptive, &shape, &counters)) {
+            fprintf(stderr, "Invalid argument: %s\n", argv[i]);
+            return EXIT_FAILURE;
+        }
+    }
 
-    const int B = 6;  // Batch size
-    const int m = 196;
-    const int n = 256;
-    const int k = 2304;
+    const int B = shape.B;  // Batch size
+    const int m = shape.m;
+    const int n = shape.n;
+    const int k = shape.k;
     const int lda = k;
     const int ldb = n;
     const int ldc = n;
@@ -190,30 +419,11 @@ int main(int argc, char *argv[])
 
     // printf("---------------------------------------\n");
     // // matmul mlir
-    MemRefDescriptor memref_a = get_memref(a, B, m, n, lda);
-    MemRefDescriptor memref_b = get_memref(b, B, m, n, lda);
-    MemRefDescriptor memref_c = get_memref(c, B, m, n, lda);
-    double mlir_times[REPS];
-
-    for(int idx=0; idx<REPS; ++idx) {
-        // zero_mat(b, m, n, ldc, memref_c_.aligned);
-        init_mat(memref_c.aligned, B, m, ldc, 0);
-        start_time = omp_get_wtime();
-        _mlir_ciface_matmul_mlir(&memref_c, &memref_a, &memref_b);
-        end_time = omp_get_wtime();
-        // printf("mlir: idx:%d time:%f second(s)\n", idx, end_time-start_time);
-        mlir_times[idx] = end_time - start_time;
-
-        // Dont perform all repetitions if the time is too high
-        if (mlir_times[idx] > 1.0) {
-            // printf("Time too high, aborting this configuration\n");
-            for (int i = idx; i < REPS; ++i) {
-                mlir_times[i] = end_time - start_time;
-            }
-            break;
-        }
-    }
-    print_statistics(mlir_times);
+#ifdef MEASURE_SERVER
+    serve(a, b, c, shape, settings, adaptive, counters);
+#else
+    measure_shape(a, b, c, shape, settings, adaptive, counters);
+#endif
 
     // MemRefDescriptor mlir_memref = get_memref(c, m, n, ldc);
     // // _mlir_ciface_print(&memref_c);
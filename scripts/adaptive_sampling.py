@@ -0,0 +1,97 @@
+from __future__ import annotations
+import math
+from statistics import median
+import time
+from typing import Callable, List, Optional, Tuple
+
+# Same procedure as lib/Performance_Exploration/measure.h: after a few warm-up
+# samples, keep sampling until the confidence interval of the median is narrow
+# enough or the time budget is used up, rejecting outliers by their median
+# absolute deviation.
+
+
+def reject_outliers(
+    samples: List[float], cutoff: float = 3.5
+) -> Tuple[List[float], List[float]]:
+    """Splits `samples` into kept values and outliers."""
+    center = median(samples)
+    # 1.4826 scales the MAD to the standard deviation of a normal distribution
+    mad = 1.4826 * median([abs(sample - center) for sample in samples])
+    # Timer resolution makes the MAD of stable runs tiny, deviations below
+    # 0.1% of the median are never outliers.
+    mad = max(mad, 1e-3 * abs(center))
+    kept = [sample for sample in samples if abs(sample - center) <= cutoff * mad]
+    outliers = [sample for sample in samples if abs(sample - center) > cutoff * mad]
+    return kept, outliers
+
+
+def median_confidence_interval(samples: List[float]) -> Tuple[float, float]:
+    """Distribution-free 95% confidence interval of the median."""
+    ordered = sorted(samples)
+    n = len(ordered)
+    half_width = 1.96 * math.sqrt(n) / 2
+    low = max(0, math.floor(n / 2 - half_width))
+    high = min(n - 1, math.ceil(n / 2 + half_width))
+    return ordered[low], ordered[high]
+
+
+class AdaptiveSampler:
+    def __init__(
+        self,
+        warmup: int = 1,
+        min_samples: int = 5,
+        max_samples: int = 100,
+        target_width: float = 0.02,
+        outlier_cutoff: float = 3.5,
+    ):
+        self.warmup = warmup
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.target_width = target_width
+        self.outlier_cutoff = outlier_cutoff
+        self.discarded = 0
+        self.samples: List[float] = []
+
+    def add(self, sample: Optional[float]):
+        if sample is None:
+            return
+        if self.discarded < self.warmup:
+            self.discarded += 1
+            return
+        self.samples.append(sample)
+
+    def summary(self) -> dict:
+        kept, outliers = reject_outliers(self.samples, self.outlier_cutoff)
+        ci_low, ci_high = median_confidence_interval(kept)
+        return {
+            "median": median(kept),
+            "ci_low": ci_low,
+            "ci_high": ci_high,
+            "samples": len(kept),
+            "rejected": len(outliers),
+        }
+
+    def converged(self) -> bool:
+        if len(self.samples) >= self.max_samples:
+            return True
+        if len(self.samples) < self.min_samples:
+            return False
+        summary = self.summary()
+        return summary["ci_high"] - summary["ci_low"] <= self.target_width * summary["median"]
+
+
+def sample_until_converged(
+    measure: Callable[[], None], samplers: List[AdaptiveSampler], time_budget: float
+):
+    """Calls `measure` until all `samplers` converged or `time_budget` seconds passed.
+
+    `measure` adds its results to the samplers itself, so a single call can
+    feed several of them, e.g. the mlir-opt and the transform time of one run.
+    """
+    start = time.perf_counter()
+    while not all(sampler.converged() for sampler in samplers):
+        measure()
+        if time.perf_counter() - start > time_budget and all(
+            sampler.samples for sampler in samplers
+        ):
+            break
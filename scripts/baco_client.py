@@ -0,0 +1,77 @@
+from __future__ import annotations
+import json
+import os
+import subprocess
+import sys
+from typing import Callable, Dict, List
+
+
+def parse_value(settings: dict, name: str, value: str):
+    parameter_type = settings["input_parameters"][name]["parameter_type"]
+    if parameter_type in ("integer", "ordinal"):
+        return int(float(value))
+    if parameter_type == "real":
+        return float(value)
+    return value
+
+
+def run_client_server(
+    settings_file: str,
+    evaluate_batch: Callable[[List[Dict]], List[Dict]],
+    batch_size: int,
+):
+    """Runs BACO in client-server mode and answers its requests in batches.
+
+    BACO writes `Request <n>`, a CSV header and n configurations to stdout and
+    expects the same configurations back, extended by the objectives and the
+    feasibility flag. `evaluate_batch` gets all n configurations at once, which
+    lets the caller evaluate them concurrently.
+    """
+    with open(settings_file, "r") as f:
+        settings = json.load(f)
+    settings["baco_mode"] = {"mode": "client-server"}
+    settings["evaluations_per_optimization_iteration"] = batch_size
+
+    client_settings_file = os.path.splitext(settings["output_data_file"])[0] + "_client_server.json"
+    with open(client_settings_file, "w") as f:
+        json.dump(settings, f, indent=4)
+
+    outputs = list(settings["optimization_objectives"])
+    if settings.get("feasible_output", {}).get("enable_feasible_predictor"):
+        outputs.append(settings["feasible_output"]["name"])
+
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from baco import run; run.optimize(sys.argv[1])",
+            client_settings_file,
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+    )
+    for line in process.stdout:
+        line = line.strip()
+        if not line.startswith("Request"):
+            print(line)
+            continue
+        num_configs = int(line.split()[1])
+        header = process.stdout.readline().strip().split(",")
+        configs = []
+        for _ in range(num_configs):
+            row = process.stdout.readline().strip().split(",")
+            configs.append(
+                {name: parse_value(settings, name, value) for name, value in zip(header, row)}
+            )
+
+        results = evaluate_batch(configs)
+
+        process.stdin.write(",".join(header + outputs) + "\n")
+        for config, result in zip(configs, results):
+            values = [config[name] for name in header] + [result[name] for name in outputs]
+            process.stdin.write(",".join(str(value) for value in values) + "\n")
+        process.stdin.flush()
+
+    return process.wait()
@@ -0,0 +1,192 @@
+from __future__ import annotations
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Specializes several configurations in one mlir-transform-opt run. Every
+# candidate's payload becomes a nested module `@candidate_<i>`, its
+# `__transform_main` the named sequence `@specialize_<i>`, and a new
+# `__transform_main` applies each of them to its module. Named sequences the
+# scripts share, like `@lower`, are parsed and verified once.
+
+symbol_pattern = re.compile(r"@([\w$.-]+)")
+main_pattern = re.compile(
+    r"transform\.named_sequence\s+@__transform_main\s*\(\s*(?P<arg>%[\w$.-]+)\s*:"
+    r"\s*(?P<type>!transform\.[\w.]+(?:<[^>]*>)?)\s*(?P<attributes>\{[^}]*\})?\s*\)"
+)
+
+
+def skip_string(text: str, pos: int) -> int:
+    """Returns the position after the string literal starting at `pos`."""
+    pos += 1
+    while pos < len(text) and text[pos] != '"':
+        pos += 2 if text[pos] == "\\" else 1
+    return pos + 1
+
+
+def skip_comment(text: str, pos: int) -> int:
+    """Returns the position of the end of the line of the comment at `pos`."""
+    end = text.find("\n", pos)
+    return len(text) if end < 0 else end
+
+
+def matching_brace(text: str, pos: int) -> int:
+    """Returns the position of the `}` closing the `{` at `pos`, skipping
+    string literals and comments."""
+    depth = 0
+    while pos < len(text):
+        char = text[pos]
+        if char == '"':
+            pos = skip_string(text, pos)
+            continue
+        if text.startswith("//", pos):
+            pos = skip_comment(text, pos)
+            continue
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return pos
+        pos += 1
+    raise ValueError("Unbalanced braces in module.")
+
+
+def split_module(script: str) -> Tuple[str, List[str]]:
+    """Splits a module into the text before it, e.g. attribute aliases, and
+    its top-level ops."""
+    match = re.search(r"^[ \t]*module\b", script, re.M)
+    if match is None:
+        raise ValueError("No module found.")
+    pos = match.end()
+    region = script.find("{", pos)
+    attributes = re.compile(r"(\s+@[\w$.-]+)?\s+attributes\s*").match(script, pos)
+    if attributes is not None and attributes.end() == region:
+        region = script.find("{", matching_brace(script, region))
+    if region < 0:
+        raise ValueError("Module without region.")
+    body = script[region + 1 : matching_brace(script, region)]
+
+    # An op ends with the line on which all its braces are closed
+    ops = []
+    start = None
+    depth = 0
+    pos = 0
+    while pos < len(body):
+        char = body[pos]
+        if body.startswith("//", pos):
+            pos = skip_comment(body, pos)
+            continue
+        if start is None and not char.isspace():
+            start = pos
+        if char == '"':
+            pos = skip_string(body, pos)
+            continue
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+        elif char == "\n" and depth == 0 and start is not None:
+            ops.append(body[start:pos].rstrip())
+            start = None
+        pos += 1
+    if start is not None and body[start:].strip():
+        ops.append(body[start:].rstrip())
+    return script[: match.start()], ops
+
+
+def sequence_name(op: str) -> Optional[str]:
+    if not op.startswith("transform.named_sequence"):
+        return None
+    return symbol_pattern.search(op).group(1)
+
+
+def rename_symbols(text: str, names: Dict[str, str]) -> str:
+    def rename(match: re.Match) -> str:
+        return "@" + names.get(match.group(1), match.group(1))
+
+    return symbol_pattern.sub(rename, text)
+
+
+def batched_script(scripts: List[str]) -> str:
+    """Returns one transform script specializing all `scripts`.
+
+    Raises `ValueError` if the scripts cannot be combined, e.g. because they
+    define different attribute aliases.
+    """
+    prefix = None
+    shared: Dict[str, str] = {}
+    payloads = []
+    sequences = []
+    for i, script in enumerate(scripts):
+        script_prefix, ops = split_module(script)
+        if prefix is not None and script_prefix != prefix:
+            raise ValueError("Scripts with different attribute aliases.")
+        prefix = script_prefix
+
+        helpers = {sequence_name(op): op for op in ops if sequence_name(op)}
+        main = helpers.pop("__transform_main", None)
+        if main is None:
+            raise ValueError("Script without __transform_main.")
+        # A candidate whose named sequences differ from the shared ones gets
+        # its own copies of all of them, under names of its own
+        names = {"__transform_main": f"specialize_{i}"}
+        if all(shared.get(name, op) == op for name, op in helpers.items()):
+            shared.update(helpers)
+            helpers = {}
+        names.update({name: f"{name}_{i}" for name in helpers})
+        sequences += [rename_symbols(op, names) for op in helpers.values()]
+        main = main_pattern.sub(
+            lambda match: (
+                f"transform.named_sequence @__transform_main({match.group('arg')}: "
+                f"{match.group('type')} "
+                f"{match.group('attributes') or '{transform.consumed}'})"
+            ),
+            main,
+            count=1,
+        )
+        sequences.append(rename_symbols(main, names))
+        payload = "\n  ".join(op for op in ops if not sequence_name(op))
+        payloads.append(f"module @candidate_{i} {{\n  {payload}\n}}")
+
+    entry = [
+        "transform.named_sequence @__transform_main("
+        "%root: !transform.any_op {transform.readonly}) {"
+    ]
+    for i in range(len(scripts)):
+        entry += [
+            f"  %candidate_{i} = transform.structured.match ops{{[\"builtin.module\"]}} "
+            f"attributes{{sym_name = \"candidate_{i}\"}} in %root "
+            ": (!transform.any_op) -> !transform.any_op",
+            # A failing candidate leaves its module as it is, the others go on
+            f"  transform.include @specialize_{i} failures(suppress) (%candidate_{i}) "
+            ": (!transform.any_op) -> ()",
+        ]
+    entry += ["  transform.yield", "}"]
+    ops = payloads + list(shared.values()) + sequences + ["\n".join(entry)]
+    return (
+        prefix
+        + "module attributes {transform.with_named_sequence} {\n"
+        + "\n\n".join(ops)
+        + "\n}\n"
+    )
+
+
+def split_lowered(output: str, count: int) -> List[Optional[str]]:
+    """Returns the lowered module of every candidate from the output of the
+    batched script.
+
+    Candidates whose transform failed are left partly lowered, with ops of
+    other dialects than LLVM. They are None, like candidates missing from the
+    output, so that they are specialized on their own and fail as they would
+    without the batch.
+    """
+    prefix, ops = split_module(output)
+    modules: List[Optional[str]] = [None] * count
+    for op in ops:
+        match = re.match(r"module @candidate_(\d+)\b", op)
+        if match is None or int(match.group(1)) >= count:
+            continue
+        module = prefix + "module" + op[match.end() :] + "\n"
+        if all(inner.startswith("llvm.") for inner in split_module(module)[1]):
+            modules[int(match.group(1))] = module
+    return modules
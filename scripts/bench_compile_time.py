@@ -1,29 +1,112 @@
 from statistics import median, stdev
+import json
 import subprocess
 import re
 import sys
-from typing import Tuple, List
+from typing import Dict, Optional, Tuple, List
 import os
 
+from adaptive_sampling import AdaptiveSampler, sample_until_converged
+from proc_monitor import run_monitored
+from results_store import default_path as default_results_db, open_store
+from scratch import Scratch
+
 debug = False
 
+# JSON lines file receiving the timing record of every tool run, see
+# patches/timing_json.patch. Set with --timing-log.
+timing_log: Optional[str] = None
+
+# Options passed to both tools, e.g. --mlir-disable-threading
+tool_options: List[str] = []
+
+# Memory usage of the last run of every tool, by tool name, see proc_monitor.py
+last_memory: Dict[str, dict] = {}
+# Sample the RSS of the tools over time, which disturbs their timings
+memory_trace = False
+
+default_pipeline = "--pass-pipeline=builtin.module(func.func(tosa-optional-decompositions), canonicalize, func.func(tosa-infer-shapes, tosa-make-broadcastable, tosa-to-linalg-named), canonicalize, func.func(tosa-layerwise-constant-fold, tosa-make-broadcastable), tosa-validate, func.func(tosa-to-linalg, tosa-to-arith, tosa-to-tensor), linalg-fuse-elementwise-ops, one-shot-bufferize)"
+
 
 def log(message: str, force: bool = False):
     if debug or force:
         print(message)
 
 
-def run_mlir_opt(input: str, pipeline: str, file: bool = False) -> Tuple[str, str]:
-    # The command you want to execute
-    command = ["/home/lib/llvm-project/build/bin/mlir-opt"]
-    if file:
-        if os.path.exists("tmp.mlir"):
-            input = "tmp.mlir"
-        else:
-            with open("tmp.mlir", "w") as file:
-                file.write(input)
-                input = "tmp.mlir"
-    if input:
+def read_timing_record(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as file:
+        lines = file.read().splitlines()
+    return json.loads(lines[-1]) if lines else None
+
+
+def communicate_with_timing(
+    command: List[str],
+    input: Optional[str] = None,
+    timeout: int = 15,
+    scratch: Optional[Scratch] = None,
+    payload: Optional[str] = None,
+) -> Tuple[str, str, Optional[dict]]:
+    """Runs a patched MLIR tool and collects its structured timing record.
+
+    Returns stdout, stderr and the record, which is None if the tool was
+    built without patches/timing_json.patch. Files of `scratch` referenced
+    by `command` are passed to the tool. The memory usage of the tool is
+    kept in `last_memory` and added to the record. `payload` names the
+    payload in the record if `command` reads it from a scratch file or stdin.
+    """
+    if scratch is None:
+        with Scratch() as scratch:
+            return communicate_with_timing(command, input, timeout, scratch, payload)
+
+    timing_file = scratch.path("timing.json")
+    if os.path.exists(timing_file):
+        os.remove(timing_file)
+    _, output, errors, memory = run_monitored(
+        command,
+        input,
+        timeout,
+        memory_trace,
+        pass_fds=scratch.fds,
+        env=dict(os.environ, MLIR_TIMING_JSON=timing_file),
+    )
+    if memory["timed_out"]:
+        log(f"{command[0]} timeout expired.")
+    del memory["timed_out"]
+    last_memory[os.path.basename(command[0])] = memory
+    record = read_timing_record(timing_file)
+    if record is not None:
+        record["memory"] = memory
+
+    if record is not None and timing_log:
+        record["command"] = command
+        if payload is not None:
+            record["payload"] = payload
+        # One write to a descriptor opened with O_APPEND, records of concurrent
+        # jobs, e.g. of bench_matrix.py, do not interleave however large
+        fd = os.open(timing_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(record) + "\n").encode())
+        finally:
+            os.close(fd)
+    return (output, errors, record)
+
+
+def run_mlir_opt(
+    input: str,
+    pipeline: str,
+    file: bool = False,
+    scratch: Optional[Scratch] = None,
+    payload: Optional[str] = None,
+) -> Tuple[str, str, Optional[dict]]:
+    """Runs `pipeline` on the payload file `input`.
+
+    With `file`, `input` is the payload itself and piped to mlir-opt, named
+    `payload` in the timing record.
+    """
+    command = ["/home/lib/llvm-project/build/bin/mlir-opt"] + tool_options
+    if input and not file:
         command.append(input)
 
     if pipeline:
@@ -31,20 +114,9 @@ def run_mlir_opt(input: str, pipeline: str, file: bool = False) -> Tuple[str, st
             command.extend(pipeline.split(" "))
         else:
             command.append(pipeline)
-    # Initialize the subprocess with the command
-    process = subprocess.Popen(
-        command,  # Add any additional flags you need here
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
+    output, errors, record = communicate_with_timing(
+        command, input if file else None, scratch=scratch, payload=payload
     )
-    # Send the MLIR input to mlir-opt through the stdin pipe and capture the output
-    try:
-        output, errors = process.communicate(timeout=15)  # Set appropriate timeout
-    except subprocess.TimeoutExpired:
-        process.kill()
-        output, errors = process.communicate()
     if errors:
         if "error" in errors or "Unknown" in errors:
             log("Error stream:\n" + errors, True)
@@ -54,16 +126,36 @@ def run_mlir_opt(input: str, pipeline: str, file: bool = False) -> Tuple[str, st
         log("MLIR Output:")
         log(output)
 
-    return (errors, output)
+    return (errors, output, record)
+
 
+def extract_first_module(errors: str) -> Optional[str]:
+    """Returns the first top-level `module` block printed to `errors`.
 
-def process_mlir_opt_output(errors: str) -> Tuple[str, float]:
-    # Regular expression to capture the first `module` block.
-    # This pattern assumes that 'module {...}' blocks do not have nested 'module' definitions
-    module_pattern = re.compile(r"(module.*?\{.*?\n\})", re.DOTALL)
-    # Find all module blocks in the output
-    matches = module_pattern.findall(errors)
-    first_module = matches[0] if matches else None
+    The block ends at the first unindented closing brace, which assumes that
+    module blocks do not have nested module definitions.
+    """
+    lines = errors.splitlines()
+    for begin, line in enumerate(lines):
+        if line.startswith("module") and "{" in line:
+            for end in range(begin + 1, len(lines)):
+                if lines[end] == "}":
+                    return "\n".join(lines[begin : end + 1])
+            return None
+    return None
+
+
+def parse_time_taken(errors: str) -> Optional[float]:
+    # Fallback for tools built without patches/timing_json.patch
+    time_pattern = re.compile(r"Time taken:\s*(\d+\.\d+e[+-]?\d*)\s*seconds.")
+    time_match = time_pattern.search(errors)
+    return float(time_match.group(1)) if time_match else None
+
+
+def process_mlir_opt_output(
+    errors: str, record: Optional[dict] = None
+) -> Tuple[str, float]:
+    first_module = extract_first_module(errors)
     if first_module:
         log("First module block:")
         log(first_module)
@@ -75,17 +167,13 @@ def process_mlir_opt_output(errors: str) -> Tuple[str, float]:
         log("No module block found.")
         raise Exception("No module block found.")
 
-    # Regular expression to capture the time taken in seconds.
-    time_pattern = re.compile(r"Time taken:\s*(\d+\.\d+e[+-]?\d*)\s*seconds.")
-
-    # Search for the time pattern in the output.
-    time_match = time_pattern.search(errors)
-
-    # Isolate the time (number of seconds) if it's found.
-    time_in_seconds = float(time_match.group(1)) if time_match else None
+    if record is not None and "total" in record:
+        time_in_seconds = record["total"]
+    else:
+        time_in_seconds = parse_time_taken(errors)
 
     # Now `time_in_seconds` contains the number of seconds as a float
-    # or is `None` if no match was found.
+    # or is `None` if no time information was found.
     if time_in_seconds is not None:
         log(f"MLIR Time taken: {time_in_seconds} seconds.")
     else:
@@ -97,71 +185,30 @@ def process_mlir_opt_output(errors: str) -> Tuple[str, float]:
 
 
 def run_transform_opt(
-    input: str, transform_script: str, external_script: bool = True
-) -> Tuple[str, str]:
-
-    # The command you want to execute
-    command = ["/home/lib/llvm-project/build/bin/mlir-transform-opt"]
-    if not external_script:
-        if input:
-            # Read the input file
-            with open(input, "r") as file:
-                mlir_input = file.read()
-
-        # Problem: the input is now in bytecode and I depend on appending the script into the mlir
-
-        command.append("-allow-unregistered-dialect")
-
-        # Send the MLIR input to mlir-transform-opt through the stdin pipe and capture the output
-        # remove empty lines
-        mlir_lines = [line for line in mlir_input.split("\n") if line.strip()]
-        # Add transform.with_named_sequence attribute
-        if mlir_lines[0].startswith("module attributes"):
-            mlir_lines[0] = mlir_lines[0].removesuffix("} {")
-            mlir_lines[0] += ", transform.with_named_sequence} {"
-        else:
-            mlir_lines[0] = mlir_lines[0].removesuffix("{")
-            mlir_lines[0] += "attributes {transform.with_named_sequence} {"
-        # erase closing brace of module
-        mlir_lines.pop()
-
-        modified_mlir_input = "\n".join(mlir_lines) + "\n" + transform_script + "\n}"
-
-        # write modified input to file
-        with open("dump.mlir", "w") as file:
-            file.write(modified_mlir_input)
-    else:
-        modified_mlir_input = input
-        if os.path.exists("transform_script.mlir"):
-            os.remove("transform_script.mlir")
-        with open("transform_script.mlir", "w") as file:
-            file.write("module attributes {transform.with_named_sequence} {\n")
-            file.write(transform_script)
-            file.write("}\n")
+    input: str,
+    transform_script: str,
+    scratch: Optional[Scratch] = None,
+    payload: Optional[str] = None,
+) -> Tuple[str, str, Optional[dict]]:
+    # The transform script is always passed in its own file, so the payload
+    # is never modified and may be textual or bytecode.
+    if scratch is None:
+        with Scratch() as scratch:
+            return run_transform_opt(input, transform_script, scratch, payload)
+
+    command = ["/home/lib/llvm-project/build/bin/mlir-transform-opt"] + tool_options
+    script_file = scratch.write(
+        "transform_script.mlir",
+        "module attributes {transform.with_named_sequence} {\n"
+        + transform_script
+        + "}\n",
+    )
+    command.append(input)
+    command.append(f"--transform={script_file}")
 
-        command.append(input)
-        command.append("--transform=transform_script.mlir")
-
-    # log(input, True)
-    # Initialize the subprocess with the command
-    process = subprocess.Popen(
-        command,  # Add any additional flags you need here
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
+    output, errors, record = communicate_with_timing(
+        command, scratch=scratch, payload=payload
     )
-    try:
-        if not external_script:
-            output, errors = process.communicate(
-                input=modified_mlir_input, timeout=15
-            )  # Set appropriate timeout
-        else:
-            output, errors = process.communicate(timeout=15)
-    except subprocess.TimeoutExpired:
-        log("Transform timeout expired.")
-        process.kill()
-        output, errors = process.communicate()
     if errors:
         # log("Error stream:")
         if "error" in errors:
@@ -172,22 +219,68 @@ def run_transform_opt(
         # log or otherwise use the output from mlir-opt
         log("Transform output:\n" + output)
 
-    return (errors, output)
-
+    return (errors, output, record)
 
-def process_transform_opt_output(errors: str) -> float:
-    # Regular expression to capture the time taken in seconds.
-    time_pattern = re.compile(r"Time taken:\s*(\d+\.\d+e[+-]?\d*)\s*seconds.")
-
-    # Search for the time pattern in the output.
-    time_match = time_pattern.search(errors)
 
-    # Isolate the time (number of seconds) if it's found.
-    time_in_seconds = float(time_match.group(1)) if time_match else None
+def process_transform_opt_output(errors: str, record: Optional[dict] = None) -> float:
+    if record is not None and "total" in record:
+        time_in_seconds = record["total"]
+    else:
+        time_in_seconds = parse_time_taken(errors)
     log(f"Transform Time taken: {time_in_seconds} seconds.")
     return time_in_seconds
 
 
+def measure_parse_time(input: str) -> Optional[float]:
+    """Returns the time mlir-opt takes to parse `input`.
+
+    The times of both benchmarked tools exclude parsing, this reports it
+    separately, e.g. to compare textual and bytecode payloads.
+    """
+    command = [
+        "/home/lib/llvm-project/build/bin/mlir-opt",
+        input,
+        "--mlir-timing",
+        "--mlir-timing-display=list",
+        "-o",
+        os.devnull,
+    ]
+    _, errors, _ = communicate_with_timing(command)
+    for line in errors.splitlines():
+        if line.strip().endswith("Parser"):
+            # The last column is the wall time
+            times = re.findall(r"(\d+\.\d+) \(\s*\d+\.\d+%\)", line)
+            if times:
+                return float(times[-1])
+    return None
+
+
+def bytecode_payload(input: str) -> str:
+    """Returns the bytecode version of `input`, converting it if needed.
+
+    The bytecode is kept next to the textual payload, e.g. as
+    bert_tosa.mlirbc, and converted again when the payload is newer.
+    """
+    if input.endswith(".mlirbc"):
+        return input
+    bytecode = os.path.splitext(input)[0] + ".mlirbc"
+    if not os.path.exists(bytecode) or os.path.getmtime(bytecode) < os.path.getmtime(
+        input
+    ):
+        subprocess.run(
+            [
+                "/home/lib/llvm-project/build/bin/mlir-opt",
+                input,
+                "--emit-bytecode",
+                "-o",
+                bytecode,
+            ],
+            check=True,
+            stderr=subprocess.DEVNULL,
+        )
+    return bytecode
+
+
 def preprocess_mlir_test_file(input_file: str) -> List[Tuple[str, str]]:
     configs: List[Tuple[str, str]] = []
     with open(input_file, "r") as file:
@@ -215,7 +308,14 @@ def preprocess_mlir_test_file(input_file: str) -> List[Tuple[str, str]]:
 
 
 def run(args):
+    # Every run gets its own scratch space, removed when it ends
+    with Scratch() as scratch:
+        return run_in(args, scratch)
+
+
+def run_in(args, scratch: Scratch):
     transform_script = None
+    pipeline = None
     test_file = False
     if len(args) > 0 and args[0] == "--transform-script":
         mlir_input = args[1]
@@ -237,34 +337,51 @@ def run(args):
     if test_file:
         configs = preprocess_mlir_test_file(mlir_input)
         times: List[Tuple[float, float]] = []
-        for input, pipeline in configs:
-            mlir_errors, mlir_output = run_mlir_opt(input, pipeline, True)
-            transform_script, mlir_time = process_mlir_opt_output(mlir_errors)
-            transform_errors, transform_output = run_transform_opt(
-                "tmp.mlir", transform_script, True
+        stem, extension = os.path.splitext(mlir_input)
+        for i, (input, pipeline) in enumerate(configs):
+            # Both tools read the payload from memory, the records name it
+            # after the test file and its position in it
+            payload = f"{stem}_{i}{extension}"
+            mlir_errors, mlir_output, mlir_record = run_mlir_opt(
+                input, pipeline, True, scratch, payload
+            )
+            transform_script, mlir_time = process_mlir_opt_output(
+                mlir_errors, mlir_record
+            )
+            transform_errors, transform_output, transform_record = run_transform_opt(
+                scratch.write(f"payload{i}.mlir", input),
+                transform_script,
+                scratch,
+                payload,
+            )
+            transform_time = process_transform_opt_output(
+                transform_errors, transform_record
             )
-            transform_time = process_transform_opt_output(transform_errors)
             log(f"Time:\nTransform: {transform_time}")
             times.append((mlir_time, transform_time))
 
         return times
 
-    pipeline = "--pass-pipeline=builtin.module(func.func(tosa-optional-decompositions), canonicalize, func.func(tosa-infer-shapes, tosa-make-broadcastable, tosa-to-linalg-named), canonicalize, func.func(tosa-layerwise-constant-fold, tosa-make-broadcastable), tosa-validate, func.func(tosa-to-linalg, tosa-to-arith, tosa-to-tensor), linalg-fuse-elementwise-ops, one-shot-bufferize)"
+    if not pipeline:
+        pipeline = default_pipeline
     if transform_script:
-        mlir_errors, mlir_output = run_mlir_opt(mlir_input, pipeline)
-        _, mlir_time = process_mlir_opt_output(mlir_errors)
+        mlir_errors, mlir_output, mlir_record = run_mlir_opt(
+            mlir_input, pipeline, scratch=scratch
+        )
+        _, mlir_time = process_mlir_opt_output(mlir_errors, mlir_record)
     else:
-        mlir_errors, mlir_output = run_mlir_opt(mlir_input, pipeline)
-        with open("output", "w") as file:
-            file.write(mlir_output)
-
-        transform_script, mlir_time = process_mlir_opt_output(mlir_errors)
-
-    transform_errors, transform_output = run_transform_opt(
-        mlir_input, transform_script, True
+        mlir_errors, mlir_output, mlir_record = run_mlir_opt(
+            mlir_input, pipeline, scratch=scratch
+        )
+        transform_script, mlir_time = process_mlir_opt_output(
+            mlir_errors, mlir_record
+        )
+
+    transform_errors, transform_output, transform_record = run_transform_opt(
+        mlir_input, transform_script, scratch
     )
 
-    transform_time = process_transform_opt_output(transform_errors)
+    transform_time = process_transform_opt_output(transform_errors, transform_record)
 
     if "mlir_time" in locals():
         log(f"Time:\nMLIR:      {mlir_time}\nTransform: {transform_time}")
@@ -273,7 +390,67 @@ def run(args):
     return (mlir_time if "mlir_time" in locals() else None, transform_time)
 
 
+def extract_transform_script(pipeline: str) -> str:
+    # mlir-opt prints the transform script equivalent to the pipeline before
+    # running it, an empty payload is enough to obtain it.
+    mlir_errors, _, mlir_record = run_mlir_opt("", pipeline)
+    transform_script, _ = process_mlir_opt_output(mlir_errors, mlir_record)
+    return transform_script
+
+
+def main_worker(args, repetitions: int):
+    """Benchmarks both approaches in-process using the MLIR Python bindings.
+
+    The payload is parsed once, every repetition applies the pipeline and the
+    transform script to a fresh clone of it.
+    """
+    try:
+        from mlir_worker import MlirWorker
+    except ImportError as e:
+        sys.exit(
+            f"--worker needs the MLIR Python bindings ({e}). Build the target "
+            "MLIRPythonModules and add build/tools/mlir/python_packages/mlir_core "
+            "of llvm-project to PYTHONPATH."
+        )
+
+    mlir_input = args[0]
+    pipeline = "".join(args[1:]) if len(args) > 1 else default_pipeline
+    if len(args) > 2 and args[1] == "--transform-script":
+        pipeline = default_pipeline
+        with open(args[2], "r") as file:
+            transform_script = file.read()
+    else:
+        transform_script = extract_transform_script(pipeline)
+
+    worker = MlirWorker.from_file(mlir_input)
+    log(f"Parse time: {worker.parse_time}", True)
+
+    mlir_times: List[dict] = []
+    transform_times: List[dict] = []
+    for i in range(repetitions):
+        mlir_times.append(worker.run_pipeline(pipeline))
+        transform_times.append(worker.run_transform(transform_script))
+
+    for phase in ["clone", "apply"]:
+        mlir_phase = [times[phase] for times in mlir_times]
+        transform_phase = [times[phase] for times in transform_times]
+        log(f"MLIR {phase} times: {mlir_phase}", True)
+        log(f"Transform {phase} times: {transform_phase}", True)
+        log(f"Median {phase}: {median(mlir_phase)}, {median(transform_phase)}", True)
+    log(
+        f"Median Speedup: {median([m['apply'] / t['apply'] for m, t in zip(mlir_times, transform_times)])}",
+        True,
+    )
+
+
 def main(args):
+    # Files of the whole benchmark, like the timing log of --profile, live in
+    # a scratch space of their own, removed when the benchmark ends
+    with Scratch() as logs:
+        benchmark(args, logs)
+
+
+def benchmark(args, logs: Scratch):
     transform_times: List[float] = []
     mlir_times: List[float] = []
     speedups: List[float] = []
@@ -286,17 +463,90 @@ def main(args):
             if transform_time is not None:
                 speedups.append(mlir_time / transform_time)
 
+    global timing_log, memory_trace
+    profile = False
     repetitions = 10
-    for i in range(repetitions):
+    adaptive = False
+    # Adaptive sampling: relative width of the median's confidence interval
+    # to reach and the time budget in seconds
+    target_width = 0.02
+    time_budget = 600.0
+    bytecode = False
+    results_db = default_results_db
+    options = ["--profile", "--adaptive", "--timing-log=", "--repetitions="]
+    options += ["--target-width=", "--time-budget=", "--bytecode", "--results-db="]
+    options += ["--memory-trace"]
+    while len(args) > 0 and any(args[0].startswith(option) for option in options):
+        option, _, value = args[0].partition("=")
+        if option == "--profile":
+            # Break the time down by pass and transform op, see timing_report.py
+            profile = True
+        elif option == "--adaptive":
+            adaptive = True
+        elif option == "--timing-log":
+            timing_log = value
+        elif option == "--repetitions":
+            repetitions = int(value)
+        elif option == "--target-width":
+            target_width = float(value)
+        elif option == "--time-budget":
+            time_budget = float(value)
+        elif option == "--bytecode":
+            # Benchmark the bytecode version of the payload
+            bytecode = True
+        elif option == "--results-db":
+            # Empty to not store the results
+            results_db = value
+        elif option == "--memory-trace":
+            # Record the RSS over time in the timing log, not only its peak
+            memory_trace = True
+        args = args[1:]
+    if profile and not timing_log:
+        timing_log = logs.path("timing.jsonl")
+
+    if bytecode:
+        worker = len(args) > 0 and args[0] == "--worker"
+        payload = 1 if worker else 0
+        if len(args) > payload and os.path.isfile(args[payload]):
+            args = args[:payload] + [bytecode_payload(args[payload])] + args[payload + 1 :]
+
+    if len(args) > 0 and args[0] == "--worker":
+        main_worker(args[1:], repetitions)
+        return
+
+    mlir_sampler = AdaptiveSampler(warmup=0, target_width=target_width)
+    transform_sampler = AdaptiveSampler(warmup=0, target_width=target_width)
+    parse_times: List[float] = []
+    # Peak RSS in KiB and page faults of every run, per tool
+    memory: Dict[str, List[dict]] = {"mlir-opt": [], "mlir-transform-opt": []}
+    # Parsing is excluded from both times, measure it on its own for payloads
+    # given as files.
+    payload = args[0] if len(args) > 0 and os.path.isfile(args[0]) else None
+
+    def measure():
+        if payload:
+            parse_time = measure_parse_time(payload)
+            if parse_time is not None:
+                parse_times.append(parse_time)
+        last_memory.clear()
         result = run(args)
-        if isinstance(result, List):
-            for mlir_time, transform_time in result:
-                add_times(mlir_time, transform_time)
-        else:
-            mlir_time, transform_time = result
+        for tool, usage in last_memory.items():
+            if tool in memory:
+                memory[tool].append(usage)
+        for mlir_time, transform_time in (
+            result if isinstance(result, List) else [result]
+        ):
             add_times(mlir_time, transform_time)
+            mlir_sampler.add(mlir_time)
+            transform_sampler.add(transform_time)
 
-        mlir_time, transform_time = result
+    if adaptive:
+        # warm-up run, e.g. to get the model into the page cache
+        run(args)
+        sample_until_converged(measure, [mlir_sampler, transform_sampler], time_budget)
+    else:
+        for i in range(repetitions):
+            measure()
 
     log(f"MLIR times: {mlir_times}", True)
     log(f"Transform times: {transform_times}", True)
@@ -313,6 +563,62 @@ def main(args):
         pass
     log(f"Median: {median(mlir_times)}, {median(transform_times)}", True)
     log(f"Median Speedup: {median(speedups)}", True)
+    if parse_times:
+        log(f"Median Parse time: {median(parse_times)}", True)
+    if memory["mlir-opt"] and memory["mlir-transform-opt"]:
+        mlir_memory, transform_memory = memory["mlir-opt"], memory["mlir-transform-opt"]
+        for key, label in [
+            ("peak_rss_kb", "Peak RSS (KiB)"),
+            ("minor_faults", "Minor page faults"),
+            ("major_faults", "Major page faults"),
+        ]:
+            log(
+                f"Median {label}: {median(u[key] for u in mlir_memory)}, "
+                f"{median(u[key] for u in transform_memory)}",
+                True,
+            )
+    if adaptive:
+        for name, sampler in [("MLIR", mlir_sampler), ("Transform", transform_sampler)]:
+            summary = sampler.summary()
+            log(
+                f"{name} median: {summary['median']} "
+                f"(95% CI {summary['ci_low']} - {summary['ci_high']}, "
+                f"{summary['samples']} samples, {summary['rejected']} outliers rejected)",
+                True,
+            )
+
+    store = open_store(results_db) if results_db else None
+    if store is not None and payload:
+        store.add_run(
+            "compile",
+            re.sub(r"(_tosa)?\.mlir(bc)?$", "", os.path.basename(payload)),
+            "".join(args[1:]) or default_pipeline,
+            {
+                "mlir_time": mlir_times,
+                "transform_time": transform_times,
+                "parse_time": parse_times,
+                "mlir_peak_rss_kb": [u["peak_rss_kb"] for u in memory["mlir-opt"]],
+                "transform_peak_rss_kb": [
+                    u["peak_rss_kb"] for u in memory["mlir-transform-opt"]
+                ],
+            },
+        )
+        log(f"Stored results of revision {store.revision} in {results_db}", True)
+
+    if profile:
+        from timing_report import load_records, print_trees
+
+        # Counting the payload ops of every transform op slows the tools
+        # down, they are counted in one more run that is not measured.
+        measured_log = timing_log
+        timing_log = logs.path("payload_ops.jsonl")
+        os.environ["MLIR_TIMING_JSON_PAYLOAD_OPS"] = "1"
+        try:
+            run(args)
+        finally:
+            del os.environ["MLIR_TIMING_JSON_PAYLOAD_OPS"]
+            counted_log, timing_log = timing_log, measured_log
+        print_trees(load_records([measured_log]), load_records([counted_log]))
 
 
 if __name__ == "__main__":
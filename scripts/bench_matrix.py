@@ -0,0 +1,261 @@
+from __future__ import annotations
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import multiprocessing
+import os
+import re
+from statistics import median, stdev
+from typing import Dict, List, Optional, Tuple
+
+import bench_compile_time
+import results_store
+from get_models import MODEL_URLS
+
+model_dir = "/home/models"
+
+
+def init_worker(
+    worker_ids, pin_cores: bool, timing_log: Optional[str], memory_trace: bool
+):
+    worker_id = worker_ids.get()
+    bench_compile_time.timing_log = timing_log
+    bench_compile_time.memory_trace = memory_trace
+    if pin_cores:
+        cpu = sorted(os.sched_getaffinity(0))[worker_id]
+        os.sched_setaffinity(0, {cpu})
+
+
+def run_job(job: Tuple[str, str, str, int]) -> Optional[dict]:
+    """Returns the sample of one job, None if it failed."""
+    model, pipeline_name, pipeline, repetition = job
+    # Every run has its own scratch space, jobs do not interfere
+    try:
+        parse_time = bench_compile_time.measure_parse_time(model)
+        bench_compile_time.last_memory.clear()
+        mlir_time, transform_time = bench_compile_time.run([model, pipeline])
+    except Exception as e:
+        print(f"{os.path.basename(model)} with {pipeline_name} failed: {e}")
+        return None
+    result = {
+        "model": re.sub(r"_tosa\.mlir(bc)?$", "", os.path.basename(model)),
+        "pipeline": pipeline_name,
+        "repetition": repetition,
+        "parse_time": parse_time,
+        "mlir_time": mlir_time,
+        "transform_time": transform_time,
+    }
+    for prefix, tool in [("mlir", "mlir-opt"), ("transform", "mlir-transform-opt")]:
+        memory = bench_compile_time.last_memory.get(tool, {})
+        for key in ["peak_rss_kb", "minor_faults", "major_faults"]:
+            result[f"{prefix}_{key}"] = memory.get(key)
+    return result
+
+
+def peak_median(samples: List[dict], key: str) -> float:
+    peaks = [sample[key] for sample in samples if sample[key] is not None]
+    return median(peaks) / 1024 if peaks else float("nan")
+
+
+def summarize(results: List[dict]) -> List[dict]:
+    groups: Dict[Tuple[str, str], List[dict]] = {}
+    for result in results:
+        groups.setdefault((result["model"], result["pipeline"]), []).append(result)
+
+    rows = []
+    for (model, pipeline), samples in sorted(groups.items()):
+        mlir_times = [sample["mlir_time"] for sample in samples]
+        transform_times = [sample["transform_time"] for sample in samples]
+        parse_times = [
+            sample["parse_time"] for sample in samples if sample["parse_time"] is not None
+        ]
+        rows.append(
+            {
+                "model": model,
+                "pipeline": pipeline,
+                "samples": len(samples),
+                "parse_median": median(parse_times) if parse_times else float("nan"),
+                "mlir_median": median(mlir_times),
+                "transform_median": median(transform_times),
+                "mlir_stdev": stdev(mlir_times) if len(samples) > 1 else 0.0,
+                "transform_stdev": stdev(transform_times) if len(samples) > 1 else 0.0,
+                "median_speedup": median(
+                    [m / t for m, t in zip(mlir_times, transform_times)]
+                ),
+                "mlir_peak_mb": peak_median(samples, "mlir_peak_rss_kb"),
+                "transform_peak_mb": peak_median(samples, "transform_peak_rss_kb"),
+            }
+        )
+    return rows
+
+
+def store_results(
+    store: results_store.ResultsStore, results: List[dict], pipelines: Dict[str, str]
+):
+    """Adds a run per model and pipeline, the pipeline itself is the config."""
+    groups: Dict[Tuple[str, str], List[dict]] = {}
+    for result in results:
+        groups.setdefault((result["model"], result["pipeline"]), []).append(result)
+    for (model, pipeline), samples in groups.items():
+        store.add_run(
+            "compile",
+            model,
+            pipelines[pipeline],
+            {
+                metric: [sample[metric] for sample in samples]
+                for metric in [
+                    "mlir_time",
+                    "transform_time",
+                    "parse_time",
+                    "mlir_peak_rss_kb",
+                    "transform_peak_rss_kb",
+                ]
+            },
+        )
+
+
+def format_cell(value) -> str:
+    return f"{value:.6g}" if isinstance(value, float) else str(value)
+
+
+def print_table(rows: List[dict]):
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    widths = {
+        column: max(len(column), *(len(format_cell(row[column])) for row in rows))
+        for column in columns
+    }
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print(
+            "  ".join(format_cell(row[column]).ljust(widths[column]) for column in columns)
+        )
+
+
+def parse_pipelines(specs: List[str]) -> Dict[str, str]:
+    """Parses `name=pipeline` pairs, a bare pipeline is named after its position."""
+    if not specs:
+        return {"default": bench_compile_time.default_pipeline}
+    pipelines = {}
+    for i, spec in enumerate(specs):
+        name, separator, pipeline = spec.partition("=")
+        if not separator or not re.fullmatch(r"\w[\w-]*", name):
+            name, pipeline = f"pipeline{i}", spec
+        if not pipeline.startswith("--pass-pipeline="):
+            pipeline = f"--pass-pipeline={pipeline}"
+        pipelines[name] = pipeline
+    return pipelines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark compile time for a matrix of models and pipelines."
+    )
+    parser.add_argument(
+        "files", nargs="*", help="TOSA models to benchmark, e.g. /home/models/bert_tosa.mlir"
+    )
+    parser.add_argument(
+        "--models",
+        type=str,
+        help="Comma-separated list of models from get_models.py, e.g. --models=bert,gpt2",
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="Benchmark all models of get_models.py."
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="append",
+        default=[],
+        help="Pipeline as name=builtin.module(...), may be given several times.",
+    )
+    parser.add_argument("--repetitions", type=int, default=10)
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Maximum number of benchmarks running at the same time.",
+    )
+    parser.add_argument(
+        "--pin-cores", action="store_true", help="Pin every job to its own core."
+    )
+    parser.add_argument(
+        "--output",
+        default="/home/results/compile_time_matrix.csv",
+        help="CSV file receiving every sample.",
+    )
+    parser.add_argument(
+        "--timing-log",
+        help="JSON lines file receiving the per-pass timing record of every run.",
+    )
+    parser.add_argument(
+        "--memory-trace",
+        action="store_true",
+        help="Sample the RSS of the tools every 10 ms for the timing log, this disturbs the timings.",
+    )
+    parser.add_argument(
+        "--bytecode",
+        action="store_true",
+        help="Benchmark the bytecode version of every model, converting it if needed.",
+    )
+    parser.add_argument(
+        "--results-db",
+        default=results_store.default_path,
+        help="SQLite results store receiving the samples, empty to not store them.",
+    )
+    args = parser.parse_args()
+
+    models = list(args.files)
+    if args.all:
+        models += [f"{model_dir}/{name}_tosa.mlir" for name in MODEL_URLS]
+    elif args.models:
+        models += [f"{model_dir}/{name}_tosa.mlir" for name in args.models.split(",")]
+    if not models:
+        print("Please specify models, --models or --all")
+        return
+    for model in models:
+        if not os.path.isfile(model):
+            raise FileNotFoundError(f"Error: {model} is not a valid file.")
+    models = [os.path.abspath(model) for model in models]
+    if args.bytecode:
+        # Converted once up front, not by concurrent jobs
+        models = [bench_compile_time.bytecode_payload(model) for model in models]
+
+    pipelines = parse_pipelines(args.pipeline)
+    jobs = [
+        (model, name, pipeline, repetition)
+        for repetition in range(args.repetitions)
+        for model in models
+        for name, pipeline in pipelines.items()
+    ]
+    if args.pin_cores:
+        args.jobs = min(args.jobs, len(os.sched_getaffinity(0)))
+
+    worker_ids = multiprocessing.Queue()
+    for worker_id in range(args.jobs):
+        worker_ids.put(worker_id)
+    with ProcessPoolExecutor(
+        max_workers=args.jobs,
+        initializer=init_worker,
+        initargs=(worker_ids, args.pin_cores, args.timing_log, args.memory_trace),
+    ) as pool:
+        results = [result for result in pool.map(run_job, jobs) if result is not None]
+    if not results:
+        print("No job succeeded, nothing to write.")
+        return
+
+    with open(args.output, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+
+    store = results_store.open_store(args.results_db) if args.results_db else None
+    if store is not None:
+        store_results(store, results, pipelines)
+        print(f"Stored results of revision {store.revision} in {args.results_db}")
+
+    print_table(summarize(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+from __future__ import annotations
+import argparse
+import csv
+import math
+import os
+import re
+from statistics import median
+import subprocess
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from bench_compile_time import (
+    default_pipeline,
+    extract_transform_script,
+    parse_time_taken,
+    read_timing_record,
+)
+from proc_monitor import run_monitored
+from scratch import Scratch
+
+mlir_opt = "/home/lib/llvm-project/build/bin/mlir-opt"
+mlir_transform_opt = "/home/lib/llvm-project/build/bin/mlir-transform-opt"
+
+# TOSA ops whose syntax is stable across LLVM versions, lowered by the default
+# pipeline like the ops of the models.
+default_seed = """module {
+  func.func @seed(%arg0: tensor<1x16x16xf32>, %arg1: tensor<1x16x16xf32>) -> tensor<1x16x16xf32> {
+    %0 = tosa.add %arg0, %arg1 : (tensor<1x16x16xf32>, tensor<1x16x16xf32>) -> tensor<1x16x16xf32>
+    %1 = tosa.sub %0, %arg1 : (tensor<1x16x16xf32>, tensor<1x16x16xf32>) -> tensor<1x16x16xf32>
+    %2 = tosa.maximum %1, %arg0 : (tensor<1x16x16xf32>, tensor<1x16x16xf32>) -> tensor<1x16x16xf32>
+    %3 = tosa.exp %2 : (tensor<1x16x16xf32>) -> tensor<1x16x16xf32>
+    %4 = tosa.tanh %3 : (tensor<1x16x16xf32>) -> tensor<1x16x16xf32>
+    %5 = tosa.abs %4 : (tensor<1x16x16xf32>) -> tensor<1x16x16xf32>
+    return %5 : tensor<1x16x16xf32>
+  }
+}
+"""
+
+
+def module_body(seed: str) -> str:
+    """Returns the ops of the top-level module of `seed`."""
+    lines = seed.strip().splitlines()
+    if lines and lines[0].startswith("module") and lines[-1].strip() == "}":
+        return "\n".join(lines[1:-1])
+    return "\n".join(lines)
+
+
+def count_ops(seed: str) -> int:
+    """Number of ops in `seed` without the module, counted by mlir-opt."""
+    try:
+        result = subprocess.run(
+            [mlir_opt, "--print-op-stats", "-o", os.devnull],
+            input=seed,
+            capture_output=True,
+            text=True,
+        )
+        errors = result.stderr
+    except OSError:
+        errors = ""
+    counts = re.findall(r"^\s*([\w.]+)\s*,\s*(\d+)\s*$", errors, re.MULTILINE)
+    if counts:
+        return sum(int(count) for name, count in counts if name != "builtin.module")
+    # Without mlir-opt every line with an op or a function counts
+    return sum(
+        1
+        for line in module_body(seed).splitlines()
+        if re.match(r"\s*(%[\w:, %#]+=\s*)?[a-z_]+\.[\w.]+|\s*return\b", line)
+    )
+
+
+def replicate(seed: str, copies: int) -> Iterator[str]:
+    """Generates a payload with `copies` renamed copies of the functions in
+    `seed`, one copy at a time."""
+    body = module_body(seed)
+    names = re.findall(r"func\.func\s+(?:private\s+)?@([\w$.]+)", body)
+    symbols = re.compile(r"@(" + "|".join(map(re.escape, names)) + r")\b")
+    yield "module {\n"
+    for copy in range(copies):
+        yield symbols.sub(lambda match: f"@{match.group(1)}_{copy}", body) + "\n"
+    yield "}\n"
+
+
+def run_measured(
+    command: List[str], scratch: Scratch, timeout: int = 3600
+) -> Tuple[str, Optional[dict], int]:
+    """Runs a tool and returns its stderr, timing record and peak RSS in KiB.
+
+    Stdout is discarded, it is the transformed payload.
+    """
+    timing_file = scratch.path("timing.json")
+    if os.path.exists(timing_file):
+        os.remove(timing_file)
+    returncode, _, errors, memory = run_monitored(
+        command,
+        timeout=timeout,
+        discard_output=True,
+        pass_fds=scratch.fds,
+        env=dict(os.environ, MLIR_TIMING_JSON=timing_file),
+    )
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, stderr=errors)
+    return errors, read_timing_record(timing_file), memory["peak_rss_kb"]
+
+
+def tool_time(command: List[str], errors: str, record: Optional[dict]) -> float:
+    """Returns the time a tool reported, raises `RuntimeError` if it has none."""
+    if record is not None and "total" in record:
+        return record["total"]
+    time = parse_time_taken(errors)
+    if time is None:
+        raise RuntimeError(
+            f"{os.path.basename(command[0])} reported no time, is it built with "
+            f"patches/timing_json.patch?\n{errors}"
+        )
+    return time
+
+
+def measure_size(
+    seed: str, copies: int, transform_script: str, pipeline: str, repetitions: int
+) -> Dict[str, float]:
+    """Measures both approaches on `copies` copies of `seed`.
+
+    The payload is streamed into the scratch space copy by copy, this process
+    does not grow with it. The peaks are those of the tools alone, see
+    `run_monitored`.
+    """
+    mlir_times, transform_times = [], []
+    mlir_peaks, transform_peaks = [], []
+    with Scratch() as scratch:
+        payload_file = scratch.write_parts("payload.mlir", replicate(seed, copies))
+        script_file = scratch.write(
+            "transform_script.mlir",
+            "module attributes {transform.with_named_sequence} {\n"
+            + transform_script
+            + "}\n",
+        )
+        for _ in range(repetitions):
+            command = [mlir_opt, payload_file, pipeline, "-o", os.devnull]
+            errors, record, peak = run_measured(command, scratch)
+            mlir_times.append(tool_time(command, errors, record))
+            mlir_peaks.append(peak)
+            command = [mlir_transform_opt, payload_file, f"--transform={script_file}"]
+            errors, record, peak = run_measured(command, scratch)
+            transform_times.append(tool_time(command, errors, record))
+            transform_peaks.append(peak)
+    return {
+        "mlir_time": median(mlir_times),
+        "transform_time": median(transform_times),
+        "mlir_peak_mb": max(mlir_peaks) / 1024,
+        "transform_peak_mb": max(transform_peaks) / 1024,
+    }
+
+
+def fit_exponent(sizes: List[float], values: List[float]) -> float:
+    """Least squares slope of log(value) over log(size): value ~ size^slope."""
+    points = [(math.log(s), math.log(v)) for s, v in zip(sizes, values) if v > 0]
+    if len(points) < 2:
+        return float("nan")
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    return covariance / variance if variance else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure how compile time and memory of both approaches scale with the IR size."
+    )
+    parser.add_argument(
+        "--seed",
+        help="MLIR file with TOSA functions to replicate, defaults to a chain of elementwise ops.",
+    )
+    parser.add_argument(
+        "--sizes",
+        default="1e3,1e4,1e5,1e6",
+        help="Comma-separated numbers of ops of the generated payloads.",
+    )
+    parser.add_argument(
+        "--pipeline",
+        default=default_pipeline,
+        help="Pass pipeline, the transform script is extracted from it.",
+    )
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument(
+        "--output",
+        default="/home/results/compile_time_scaling.csv",
+        help="CSV file receiving one row per size.",
+    )
+    args = parser.parse_args()
+
+    seed = default_seed
+    if args.seed:
+        with open(args.seed, "r") as file:
+            seed = file.read()
+    pipeline = args.pipeline
+    if not pipeline.startswith("--pass-pipeline="):
+        pipeline = f"--pass-pipeline={pipeline}"
+    transform_script = extract_transform_script(pipeline)
+
+    seed_ops = count_ops(seed)
+    print(f"Seed has {seed_ops} ops")
+    rows = []
+    for size in sorted(int(float(size)) for size in args.sizes.split(",")):
+        copies = max(1, math.ceil(size / seed_ops))
+        row = {"ops": copies * seed_ops, "copies": copies}
+        row.update(
+            measure_size(seed, copies, transform_script, pipeline, args.repetitions)
+        )
+        print(
+            f"{row['ops']} ops: MLIR {row['mlir_time']:.4f} s {row['mlir_peak_mb']:.0f} MB, "
+            f"Transform {row['transform_time']:.4f} s {row['transform_peak_mb']:.0f} MB"
+        )
+        rows.append(row)
+
+    with open(args.output, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    # An exponent of 1 means linear growth with the number of ops
+    ops = [row["ops"] for row in rows]
+    for column in ["mlir_time", "transform_time", "mlir_peak_mb", "transform_peak_mb"]:
+        exponent = fit_exponent(ops, [row[column] for row in rows])
+        print(f"{column} ~ ops^{exponent:.2f}")
+
+
+if __name__ == "__main__":
+    main()
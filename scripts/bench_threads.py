@@ -0,0 +1,249 @@
+from __future__ import annotations
+import argparse
+from bisect import bisect_left, bisect_right
+import csv
+import os
+import re
+from statistics import median
+from typing import Dict, List, Tuple
+
+import bench_compile_time
+from get_models import MODEL_URLS
+from scratch import Scratch
+from timing_report import load_records
+
+model_dir = "/home/models"
+
+# Transform ops that only sequence others, their time is that of their body
+container_ops = {
+    "transform.named_sequence",
+    "transform.sequence",
+    "transform.include",
+    "transform.foreach",
+    "transform.foreach_match",
+}
+
+
+def thread_counts(cpus: int) -> List[int]:
+    """Powers of two up to `cpus`, and `cpus` itself."""
+    counts = []
+    threads = 1
+    while threads < cpus:
+        counts.append(threads)
+        threads *= 2
+    return counts + [cpus]
+
+
+def run_with_threads(
+    model: str, pipeline: str, threads: int, repetitions: int
+) -> Tuple[List[Tuple[float, float]], List[dict]]:
+    """Benchmarks `model` with both tools limited to `threads` cores.
+
+    The thread pool of the MLIR context has one thread per core the process
+    may run on, the affinity mask inherited by the tools sets its size. With
+    a single thread, threading is disabled altogether.
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    bench_compile_time.tool_options = (
+        ["--mlir-disable-threading"] if threads == 1 else []
+    )
+    with Scratch() as scratch:
+        log_file = scratch.path("threads.jsonl")
+        bench_compile_time.timing_log = log_file
+        os.sched_setaffinity(0, cpus[:threads])
+        try:
+            times = [
+                bench_compile_time.run([model, pipeline]) for _ in range(repetitions)
+            ]
+        finally:
+            os.sched_setaffinity(0, cpus)
+            bench_compile_time.tool_options = []
+            bench_compile_time.timing_log = None
+        records = load_records([log_file]) if os.path.exists(log_file) else []
+    return times, records
+
+
+def op_usage(records: List[dict]) -> Dict[str, dict]:
+    """Returns the median time and the threads used of every transform op.
+
+    An op uses the threads of all actions running while it is applied, the
+    interpreter applies one op at a time. Container ops are left out.
+    """
+    durations: Dict[str, List[float]] = {}
+    threads: Dict[str, int] = {}
+    for record in records:
+        actions = sorted(record.get("actions", []), key=lambda action: action["start"])
+        starts = [action["start"] for action in actions]
+        per_run: Dict[str, float] = {}
+        for i, action in enumerate(actions):
+            if action["kind"] != "transform" or action["name"] in container_ops:
+                continue
+            # Only the actions starting while the op is applied can be in it
+            end = action["start"] + action["duration"]
+            first = bisect_left(starts, action["start"], 0, i + 1)
+            last = bisect_right(starts, end, i)
+            used = {
+                other["thread"]
+                for other in actions[first:last]
+                if other["start"] + other["duration"] <= end
+            }
+            name = action["name"]
+            per_run[name] = per_run.get(name, 0.0) + action["duration"]
+            threads[name] = max(threads.get(name, 1), len(used))
+        for name, duration in per_run.items():
+            durations.setdefault(name, []).append(duration)
+    return {
+        name: {"time": median(times), "threads": threads[name]}
+        for name, times in durations.items()
+    }
+
+
+def serial_ops(
+    serial_records: List[dict], parallel_records: List[dict], min_share: float
+) -> List[dict]:
+    """Returns the transform ops that do not run in parallel with more threads.
+
+    Ops taking less than `min_share` of the total time are ignored.
+    """
+    parallel = op_usage(parallel_records)
+    serial = op_usage(serial_records)
+    total = sum(usage["time"] for usage in parallel.values())
+    rows = []
+    for name, usage in sorted(parallel.items(), key=lambda item: -item[1]["time"]):
+        if usage["threads"] > 1 or not total or usage["time"] / total < min_share:
+            continue
+        rows.append(
+            {
+                "name": name,
+                "time": usage["time"],
+                "share": usage["time"] / total,
+                "speedup": serial[name]["time"] / usage["time"]
+                if name in serial and usage["time"]
+                else float("nan"),
+            }
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare how both approaches scale with the number of threads."
+    )
+    parser.add_argument(
+        "files", nargs="*", help="TOSA models to benchmark, e.g. /home/models/bert_tosa.mlir"
+    )
+    parser.add_argument(
+        "--models",
+        type=str,
+        help="Comma-separated list of models from get_models.py, e.g. --models=bert,gpt2",
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="Benchmark all models of get_models.py."
+    )
+    parser.add_argument(
+        "--threads",
+        type=str,
+        help="Comma-separated thread counts, defaults to powers of two up to the number of cores.",
+    )
+    parser.add_argument("--pipeline", default=bench_compile_time.default_pipeline)
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument(
+        "--min-share",
+        type=float,
+        default=0.01,
+        help="Smallest share of the time of a transform op reported as serial.",
+    )
+    parser.add_argument(
+        "--output",
+        default="/home/results/compile_time_threads.csv",
+        help="CSV file receiving one row per model and thread count.",
+    )
+    args = parser.parse_args()
+
+    models = list(args.files)
+    if args.all:
+        models += [f"{model_dir}/{name}_tosa.mlir" for name in MODEL_URLS]
+    elif args.models:
+        models += [f"{model_dir}/{name}_tosa.mlir" for name in args.models.split(",")]
+    if not models:
+        print("Please specify models, --models or --all")
+        return
+    for model in models:
+        if not os.path.isfile(model):
+            raise FileNotFoundError(f"Error: {model} is not a valid file.")
+
+    pipeline = args.pipeline
+    if not pipeline.startswith("--pass-pipeline="):
+        pipeline = f"--pass-pipeline={pipeline}"
+    cpus = len(os.sched_getaffinity(0))
+    if args.threads:
+        counts = sorted({min(int(count), cpus) for count in args.threads.split(",")})
+    else:
+        counts = thread_counts(cpus)
+
+    rows = []
+    for model in models:
+        name = re.sub(r"_tosa\.mlir(bc)?$", "", os.path.basename(model))
+        records: Dict[int, List[dict]] = {}
+        baseline = None
+        for threads in counts:
+            try:
+                times, records[threads] = run_with_threads(
+                    model, pipeline, threads, args.repetitions
+                )
+            except Exception as e:
+                print(f"{name} {threads} threads failed: {e}")
+                continue
+            mlir_time = median(mlir for mlir, _ in times)
+            transform_time = median(transform for _, transform in times)
+            if baseline is None:
+                baseline = (mlir_time, transform_time)
+            row = {
+                "model": name,
+                "threads": threads,
+                "mlir_median": mlir_time,
+                "transform_median": transform_time,
+                "mlir_speedup": baseline[0] / mlir_time,
+                "transform_speedup": baseline[1] / transform_time,
+            }
+            print(
+                f"{name} {threads} threads: MLIR {mlir_time:.4f} s (x{row['mlir_speedup']:.2f}), "
+                f"Transform {transform_time:.4f} s (x{row['transform_speedup']:.2f})"
+            )
+            rows.append(row)
+
+        # Where the interpreter leaves cores idle
+        measured = sorted(records)
+        most = measured[-1] if measured else 1
+        if most > 1:
+            transform_records = {
+                threads: [r for r in group if r["tool"] == "mlir-transform-opt"]
+                for threads, group in records.items()
+            }
+            if not transform_records[most]:
+                print(
+                    "No timing records, apply patches/timing_json.patch "
+                    "to find serial transform ops."
+                )
+                continue
+            serial = serial_ops(
+                transform_records[measured[0]], transform_records[most], args.min_share
+            )
+            print(f"{name}: transform ops running on a single thread with {most} threads:")
+            for op in serial:
+                print(
+                    f"  {op['name']}: {op['time']:.4f} s ({100 * op['share']:.1f}%), "
+                    f"x{op['speedup']:.2f} over {measured[0]} thread(s)"
+                )
+
+    if not rows:
+        print("No run succeeded, nothing to write.")
+        return
+    with open(args.output, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
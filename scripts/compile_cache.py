@@ -0,0 +1,128 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+def content_hash(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        digest.update(part)
+        # separator, so that ("ab", "c") and ("a", "bc") hash differently
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+
+    def file(self, name: str) -> str:
+        return f"{self.path}/{name}"
+
+
+class CompileCache:
+    """Content-addressed on-disk cache of build artifacts.
+
+    Every entry is a directory `<root>/<key[:2]>/<key>` holding the cached
+    files and a `meta.json`. The modification time of `meta.json` is the last
+    use of the entry, the least recently used entries are evicted once the
+    cache grows beyond `max_bytes`. Entries are published with an atomic
+    rename, so several processes can share one cache.
+
+    The size of the cache is scanned once and then counted up with every
+    store, the entries are only listed again to evict some. Stores of other
+    processes are counted by the next scan.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 2 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.size: Optional[int] = None
+        os.makedirs(root, exist_ok=True)
+
+    def entry_path(self, key: str) -> str:
+        return f"{self.root}/{key[:2]}/{key}"
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        path = self.entry_path(key)
+        try:
+            with open(f"{path}/meta.json", "r") as f:
+                meta = json.load(f)
+            os.utime(f"{path}/meta.json")
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(path, meta)
+
+    def store(self, key: str, files: Dict[str, str], meta: dict) -> CacheEntry:
+        """Copies `files` (name -> source path) into the cache under `key`."""
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".tmp")
+        size = 0
+        for name, source in files.items():
+            shutil.copy2(source, f"{staging}/{name}")
+            size += os.path.getsize(source)
+        meta = dict(meta, size=size, created=time.time())
+        with open(f"{staging}/meta.json", "w") as f:
+            json.dump(meta, f)
+        try:
+            os.rename(staging, path)
+        except OSError:
+            # Another process stored the same key in the meantime.
+            shutil.rmtree(staging, ignore_errors=True)
+        else:
+            if self.size is None:
+                self.size = self.scan()[1]
+            else:
+                self.size += size
+            if self.size > self.max_bytes:
+                self.evict()
+        return CacheEntry(path, meta)
+
+    def scan(self) -> Tuple[List[Tuple[float, int, str]], int]:
+        """Returns the entries as (last use, size, path) and their total size."""
+        entries = []
+        total = 0
+        for bucket in os.listdir(self.root):
+            bucket_path = f"{self.root}/{bucket}"
+            if not os.path.isdir(bucket_path):
+                continue
+            for key in os.listdir(bucket_path):
+                if key.startswith(".tmp"):
+                    continue
+                try:
+                    with open(f"{bucket_path}/{key}/meta.json", "r") as f:
+                        size = json.load(f).get("size", 0)
+                    last_use = os.path.getmtime(f"{bucket_path}/{key}/meta.json")
+                except (OSError, ValueError):
+                    continue
+                entries.append((last_use, size, f"{bucket_path}/{key}"))
+                total += size
+        return entries, total
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits."""
+        entries, total = self.scan()
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        self.size = total
@@ -0,0 +1,209 @@
+from __future__ import annotations
+import glob
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Vectorizing a tile creates one vector operation over the whole tile, which
+# is unrolled when the contraction is lowered. The default is the largest
+# tile that compiled within the 20 s timeout of kernel_build.py on the
+# machines of the artifact, larger ones only run into the timeout. It depends
+# on the host and LLVM version, see --max-vector-elements.
+max_vector_elements = 1 << 16
+
+# Lower bounds of the throughput of any kernel, scalar code streaming every
+# tile from memory, for the runtime reported instead of measuring a tiling
+# the cost model considers slow.
+pessimistic_gflops = 1.0
+pessimistic_bandwidth = 5.0  # GB/s
+
+element_bytes = {"f16": 2, "bf16": 2, "f32": 4, "f64": 8, "i8": 1, "i32": 4, "i64": 8}
+
+
+def parse_size(size: str) -> int:
+    """Parses cache sizes as written in sysfs, e.g. 48K or 2048K."""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if size[-1] in units:
+        return int(size[:-1]) * units[size[-1]]
+    return int(size)
+
+
+def cache_sizes() -> Dict[int, int]:
+    """Returns the size in bytes of the data caches of the host per level."""
+    sizes = {}
+    for index in glob.glob("/sys/devices/system/cpu/cpu0/cache/index*"):
+        try:
+            with open(f"{index}/type") as f:
+                if f.read().strip() == "Instruction":
+                    continue
+            with open(f"{index}/level") as f:
+                level = int(f.read())
+            with open(f"{index}/size") as f:
+                sizes[level] = parse_size(f.read().strip())
+        except (OSError, ValueError):
+            continue
+    return sizes
+
+
+def batch_matmul_shape(script: str):
+    """Returns the loop bounds (B, M, N, K) and the element type of the
+    `linalg.batch_matmul` in the payload of `script`."""
+    match = re.search(
+        r"linalg\.batch_matmul.*ins\([^:]*:\s*memref<(\d+)x(\d+)x(\d+)x(\w+)>,"
+        r"\s*memref<\d+x\d+x(\d+)x\w+>\)",
+        script,
+    )
+    if match is None:
+        raise ValueError("No linalg.batch_matmul with static shapes found.")
+    b, m, k, element_type, n = match.groups()
+    return [int(b), int(m), int(n), int(k)], element_type
+
+
+class CostModel:
+    """Analytical estimate of a tiling of the batch matmul.
+
+    The loops of the generalized batch matmul are (b, m, n, k), tiled by the
+    parameters in `tile_parameters`, a tile size of 0 leaves a loop untiled.
+    One tile reads an A tile (b, m, k), a B tile (b, k, n) and updates a C tile
+    (b, m, n), their sum is the working set of the innermost tile loop.
+    """
+
+    def __init__(
+        self,
+        shape: List[int],
+        element_type: str = "f32",
+        caches: Optional[Dict[int, int]] = None,
+        tile_parameters: Optional[List[str]] = None,
+        vectorize_parameter: str = "do_vect",
+        max_vector_elements: int = max_vector_elements,
+    ):
+        self.shape = shape
+        self.element_bytes = element_bytes.get(element_type, 4)
+        self.caches = cache_sizes() if caches is None else caches
+        self.tile_parameters = tile_parameters or ["tile0", "tile1", "tile2", "tile3"]
+        self.vectorize_parameter = vectorize_parameter
+        self.max_vector_elements = max_vector_elements
+
+    @classmethod
+    def from_script(cls, script: str, **kwargs) -> "CostModel":
+        shape, element_type = batch_matmul_shape(script)
+        return cls(shape, element_type, **kwargs)
+
+    def estimate(self, config: dict) -> dict:
+        b, m, n, k = [
+            int(config[parameter]) or size
+            for parameter, size in zip(self.tile_parameters, self.shape)
+        ]
+        footprint = self.element_bytes * (b * m * k + b * k * n + b * m * n)
+        flops = 2 * b * m * n * k
+        # Smallest cache level holding the working set, 0 if none does
+        level = min(
+            (level for level, size in self.caches.items() if footprint <= size),
+            default=0,
+        )
+        return {
+            "footprint": footprint,
+            "intensity": flops / footprint,
+            "cache_level": level,
+            "vector_elements": b * m * n * k
+            if int(config.get(self.vectorize_parameter, 0))
+            else 0,
+        }
+
+    def screen(self, config: dict) -> Optional[Tuple[str, bool]]:
+        """Returns why `config` is not worth measuring and whether it would
+        still compile, or None if it is worth measuring.
+
+        A tile vectorizing too many elements runs into the compile timeout,
+        like an invalid configuration. A working set beyond the last level
+        cache is only slow.
+        """
+        estimate = self.estimate(config)
+        if estimate["vector_elements"] > self.max_vector_elements:
+            reason = (
+                f"vectorizing {estimate['vector_elements']} elements per tile "
+                f"exceeds {self.max_vector_elements}"
+            )
+            return reason, False
+        if self.caches and estimate["cache_level"] == 0:
+            reason = (
+                f"working set of {estimate['footprint'] >> 10} KiB per tile "
+                f"exceeds the last level cache"
+            )
+            return reason, True
+        return None
+
+    def pessimistic_runtime(self, config: dict) -> float:
+        """Returns a runtime in seconds no tiling should exceed: scalar code
+        loading the working set of every tile from memory."""
+        tiles = [
+            int(config[parameter]) or size
+            for parameter, size in zip(self.tile_parameters, self.shape)
+        ]
+        count = math.prod(
+            math.ceil(size / tile) for size, tile in zip(self.shape, tiles)
+        )
+        traffic = count * self.estimate(config)["footprint"]
+        flops = 2 * math.prod(self.shape)
+        return max(flops / pessimistic_gflops, traffic / pessimistic_bandwidth) / 1e9
+
+
+def host_peak_gflops(cores: int = 1) -> Optional[float]:
+    """Estimates the single precision peak GFLOP/s of the host from the vector
+    extensions in /proc/cpuinfo and the maximum frequency."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(
+                next(line for line in f if line.startswith(("flags", "Features")))
+                .partition(":")[2]
+                .split()
+            )
+        with open("/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq") as f:
+            ghz = int(f.read()) / 1e6
+    except (OSError, StopIteration, ValueError):
+        return None
+    # Two FMA units of 16, 8 or 4 lanes, or an SSE add and multiply unit
+    if "avx512f" in flags:
+        flops_per_cycle = 2 * 16 * 2
+    elif "avx2" in flags and "fma" in flags:
+        flops_per_cycle = 2 * 8 * 2
+    elif "asimd" in flags:
+        flops_per_cycle = 2 * 4 * 2
+    else:
+        flops_per_cycle = 2 * 4
+    return cores * ghz * flops_per_cycle
+
+
+class Roofline:
+    """Attainable GFLOP/s of the host: the compute peak, or the memory
+    bandwidth times the arithmetic intensity if that is lower. Without a
+    known peak only the achieved GFLOP/s are reported."""
+
+    def __init__(self, peak_gflops: Optional[float], bandwidth: Optional[float] = None):
+        self.peak_gflops = peak_gflops
+        # GB/s, without it only the compute roof is known
+        self.bandwidth = bandwidth
+
+    @classmethod
+    def from_host(
+        cls, peak_gflops: Optional[float] = None, bandwidth: Optional[float] = None
+    ) -> "Roofline":
+        return cls(peak_gflops or host_peak_gflops(), bandwidth)
+
+    def attainable(self, intensity: float) -> Optional[float]:
+        if self.peak_gflops is None or self.bandwidth is None:
+            return self.peak_gflops
+        return min(self.peak_gflops, self.bandwidth * intensity)
+
+    def metrics(self, shape: List[int], element_type: str, runtime: float) -> dict:
+        """Returns GFLOP/s and the fraction of the roofline of a batch matmul
+        (B, M, N, K) taking `runtime` seconds. The intensity counts every
+        element of the operands once, the traffic of a perfect tiling."""
+        b, m, n, k = shape
+        flops = 2 * b * m * n * k
+        traffic = element_bytes.get(element_type, 4) * (b * m * k + b * k * n + b * m * n)
+        metrics = {"gflops": flops / runtime / 1e9}
+        attainable = self.attainable(flops / traffic)
+        if attainable:
+            metrics["roofline_fraction"] = metrics["gflops"] / attainable
+        return metrics
@@ -0,0 +1,148 @@
+from __future__ import annotations
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+def reduced_shape(shape: List[int], tiles: List[int], fidelity: float) -> List[int]:
+    """Returns a smaller batch matmul (B, M, N, K) doing about `fidelity` of the work.
+
+    The batch is reduced first, then K. M and N keep their size, so the tiles
+    of the output and the vectorized inner loops stay the same. Reduced sizes
+    stay multiples of their tile size, tiles never get partial.
+    """
+    b, m, n, k = shape
+    step_b = tiles[0] or 1
+    step_k = tiles[3] or 1
+    new_b = max(step_b, math.floor(b * fidelity / step_b) * step_b)
+    remaining = fidelity * b / new_b
+    new_k = k
+    if remaining < 1:
+        new_k = min(k, max(step_k, round(k * remaining / step_k) * step_k))
+    return [new_b, m, n, new_k]
+
+
+value_pattern = r"%[\w.$-]+"
+batch_matmul_pattern = re.compile(
+    rf"linalg\.batch_matmul\b.*ins\(\s*({value_pattern})\s*,\s*({value_pattern})\s*:"
+    rf".*outs\(\s*({value_pattern})\s*:"
+)
+return_pattern = re.compile(rf"\breturn\s+({value_pattern})")
+
+
+def uses(value: str) -> re.Pattern:
+    return re.compile(rf"(?<![\w%$.-]){re.escape(value)}(?![\w$.-])")
+
+
+def reshape_payload(script: str, shape: List[int], new_shape: List[int]) -> str:
+    """Replaces the operand types of the batch matmul payload for `new_shape`.
+
+    Types are replaced by the operand they belong to, not by their text, as
+    operands of shapes with equal dimensions have the same type: on the line
+    of the batch matmul by position, in the function signature by argument
+    and result, and on other lines by the operand they use.
+    """
+    b, m, n, k = shape
+    new_b, new_m, new_n, new_k = new_shape
+    match = batch_matmul_pattern.search(script)
+    if match is None:
+        raise ValueError("No linalg.batch_matmul with ins and outs found.")
+    # The (B, M, K), (B, K, N) and (B, M, N) memrefs of A, B and C
+    old_dims = [(b, m, k), (b, k, n), (b, m, n)]
+    new_dims = [(new_b, new_m, new_k), (new_b, new_k, new_n), (new_b, new_m, new_n)]
+    type_pattern = re.compile(
+        r"memref<("
+        + "|".join(re.escape("x".join(map(str, dims))) for dims in set(old_dims))
+        + r")x(\w+)>"
+    )
+
+    def retype(text: str, operand: int) -> str:
+        dims = "x".join(map(str, new_dims[operand]))
+        return type_pattern.sub(lambda type: f"memref<{dims}x{type.group(2)}>", text)
+
+    operands = {value: i for i, value in enumerate(match.groups())}
+    returned = return_pattern.search(script)
+    result_operand = operands.get(returned.group(1), 2) if returned else 2
+    lines = []
+    for line in script.splitlines(keepends=True):
+        if batch_matmul_pattern.search(line):
+            types = iter(range(3))
+            line = type_pattern.sub(
+                lambda type: retype(type.group(0), next(types, 2)), line
+            )
+        elif "func.func" in line and any(uses(v).search(line) for v in operands):
+            arguments, arrow, results = line.partition("->")
+            for value, i in operands.items():
+                arguments = re.sub(
+                    rf"({re.escape(value)}\s*:\s*)(memref<[^>]*>)",
+                    lambda type: type.group(1) + retype(type.group(2), i),
+                    arguments,
+                )
+            line = arguments + arrow + retype(results, result_operand)
+        else:
+            used = [i for value, i in operands.items() if uses(value).search(line)]
+            if len(used) == 1:
+                line = retype(line, used[0])
+        lines.append(line)
+    return "".join(lines)
+
+
+class MultiFidelity:
+    """Successive halving over reduced problem sizes.
+
+    Every batch of configurations is measured at the lowest fidelity first.
+    Only the `promote` fraction with the best extrapolated runtime goes on to
+    the next fidelity and finally to the full problem, the others keep their
+    extrapolated runtime.
+    """
+
+    def __init__(
+        self,
+        shape: List[int],
+        fidelities: List[float],
+        promote: float = 0.5,
+        tile_parameters: Optional[List[str]] = None,
+    ):
+        self.shape = shape
+        self.fidelities = sorted(fidelity for fidelity in fidelities if fidelity < 1)
+        self.promote = promote
+        self.tile_parameters = tile_parameters or ["tile0", "tile1", "tile2", "tile3"]
+
+    def reduced_shape(self, config: dict, fidelity: float) -> List[int]:
+        tiles = [int(config[parameter]) for parameter in self.tile_parameters]
+        return reduced_shape(self.shape, tiles, fidelity)
+
+    def reducible(self, config: dict, fidelity: float) -> bool:
+        """Whether the tiles of `config` allow a smaller problem at `fidelity`,
+        e.g. a tile of the whole batch and K does not. Such configurations
+        skip the reduced rounds."""
+        return self.reduced_shape(config, fidelity) != self.shape
+
+    def reduce(
+        self, script: str, config: dict, fidelity: float
+    ) -> Tuple[str, List[str], float]:
+        """Returns the script and the harness arguments of the reduced problem,
+        and the fraction of the work it does.
+
+        Raises `ValueError` if the configuration is not `reducible`.
+        """
+        new_shape = self.reduced_shape(config, fidelity)
+        if new_shape == self.shape:
+            raise ValueError(f"{config} cannot be reduced to fidelity {fidelity}")
+        work = math.prod(new_shape) / math.prod(self.shape)
+        return (
+            reshape_payload(script, self.shape, new_shape),
+            [f"--shape={','.join(map(str, new_shape))}"],
+            work,
+        )
+
+    def promoted(self, results: Dict[int, dict]) -> List[int]:
+        """Returns the keys of the results promoted to the next fidelity."""
+        valid = [key for key, result in results.items() if result["Valid"]]
+        valid.sort(key=lambda key: extrapolate(results[key])["runtime"])
+        return valid[: math.ceil(len(valid) * self.promote)]
+
+
+def extrapolate(result: dict) -> dict:
+    """Scales the runtime of a reduced problem to the full one."""
+    return dict(result, runtime=result["runtime"] / result.get("fidelity", 1.0))
@@ -1,7 +1,11 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import requests
 import os
+import shutil
 import subprocess
+import sys
 
 # URLs for downloading models
 MODEL_URLS = {
@@ -13,8 +17,12 @@ MODEL_URLS = {
 }
 flatbuffer_translate = "/home/lib/tensorflow/bazel-bin/tensorflow/compiler/mlir/lite/flatbuffer_translate"
 tf_opt = "/home/lib/tensorflow/bazel-bin/tensorflow/compiler/mlir/tf-opt"
+mlir_opt = "/home/lib/llvm-project/build/bin/mlir-opt"
+model_dir = "/home/models"
+chunk_size = 1 << 20
 
 def run_command(command, output_file=None, cwd=None):
+    """Runs `command`, returns whether it succeeded."""
     try:
         if output_file:
             with open(output_file, 'w') as f:
@@ -24,47 +32,145 @@ def run_command(command, output_file=None, cwd=None):
     except subprocess.CalledProcessError as e:
         print(f"Error occurred while executing: {command}")
         print(e.stderr)
+        return False
+    return True
+
+# Every output is stamped with a key of what it was made from, in a file next
+# to it. A stage whose key matches the stamp of its output is skipped.
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def tool_fingerprint(tool):
+    # Size and modification time, hashing the tools themselves takes too long
+    try:
+        stat = os.stat(tool)
+    except OSError:
+        return f"{tool}:missing"
+    return f"{tool}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def stage_key(input_file, tool):
+    return hashlib.sha256(f"{file_hash(input_file)}\n{tool_fingerprint(tool)}".encode()).hexdigest()
+
+def is_current(output_file, key):
+    try:
+        with open(output_file + ".stamp") as f:
+            return os.path.exists(output_file) and f.read() == key
+    except OSError:
+        return False
+
+def stamp(output_file, key):
+    with open(output_file + ".stamp", 'w') as f:
+        f.write(key)
+
+def run_stage(name, command, input_file, output_file, tool, force=False, redirect=True):
+    """Runs one conversion stage unless its output is current.
+
+    The output of `command` is redirected to `output_file`, unless `redirect`
+    is False and the command writes it itself.
+    """
+    key = stage_key(input_file, tool)
+    if not force and is_current(output_file, key):
+        print(f"{os.path.basename(output_file)} is up to date, skipping {name}.")
+        return True
+    if not run_command(command, cwd=model_dir, output_file=output_file if redirect else None):
+        return False
+    stamp(output_file, key)
+    return True
 
 def get_bert():
     # Exported according to https://huggingface.co/docs/transformers/tflite
     command_save_bert = ["optimum-cli", "export", "tflite", "--model", "google-bert/bert-base-uncased", "--sequence_length", "128", "bert_tflite"]
-    run_command(command_save_bert, cwd="/home/models")
+    exported = run_command(command_save_bert, cwd="/home/models")
 
     command_copy_model_file = ["cp", "/home/models/bert_tflite/model.tflite", "/home/models/bert.tflite"]
-    run_command(command_copy_model_file, cwd="/home/models")
+    copied = exported and run_command(command_copy_model_file, cwd="/home/models")
 
     remove_tmp_folder = ["rm", "-r", "/home/models/bert_tflite"]
     run_command(remove_tmp_folder, cwd="/home/models")
+    return copied
+
+def stream_to_file(url: str, file_location: str):
+    """Streams `url` to `file_location` in chunks, returns whether it succeeded.
+
+    The download goes to a .part file first, an interrupted download is
+    resumed from there if the server supports range requests.
+    """
+    part = file_location + ".part"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with requests.get(url, headers=headers, stream=True) as response:
+        if response.status_code not in (200, 206):
+            return False
+        # 200 instead of 206 means the server sends the whole file again
+        with open(part, "ab" if response.status_code == 206 else "wb") as model_file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                model_file.write(chunk)
+    os.replace(part, file_location)
+    return True
+
+def download_model(model_name: str, url: str, file_location: str, force=False):
+    """Downloads the specified model, or copies it if `url` is a local file."""
+    if os.path.isfile(url):
+        key = file_hash(url)
+        if force or not is_current(file_location, key):
+            shutil.copyfile(url, file_location)
+            stamp(file_location, key)
+            print(f"Copied {model_name} from {url}.")
+        return True
+
+    if not force and is_current(file_location, url):
+        print(f"{model_name} is already downloaded.")
+        return True
 
-def download_model(model_name: str, url: str, file_location: str):
-    """Downloads the specified model."""
     if model_name == "bert":
-        get_bert()
+        if not get_bert():
+            return False
+        stamp(file_location, url)
         print(f"Downloaded {model_name} successfully.")
-        return
-
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(file_location, "wb") as model_file:
-            model_file.write(response.content)
-            if model_name == "mobile-bert":
-                # Mobile Bert model is in a zip file so requires extraction:
-                run_command(['tar', '-xzf', file_location], cwd="/home/models")
-                os.remove(file_location)
-                run_command(['mv', "1.tflite", file_location], cwd="/home/models")
-
+        return True
+
+    if stream_to_file(url, file_location):
+        if model_name == "mobile-bert":
+            # Mobile Bert model is in a zip file so requires extraction:
+            run_command(['tar', '-xzf', file_location], cwd="/home/models")
+            os.remove(file_location)
+            run_command(['mv', "1.tflite", file_location], cwd="/home/models")
+        stamp(file_location, url)
         print(f"Downloaded {model_name} successfully.")
+        return True
 
-    else:
-        print(f"Error downloading {model_name}, check your internet connection and the URL: {MODEL_URLS[model_name]}")
+    print(f"Error downloading {model_name}, check your internet connection and the URL: {url}")
+    return False
 
-def convert_model(model_name: str, file_location: str):
+def convert_model(model_name: str, file_location: str, force=False):
     print(f"converting flatbuffer model to tosa mlir dialect: {model_name}")
+    tflite_mlir = f"{model_dir}/{model_name}_tflite.mlir"
     command_flatbuffer_convert = [flatbuffer_translate, "--tflite-flatbuffer-to-mlir", file_location]
-    run_command(command_flatbuffer_convert, cwd="/home/models", output_file=f"/home/models/{model_name}_tflite.mlir")
+    if not run_stage("flatbuffer_translate", command_flatbuffer_convert, file_location, tflite_mlir, flatbuffer_translate, force):
+        return False
+
+    tosa_mlir = f"{model_dir}/{model_name}_tosa.mlir"
+    command_tf_to_tosa = [tf_opt, "--tfl-to-tosa-pipeline", tflite_mlir]
+    if not run_stage("tf-opt", command_tf_to_tosa, tflite_mlir, tosa_mlir, tf_opt, force):
+        return False
 
-    command_tf_to_tosa = [tf_opt, "--tfl-to-tosa-pipeline", f"/home/models/{model_name}_tflite.mlir"]
-    run_command(command_tf_to_tosa, cwd="/home/models", output_file=f"/home/models/{model_name}_tosa.mlir")
+    # Bytecode loads much faster than the textual format in the benchmarks
+    tosa_mlirbc = f"{model_dir}/{model_name}_tosa.mlirbc"
+    command_emit_bytecode = [mlir_opt, tosa_mlir, "--emit-bytecode", "-o", tosa_mlirbc]
+    return run_stage("mlir-opt --emit-bytecode", command_emit_bytecode, tosa_mlir, tosa_mlirbc, mlir_opt, force, redirect=False)
+
+def prepare_model(job):
+    """Downloads and converts one model, runs in a worker process."""
+    model_name, source, force = job
+    file_location = f"{model_dir}/{model_name}.tflite"
+    success = download_model(model_name, source, file_location, force) and convert_model(model_name, file_location, force)
+    # Worker processes may exit without flushing their output
+    sys.stdout.flush()
+    return model_name, success
 
 
 def main():
@@ -79,6 +185,23 @@ def main():
         type=str, 
         help="Comma-separated list of models to download. E.g., --models=bert,squeezenet"
     )
+    parser.add_argument(
+        "--source",
+        action="append",
+        default=[],
+        help="Local file or URL to use for a model instead of its default URL, e.g. --source=gpt2=/data/gpt2.tflite. May be given several times, models not in the list are added."
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of models downloaded and converted at the same time."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Download and convert again even if the outputs are up to date."
+    )
 
     args = parser.parse_args()
 
@@ -86,18 +209,30 @@ def main():
         print("Please specify either --all or --models option")
         return
 
+    sources = dict(MODEL_URLS)
+    for source in args.source:
+        model_name, _, location = source.partition("=")
+        sources[model_name] = os.path.abspath(location) if os.path.exists(location) else location
+
     if args.all:
-        models_to_download = MODEL_URLS.keys()
+        models_to_download = list(sources.keys())
     else:
         models_to_download = args.models.split(",")
 
+    jobs = []
     for model_name in models_to_download:
-        file_location = f"/home/models/{model_name}.tflite"
-        if model_name in MODEL_URLS:
-            download_model(model_name, MODEL_URLS[model_name], file_location)
-            convert_model(model_name, file_location)
+        if model_name in sources:
+            jobs.append((model_name, sources[model_name], args.force))
         else:
             print(f"Model {model_name} is not available.")
 
+    # Every model is downloaded and converted in its own process, so the
+    # conversion of one overlaps with the download of another.
+    os.makedirs(model_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(jobs)))) as pool:
+        for model_name, success in pool.map(prepare_model, jobs):
+            if not success:
+                print(f"Preparing {model_name} failed.")
+
 if __name__ == "__main__":
     main()
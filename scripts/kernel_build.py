@@ -0,0 +1,305 @@
+from __future__ import annotations
+from contextlib import nullcontext
+from functools import lru_cache
+import os
+import shutil
+import subprocess
+from typing import Dict, List, Optional
+
+from batch_specialize import batched_script, split_lowered
+from compile_cache import CompileCache, content_hash, file_hash
+from proc_monitor import run_monitored
+
+# Mirrors the toolchain and flags of `add_mlir_target` in
+# lib/Performance_Exploration/CMakeLists.txt so that a build driven from here
+# produces the same binary as `make search_batch_matmul`.
+dir = "/home/lib/Performance_Exploration"
+mlir_path = "/home/lib/llvm-project/build"
+mlir_lib_path = f"{mlir_path}/lib"
+c_compiler = "clang-18"
+c_flags = [
+    "-ffp-contract=off",
+    "-fopenmp",
+    "-fopenmp-extensions",
+    "-I/usr/lib/llvm-18/lib/clang/18/include",
+    "-Wall",
+    "-O3",
+    "-fPIC",
+]
+link_flags = [
+    "-fopenmp",
+    "-L/usr/lib/llvm-18/lib",
+    f"-L{mlir_lib_path}",
+    "-lmlir_runner_utils",
+    "-lmlir_c_runner_utils",
+    "-lblas",
+    "-lm",
+    f"-Wl,-rpath,{mlir_lib_path}",
+]
+timeout = 20  # seconds, same as TIMEOUT in CMakeLists.txt
+# seconds for a batched specialization, see `specialize_batch`
+batch_timeout = 2 * timeout
+
+
+def run_stage(
+    command: List[str],
+    output_file: Optional[str] = None,
+    limit=None,
+    memory: Optional[Dict[str, dict]] = None,
+):
+    """Runs one step of the compile chain, redirecting stdout to `output_file`.
+
+    The peak RSS and page faults of the step are stored in `memory` under the
+    name of the tool, see proc_monitor.py. Raises
+    `subprocess.CalledProcessError` or `subprocess.TimeoutExpired`.
+    """
+    with open(output_file, "w") if output_file else nullcontext() as f:
+        returncode, _, _, usage = run_monitored(
+            command, timeout=limit, stdout=f, stderr=None
+        )
+    if usage["timed_out"]:
+        raise subprocess.TimeoutExpired(command, limit)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    if memory is not None:
+        del usage["rss_trace"], usage["timed_out"]
+        memory[os.path.basename(command[0])] = usage
+
+
+@lru_cache(maxsize=None)
+def toolchain_fingerprint() -> str:
+    """Identifies the tools and flags a build depends on, part of every cache key."""
+    versions = []
+    for tool in [
+        f"{mlir_path}/bin/mlir-transform-opt",
+        f"{mlir_path}/bin/mlir-opt",
+        f"{mlir_path}/bin/mlir-translate",
+        c_compiler,
+    ]:
+        try:
+            versions.append(
+                subprocess.run(
+                    [tool, "--version"], capture_output=True, text=True
+                ).stdout
+            )
+        except OSError:
+            versions.append(f"{tool} not found")
+    return content_hash(*versions, *c_flags, *link_flags)
+
+
+class KernelBuild:
+    """A build directory for the search harness.
+
+    Every instance owns its directory, so several of them can compile
+    different specialized scripts at the same time.
+    """
+
+    def __init__(
+        self,
+        build_dir: str,
+        target: str = "search_batch_matmul",
+        cache: Optional[CompileCache] = None,
+        shared: bool = False,
+    ):
+        self.build_dir = build_dir
+        self.target = target
+        self.source_c = f"{dir}/{target}.c"
+        self.harness_sources = [
+            self.source_c,
+            f"{dir}/measure.h",
+            f"{dir}/perf_counters.h",
+        ]
+        self.cache = cache
+        # Build shared objects for the measurement server instead of executables
+        self.shared = shared
+        # Peak RSS and page faults of every step of the last compile, by tool
+        self.compile_memory: Dict[str, dict] = {}
+        self.batch_memory: Dict[str, dict] = {}
+        os.makedirs(build_dir, exist_ok=True)
+
+    def config_key(self, specialized_script: str, *harness_args: str) -> str:
+        """Cache key of the executable built from `specialized_script` and
+        its measurement with `harness_args`."""
+        return content_hash(
+            "shared-object" if self.shared else "executable",
+            toolchain_fingerprint(),
+            *(file_hash(source) for source in self.harness_sources),
+            specialized_script,
+            *harness_args,
+        )
+
+    def cached_stage(self, stage: str, input_file: str, output_file: str, run):
+        """Runs `run()` to produce `output_file` unless a cached copy exists.
+
+        The key is the content of `input_file`, so configurations that lower
+        to identical IR share the result of the expensive later stages.
+        """
+        if self.cache is None:
+            run()
+            return
+        key = content_hash(stage, toolchain_fingerprint(), file_hash(input_file))
+        entry = self.cache.lookup(key)
+        if entry is not None:
+            shutil.copyfile(entry.file("output"), output_file)
+            return
+        run()
+        self.cache.store(key, {"output": output_file}, {"stage": stage})
+
+    def path(self, suffix: str) -> str:
+        return f"{self.build_dir}/{self.target}{suffix}"
+
+    def harness_object(self) -> str:
+        # The C harness does not depend on the configuration, compile it once.
+        harness_o = self.path(".c.o")
+        if not os.path.exists(harness_o) or os.path.getmtime(harness_o) < max(
+            os.path.getmtime(source) for source in self.harness_sources
+        ):
+            run_stage([c_compiler, *c_flags, "-c", self.source_c, "-o", harness_o])
+        return harness_o
+
+    def measure_server(self) -> str:
+        """Builds the harness as measurement server, see `measure_server.py`."""
+        server = self.path("_server")
+        if not os.path.exists(server) or os.path.getmtime(server) < max(
+            os.path.getmtime(source) for source in self.harness_sources
+        ):
+            run_stage(
+                [
+                    c_compiler,
+                    *c_flags,
+                    "-DMEASURE_SERVER",
+                    self.source_c,
+                    *link_flags,
+                    "-ldl",
+                    "-o",
+                    server,
+                ]
+            )
+        return server
+
+    def specialize_batch(self, specialized_scripts: List[str]) -> List[Optional[str]]:
+        """Applies several specialized scripts in one mlir-transform-opt run
+        and returns the lowered module of each, see `batch_specialize.py`.
+
+        Parsing and tool startup are paid once for the batch. If the batch
+        fails as a whole, e.g. because one script does not verify, or times
+        out, all modules are None and `compile` specializes them one by one.
+        The batch gets at most `batch_timeout`, so that one hanging candidate
+        does not cost the timeout of every candidate before its own.
+        """
+        script = f"{self.build_dir}/batched_transform.mlir"
+        try:
+            with open(script, "w") as f:
+                f.write(batched_script(specialized_scripts))
+            self.batch_memory = {}
+            run_stage(
+                [f"{mlir_path}/bin/mlir-transform-opt", script],
+                self.path("_batch.llvm.mlir"),
+                min(timeout * len(specialized_scripts), batch_timeout),
+                self.batch_memory,
+            )
+            with open(self.path("_batch.llvm.mlir"), "r") as f:
+                return split_lowered(f.read(), len(specialized_scripts))
+        except (
+            OSError,
+            ValueError,
+            subprocess.CalledProcessError,
+            subprocess.TimeoutExpired,
+        ) as e:
+            print(f"Batched specialization failed, specializing one by one: {e}")
+            return [None] * len(specialized_scripts)
+
+    def compile(self, specialized_script: str, lowered: Optional[str] = None) -> str:
+        """Compiles `specialized_script` and returns the path of the executable,
+        or of the shared object for the measurement server. `lowered` is its
+        module from `specialize_batch`, if there is one."""
+        script = f"{self.build_dir}/specialized_transform.mlir"
+        with open(script, "w") as f:
+            f.write(specialized_script)
+
+        # A batched specialization shares the mlir-transform-opt run
+        memory = {} if lowered is None else dict(self.batch_memory)
+        self.compile_memory = memory
+        if lowered is None:
+            run_stage(
+                [f"{mlir_path}/bin/mlir-transform-opt", script],
+                self.path("_tmp.llvm.mlir"),
+                timeout,
+                memory,
+            )
+        else:
+            with open(self.path("_tmp.llvm.mlir"), "w") as f:
+                f.write(lowered)
+        run_stage(
+            [
+                f"{mlir_path}/bin/mlir-opt",
+                self.path("_tmp.llvm.mlir"),
+                "--test-transform-dialect-erase-schedule",
+            ],
+            self.path(".llvm.mlir"),
+            memory=memory,
+        )
+        self.cached_stage(
+            "mlir-translate",
+            self.path(".llvm.mlir"),
+            self.path(".mlir.ll"),
+            lambda: run_stage(
+                [
+                    f"{mlir_path}/bin/mlir-translate",
+                    "--mlir-to-llvmir",
+                    self.path(".llvm.mlir"),
+                ],
+                self.path(".mlir.ll"),
+                memory=memory,
+            ),
+        )
+        pic_flags = ["-fPIC"] if self.shared else []
+        self.cached_stage(
+            "clang-pic" if self.shared else "clang",
+            self.path(".mlir.ll"),
+            self.path(".mlir.ll.o"),
+            lambda: run_stage(
+                [
+                    c_compiler,
+                    "-O3",
+                    *pic_flags,
+                    "-c",
+                    self.path(".mlir.ll"),
+                    "-o",
+                    self.path(".mlir.ll.o"),
+                ],
+                limit=timeout,
+                memory=memory,
+            ),
+        )
+        if self.shared:
+            # Link to a new file and rename it, the server may still map the
+            # previous kernel and dlopen must not mistake the new one for it.
+            shared_object = self.path(".so")
+            run_stage(
+                [
+                    c_compiler,
+                    "-shared",
+                    self.path(".mlir.ll.o"),
+                    *link_flags,
+                    "-o",
+                    shared_object + ".tmp",
+                ],
+                memory=memory,
+            )
+            os.replace(shared_object + ".tmp", shared_object)
+            return shared_object
+
+        executable = self.path("")
+        run_stage(
+            [
+                c_compiler,
+                self.harness_object(),
+                self.path(".mlir.ll.o"),
+                *link_flags,
+                "-o",
+                executable,
+            ],
+            memory=memory,
+        )
+        return executable
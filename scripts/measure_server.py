@@ -0,0 +1,116 @@
+from __future__ import annotations
+import os
+import select
+import subprocess
+import time
+from typing import List, Optional
+
+from proc_monitor import page_faults, peak_rss, reset_peak
+
+
+class MeasureServer:
+    """Long-lived harness process that measures kernels loaded with dlopen.
+
+    The server is the search harness built with -DMEASURE_SERVER. It allocates
+    and initializes the inputs once and then measures one shared object per
+    request, so candidates skip linking, process startup and input setup, and
+    all of them run in the same process. A kernel that crashes takes the
+    server down, one that does not answer within `timeout` seconds is killed
+    with it, the server is restarted with the next request.
+    """
+
+    def __init__(
+        self,
+        executable: str,
+        harness_args: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.executable = executable
+        self.harness_args = harness_args or []
+        self.timeout = timeout
+        self.process: Optional[subprocess.Popen] = None
+        # Memory usage of the server during the last request
+        self.memory: dict = {}
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [self.executable, *self.harness_args],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0,
+        )
+
+    def read_line(self, command: List[str]) -> str:
+        """Reads the answer to a request, "" if the server exited.
+
+        Raises `subprocess.TimeoutExpired` after killing the server if there
+        is none within the timeout.
+        """
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        fd = self.process.stdout.fileno()
+        line = b""
+        # The server answers every request with one line and waits for the
+        # next, there is nothing to read after its end.
+        while not line.endswith(b"\n"):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and (
+                remaining <= 0 or not select.select([fd], [], [], remaining)[0]
+            ):
+                self.kill()
+                raise subprocess.TimeoutExpired(command, self.timeout)
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            line += chunk
+        return line.decode()
+
+    def measure(
+        self, shared_object: str, harness_args: Optional[List[str]] = None
+    ) -> str:
+        """Returns the output line of the harness for `shared_object`.
+
+        Raises `subprocess.CalledProcessError` if the kernel cannot be loaded
+        or crashes, `subprocess.TimeoutExpired` if it does not return.
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        command = [shared_object, *(harness_args or [])]
+        pid = self.process.pid
+        # The peak is that of the request where the kernel allows resetting
+        # it, otherwise that of the server so far.
+        reset_peak(pid)
+        minor, major = page_faults(pid)
+        try:
+            self.process.stdin.write((" ".join(command) + "\n").encode())
+        except BrokenPipeError:
+            pass
+        line = self.read_line(command)
+        if line:
+            minor_after, major_after = page_faults(pid)
+            self.memory = {
+                "peak_rss_kb": peak_rss(pid),
+                "minor_faults": minor_after - minor,
+                "major_faults": major_after - major,
+            }
+        if not line:
+            returncode = self.process.wait()
+            self.close()
+            raise subprocess.CalledProcessError(returncode, command)
+        if line.startswith("error"):
+            raise subprocess.CalledProcessError(1, command, output=line)
+        return line
+
+    def kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process.stdin.close()
+            self.process.stdout.close()
+            self.process = None
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import csv
+import json
+import os
+import time
+from typing import List, Optional
+
+from results_store import ResultsStore
+
+# Columns after the tuning parameters
+# `estimated` rows were answered by the cost model without measuring
+fields = [
+    "search",
+    "timestamp",
+    "fidelity",
+    "runtime",
+    "Valid",
+    "censored",
+    "estimated",
+]
+# Memory usage of the kernel run and the largest peak RSS of the steps that
+# compiled it, see proc_monitor.py, empty if not measured
+memory_fields = [
+    "peak_rss_kb",
+    "minor_faults",
+    "major_faults",
+    "compile_peak_rss_kb",
+]
+# Hardware counters per kernel call (harness --counters) and the achieved
+# performance, empty if not measured
+counter_fields = [
+    "cycles",
+    "instructions",
+    "l1d_misses",
+    "llc_misses",
+    "vector_instructions",
+]
+performance_fields = ["gflops", "roofline_fraction", "ipc"] + counter_fields
+
+
+class MeasurementLog:
+    """Appends every measurement of a search to a CSV file.
+
+    Unlike the output file of BACO, which holds one row per configuration it
+    asked for, this has a row per measurement, including reduced fidelities.
+    It is written as the search goes and is the checkpoint a search resumes
+    from. Rows carry the id of their search, a resumed search keeps its id.
+    Complete, not cached measurements also go to the results `store` if there
+    is one, with the configuration as JSON, to compare kernels across LLVM
+    revisions.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        parameters: List[str],
+        search: Optional[str] = None,
+        store: Optional[ResultsStore] = None,
+        model: str = "batch_matmul",
+    ):
+        self.path = path
+        self.parameters = parameters
+        self.store = store
+        self.model = model
+        self.search = search or time.strftime("%Y%m%d-%H%M%S")
+        header = parameters + fields + memory_fields + performance_fields
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "r", newline="") as f:
+                if next(csv.reader(f), None) == header:
+                    return
+            # Written with other columns, kept aside instead of mixed up
+            os.replace(path, f"{path}.{int(os.path.getmtime(path))}")
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerow(header)
+
+    def append(self, config: dict, result: dict):
+        row = [config[parameter] for parameter in self.parameters] + [
+            self.search,
+            time.time(),
+            result.get("fidelity", 1.0),
+            result["runtime"],
+            result["Valid"],
+            int(result.get("censored", False)),
+            int(result.get("estimated", False)),
+        ] + [result.get(field, "") for field in memory_fields + performance_fields]
+        with open(self.path, "a", newline="") as f:
+            csv.writer(f).writerow(row)
+        if (
+            self.store is not None
+            and result["Valid"]
+            and result.get("fidelity", 1.0) == 1.0
+            and not result.get("censored")
+            and not result.get("estimated")
+            and not result.get("cached")
+        ):
+            config = {parameter: config[parameter] for parameter in self.parameters}
+            self.store.add_run(
+                "kernel",
+                self.model,
+                json.dumps(config, sort_keys=True),
+                {
+                    # Every sample of the harness, compare needs distributions
+                    "runtime": result.get("times", [result["runtime"]]),
+                    "peak_rss_kb": [result.get("peak_rss_kb")],
+                    "compile_peak_rss_kb": [result.get("compile_peak_rss_kb")],
+                },
+            )
@@ -0,0 +1,73 @@
+from __future__ import annotations
+import time
+from typing import Dict, Union
+
+from mlir.dialects.transform import interpreter
+from mlir.ir import Context, Module
+from mlir.passmanager import PassManager
+
+
+class MlirWorker:
+    """Applies pass pipelines and transform scripts in-process.
+
+    The payload is parsed once and cloned for every application, so repeated
+    measurements neither start a new process nor re-parse the model. Every
+    application reports the clone and apply times separately, the parse time
+    is available as `parse_time`.
+    """
+
+    def __init__(self, payload: Union[str, bytes]):
+        self.context = Context()
+        self.context.allow_unregistered_dialects = True
+        start = time.perf_counter()
+        self.payload = Module.parse(payload, self.context)
+        self.parse_time = time.perf_counter() - start
+        self.pipelines: Dict[str, PassManager] = {}
+        self.scripts: Dict[str, Module] = {}
+
+    @classmethod
+    def from_file(cls, input_file: str) -> "MlirWorker":
+        # Read as bytes, so that bytecode payloads work as well.
+        with open(input_file, "rb") as file:
+            return cls(file.read())
+
+    def clone_payload(self):
+        start = time.perf_counter()
+        clone = self.payload.operation.clone()
+        return clone, time.perf_counter() - start
+
+    def run_pipeline(self, pipeline: str) -> Dict[str, float]:
+        if pipeline.startswith("--pass-pipeline="):
+            pipeline = pipeline[len("--pass-pipeline=") :]
+        if pipeline not in self.pipelines:
+            self.pipelines[pipeline] = PassManager.parse(pipeline, self.context)
+
+        clone, clone_time = self.clone_payload()
+        start = time.perf_counter()
+        self.pipelines[pipeline].run(clone)
+        apply_time = time.perf_counter() - start
+        clone.erase()
+        return {"clone": clone_time, "apply": apply_time}
+
+    def run_transform(self, transform_script: str) -> Dict[str, float]:
+        if transform_script not in self.scripts:
+            self.scripts[transform_script] = Module.parse(
+                "module attributes {transform.with_named_sequence} {\n"
+                + transform_script
+                + "}\n",
+                self.context,
+            )
+        script = self.scripts[transform_script]
+        entry_point = next(
+            op
+            for op in script.body.operations
+            if "sym_name" in op.attributes
+            and op.attributes["sym_name"].value == "__transform_main"
+        )
+
+        clone, clone_time = self.clone_payload()
+        start = time.perf_counter()
+        interpreter.apply_named_sequence(clone, entry_point, script)
+        apply_time = time.perf_counter() - start
+        clone.erase()
+        return {"clone": clone_time, "apply": apply_time}
@@ -1,14 +1,48 @@
 from __future__ import annotations
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
 from itertools import count
 import json
-import re
+import multiprocessing
+import os
 import subprocess
 import time
-from typing import Union
+from typing import List, Optional, Tuple, Union
 
 from scipy import special
 from baco import run
 
+from baco_client import run_client_server
+from compile_cache import CompileCache
+from cost_model import (
+    CostModel,
+    Roofline,
+    batch_matmul_shape,
+    max_vector_elements,
+)
+from fidelity import MultiFidelity, extrapolate
+from kernel_build import KernelBuild
+from measure_server import MeasureServer
+from measurement_log import (
+    MeasurementLog,
+    counter_fields,
+    memory_fields,
+    performance_fields,
+)
+from proc_monitor import run_monitored
+import results_store
+from shapes import parse_shape, shape_name, shape_script, shape_settings, suffixed
+from transform_template import TransformTemplate
+import tuning_db
+from warm_start import (
+    last_search,
+    load_evaluations,
+    resume_settings,
+    warm_start_configs,
+    write_settings,
+)
+
 EXPLORING = False
 if EXPLORING:
     explore = "_explore"
@@ -16,6 +50,9 @@ else:
     explore = ""
 
 dir = "/home/lib/Performance_Exploration"
+# Seconds one measurement of a kernel may take, all samples of a slow
+# configuration included, before it is killed and reported as invalid
+kernel_timeout = 120
 # dir = "/Users/martin/development/phd/papers/transform/evaluation/transform_paper_eval/openmp_comparison"
 
 
@@ -23,109 +60,788 @@ def search(settings: str, parametric_script: str):
     run.optimize(settings, parametric_script)
 
 
-def handle_dynamic_types(script: str):
+def warm_started(
+    settings: str,
+    evaluate_batch,
+    seeds: Optional[List[dict]] = None,
+    history: Optional[List[dict]] = None,
+    iterations: Optional[int] = None,
+) -> str:
+    """Evaluates the warm-start configurations `seeds` and returns settings
+    that let BACO continue from them and the `history` of a resumed search."""
+    seeds = seeds or []
+    results = evaluate_batch(seeds) if seeds else []
+    evaluations = (history or []) + [
+        dict(config, **result) for config, result in zip(seeds, results)
+    ]
+    if not evaluations and iterations is None:
+        return settings
+    return resume_settings(settings, evaluations, iterations)
 
-    lines = script.split("\n")
-    for i, line in enumerate(lines):
-        if "tile_using_for" in line:
-            num_vals = 4
-            pattern = r"\[(\d+),(\d+),(\d+),(\d+)\]"
-            # Search for the pattern in the input string
-            match = re.search(pattern, line)
-            if match:
-                # Extract the numbers and convert them to integers
-                numbers = [int(match.group(i)) for i in range(1, num_vals + 1)]
-                num_zeros = numbers.count(0)
 
-                lines[i] = (
-                    f"%tiled_op, %loops:{num_vals-num_zeros} = transform.structured.tile_using_for %matmul [{numbers[0]}, {numbers[1]}, {numbers[2]}, {numbers[3]}] : (!transform.any_op) -> (!transform.any_op, "
-                )
-                # Add the correct number of results, one for the tiled op (added above) + number of loops (here)
-                for j in range(num_vals - num_zeros):
-                    lines[i] += "!transform.any_op, "
-                lines[i] = lines[i][:-2] + ")"
-                break
+def record_best(
+    tuning: tuning_db.TuningDatabase,
+    measurement_log: str,
+    settings: dict,
+    search_id: str,
+    shape: List[int],
+    element_type: str,
+):
+    """Stores the fastest complete measurement of the search in the tuning
+    database."""
+    complete = [
+        evaluation
+        for evaluation in load_evaluations([measurement_log], settings, search_id)
+        if evaluation["Valid"]
+        and evaluation["fidelity"] == 1.0
+        and not evaluation["censored"]
+    ]
+    if not complete:
+        return
+    best = min(complete, key=lambda evaluation: evaluation["runtime"])
+    config = {name: best[name] for name in settings["input_parameters"]}
+    runtime = best["runtime"]
+    if tuning.record(tuning_db.batch_matmul, shape, element_type, config, runtime):
+        print(f"Stored {config} as tuned configuration of {shape_name(shape)}")
 
-    return "\n".join(lines)
 
+def parse_harness_output(stdout: str) -> dict:
+    # The harness prints the median runtime. In adaptive or racing mode it is
+    # followed by the confidence interval of the median, the number of samples,
+    # the number of rejected outliers and whether the run was censored, i.e.
+    # stopped early because it is slower than the incumbent. Then come all
+    # samples taken, times=t1,t2,..., and with --counters name=value pairs of
+    # hardware counters per kernel call.
+    values = [value for value in stdout.split() if "=" not in value]
+    result = {"runtime": float(values[0])}
+    for counter in stdout.split():
+        name, _, value = counter.partition("=")
+        if name == "times":
+            result["times"] = [float(sample) for sample in value.split(",")]
+        elif name in counter_fields:
+            result[name] = float(value)
+    if len(values) >= 6:
+        result["ci_low"] = float(values[1])
+        result["ci_high"] = float(values[2])
+        result["samples"] = int(values[3])
+        result["rejected"] = int(values[4])
+        result["censored"] = bool(int(values[5]))
+    return result
 
-def get_opt_fun(parametric_script: str):
-    def optimize_me(config: Union[tuple, dict[str, str]]):
-        print(config)
-        # replace the parameters in the script
-        specialized_script = parametric_script
-        for key, value in config.items():
-            specialized_script = specialized_script.replace(key, str(value))
-
-        # special case tile_using_for to set the correct number of results:
-        specialized_script = handle_dynamic_types(specialized_script)
-
-        # save script to file
-        with open(
-            f"{dir}/specialized_transform.mlir",
-            "w",
-        ) as f:
-            f.write(specialized_script)
-
-        print("saved specialized script")
-
-        # Run `make` command
-        subprocess.run(
-            [
-                "make",
-                "clean",
-                "-s",
-                "-C",
-                f"{dir}/build",
-            ],
+
+def measure(
+    executable: str,
+    measure_lock=None,
+    harness_args: Optional[List[str]] = None,
+    server: Optional[MeasureServer] = None,
+) -> dict:
+    harness_args = harness_args or []
+    # Timed runs of concurrent workers must not overlap unless they are pinned
+    # to separate cores, otherwise they disturb each other's measurements.
+    with measure_lock if measure_lock is not None else nullcontext():
+        if server is not None:
+            output = server.measure(executable, harness_args)
+            return dict(parse_harness_output(output), **server.memory)
+        command = [executable, *harness_args]
+        returncode, output, errors, memory = run_monitored(
+            command, timeout=kernel_timeout
+        )
+    if memory["timed_out"]:
+        raise subprocess.TimeoutExpired(command, kernel_timeout, output, errors)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, output, errors)
+    del memory["rss_trace"], memory["timed_out"]
+    return dict(parse_harness_output(output), **memory)
+
+
+def cached_result(
+    build: KernelBuild, specialized_script: str, harness_args: List[str]
+) -> Optional[dict]:
+    cache = build.cache
+    if cache is None:
+        return None
+    entry = cache.lookup(build.config_key(specialized_script, *harness_args))
+    if entry is None or "Valid" not in entry.meta:
+        return None
+    return {
+        "runtime": entry.meta["runtime"],
+        "Valid": entry.meta["Valid"],
+        "cached": True,
+    }
+
+
+def evaluate(
+    build: KernelBuild,
+    specialized_script: str,
+    measure_lock=None,
+    harness_args: Optional[List[str]] = None,
+    incumbent: Optional[float] = None,
+    server: Optional[MeasureServer] = None,
+    roofline: Optional[Roofline] = None,
+    lowered: Optional[str] = None,
+):
+    """Compiles and measures a configuration.
+
+    With an `incumbent` runtime the harness stops as soon as the configuration
+    is clearly slower. BACO still gets the median of the samples taken, a
+    lower bound of the real runtime that is larger than the incumbent.
+    `lowered` is the output of its transform script if it was already applied
+    in a batch.
+    """
+    harness_args = harness_args or []
+    cached = cached_result(build, specialized_script, harness_args)
+    if cached is not None:
+        print(f"cached time:{cached['runtime']}")
+        return cached
+
+    cache = build.cache
+    if cache is not None:
+        key = build.config_key(specialized_script, *harness_args)
+    try:
+        executable = build.compile(specialized_script, lowered)
+    except Exception as e:
+        if isinstance(e, subprocess.TimeoutExpired):
+            print("Timeout!")
+        elif (
+            cache is not None
+            and isinstance(e, subprocess.CalledProcessError)
+            and e.returncode > 0
+        ):
+            # Timeouts and kills, e.g. by the OOM killer, may depend on the
+            # load of the machine, errors reported by the tools do not.
+            cache.store(key, {}, {"runtime": float(0), "Valid": 0})
+        return {"runtime": float(0), "Valid": 0}
+
+    # Run the harness if the build was successful
+    race_args = [f"--incumbent={incumbent}"] if incumbent else []
+    try:
+        measurement = measure(executable, measure_lock, harness_args + race_args, server)
+    except subprocess.CalledProcessError as e:
+        print(f"Kernel failed: {e.output or e.returncode}")
+        return {"runtime": float(0), "Valid": 0}
+    except subprocess.TimeoutExpired:
+        print(f"Kernel timeout after {kernel_timeout} seconds!")
+        return {"runtime": float(0), "Valid": 0}
+    if build.compile_memory:
+        measurement["compile_peak_rss_kb"] = max(
+            usage["peak_rss_kb"] for usage in build.compile_memory.values()
+        )
+    runtime = measurement["runtime"]
+    if measurement.get("censored"):
+        print(f"time:>{runtime} (slower than incumbent {incumbent}, censored)")
+    elif "ci_low" in measurement:
+        print(
+            f"time:{runtime} (95% CI {measurement['ci_low']} - {measurement['ci_high']}, "
+            f"{measurement['samples']} samples)"
         )
+    else:
+        print(f"time:{runtime}")
+    # A censored runtime depends on the incumbent, only cache complete ones.
+    if cache is not None and not measurement.get("censored"):
+        cache.store(key, {"executable": executable}, dict(measurement, Valid=1))
+    metrics = performance_metrics(specialized_script, measurement, roofline)
+    return {
+        "runtime": runtime,
+        "Valid": 1,
+        "censored": measurement.get("censored", False),
+        "times": measurement.get("times", [runtime]),
+        **{key: measurement[key] for key in memory_fields if key in measurement},
+        **metrics,
+    }
 
+
+def performance_metrics(
+    specialized_script: str, measurement: dict, roofline: Optional[Roofline]
+) -> dict:
+    """Returns why a kernel is as fast as it is: the hardware counters of the
+    harness, IPC, and unless censored the GFLOP/s and roofline fraction."""
+    metrics = {key: measurement[key] for key in counter_fields if key in measurement}
+    if metrics.get("cycles") and "instructions" in metrics:
+        metrics["ipc"] = metrics["instructions"] / metrics["cycles"]
+    censored = measurement.get("censored")
+    if roofline is not None and not censored and measurement["runtime"] > 0:
         try:
-            make_result = subprocess.run(
-                [
-                    "make",
-                    "-s",
-                    "-C",
-                    f"{dir}/build",
-                    "search_batch_matmul",
-                ],
-                check=True,
-                # timeout=20,
-            )
-        except Exception as e:
-            if isinstance(e, subprocess.TimeoutExpired):
-                print("Timeout!")
-            return {"runtime": float(0), "Valid": 0}
-
-        # Run `./seach_batch_matmul` command if `make` was successful
-        if make_result.returncode == 0:
-            result = subprocess.run(
-                [f"{dir}/build/search_batch_matmul"],
-                check=True,
-                capture_output=True,
-                text=True,
-            )
-            runtime = result.stdout
-            print(f"time:{runtime}")
-            return {"runtime": float(runtime), "Valid": 1}
+            shape, element_type = batch_matmul_shape(specialized_script)
+            runtime = measurement["runtime"]
+            metrics.update(roofline.metrics(shape, element_type, runtime))
+        except ValueError:
+            pass  # not a batch matmul, no FLOP count
+    if metrics:
+        reported = [key for key in performance_fields if key in metrics]
+        print(" ".join(f"{key}:{metrics[key]:.4g}" for key in reported))
+    return metrics
+
+
+class Incumbent:
+    """Best complete (not censored) runtime found so far, used for racing."""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.runtime: Optional[float] = None
+
+    def get(self) -> Optional[float]:
+        return self.runtime if self.enabled else None
+
+    def update(self, result: dict):
+        # Extrapolated runtimes of reduced problems and estimated ones are no
+        # bound to race against
+        if (
+            result["Valid"]
+            and not result.get("censored")
+            and not result.get("estimated")
+            and result.get("fidelity", 1.0) == 1.0
+        ):
+            if self.runtime is None or result["runtime"] < self.runtime:
+                self.runtime = result["runtime"]
+
+
+def prescreen(cost_model: Optional[CostModel], config: dict) -> Optional[dict]:
+    """Returns the result for a configuration the cost model deems hopeless,
+    without compiling it.
+
+    Only configurations that would not compile are invalid. Slow ones get a
+    pessimistic runtime, so that BACO's feasibility predictor does not learn
+    to avoid regions that are merely slow by the model.
+    """
+    if cost_model is None:
+        return None
+    screened = cost_model.screen(config)
+    if screened is None:
+        return None
+    reason, compiles = screened
+    if not compiles:
+        print(f"{config} skipped: {reason}")
         return {"runtime": float(0), "Valid": 0}
+    runtime = cost_model.pessimistic_runtime(config)
+    print(f"{config} skipped: {reason}, estimated time:{runtime}")
+    return {"runtime": runtime, "Valid": 1, "estimated": True}
+
+
+@contextmanager
+def get_opt_fun(
+    template: TransformTemplate,
+    cache: Optional[CompileCache] = None,
+    harness_args: Optional[List[str]] = None,
+    race: bool = False,
+    use_server: bool = False,
+    cost_model: Optional[CostModel] = None,
+    log: Optional[MeasurementLog] = None,
+    history: Optional[List[dict]] = None,
+    roofline: Optional[Roofline] = None,
+):
+    harness_args = harness_args or []
+    build = KernelBuild(f"{dir}/build", cache=cache, shared=use_server)
+    server = (
+        MeasureServer(build.measure_server(), harness_args, kernel_timeout)
+        if use_server
+        else None
+    )
+    incumbent = Incumbent(race)
+    for result in history or []:
+        incumbent.update(result)
 
-        # return the result
+    def optimize_me(config: Union[tuple, dict[str, str]]):
+        skipped = prescreen(cost_model, config)
+        if skipped is not None:
+            if log is not None:
+                log.append(config, skipped)
+            return {"runtime": skipped["runtime"], "Valid": skipped["Valid"]}
+        print(config)
+        specialized_script = template.instantiate(config)
+        result = evaluate(
+            build,
+            specialized_script,
+            harness_args=harness_args,
+            incumbent=incumbent.get(),
+            server=server,
+            roofline=roofline,
+        )
+        incumbent.update(result)
+        if log is not None:
+            log.append(config, result)
+        return {"runtime": result["runtime"], "Valid": result["Valid"]}
+
+    try:
+        yield optimize_me
+    finally:
+        if server is not None:
+            server.close()
+
+
+# State of a worker process in the parallel search, set up by `init_worker`.
+worker_state = {}
+
+
+def init_worker(
+    template: TransformTemplate,
+    worker_ids,
+    measure_lock,
+    pin_cores: bool,
+    cache: Optional[CompileCache],
+    harness_args: List[str],
+    use_server: bool,
+    multi_fidelity: Optional[MultiFidelity],
+    roofline: Optional[Roofline],
+):
+    worker_id = worker_ids.get()
+    worker_state["template"] = template
+    worker_state["harness_args"] = harness_args
+    worker_state["multi_fidelity"] = multi_fidelity
+    worker_state["roofline"] = roofline
+    # Each worker gets its own build directory and specialized script.
+    build = KernelBuild(f"{dir}/build_worker{worker_id}", cache=cache, shared=use_server)
+    worker_state["build"] = build
+    if pin_cores:
+        # The worker and everything it spawns (compiler and timed runs) stay
+        # on one core, so measurements on different cores can overlap.
+        cpu = sorted(os.sched_getaffinity(0))[worker_id]
+        os.sched_setaffinity(0, {cpu})
+        worker_state["measure_lock"] = None
+    else:
+        worker_state["measure_lock"] = measure_lock
+    # Started after pinning, so the server runs on the core of its worker. It
+    # exits when its stdin is closed with the worker.
+    worker_state["server"] = (
+        MeasureServer(build.measure_server(), harness_args, kernel_timeout)
+        if use_server
+        else None
+    )
+
+
+def specialize_job(job: Tuple[dict, Optional[float], float]):
+    """Returns the specialized script, harness arguments and fraction of the
+    work of a job."""
+    config, _, fidelity = job
+    specialized_script = worker_state["template"].instantiate(config)
+    harness_args = worker_state["harness_args"]
+    work = 1.0
+    if fidelity < 1.0:
+        specialized_script, shape_args, work = worker_state["multi_fidelity"].reduce(
+            specialized_script, config, fidelity
+        )
+        harness_args = harness_args + shape_args
+    return specialized_script, harness_args, work
+
+
+def evaluate_in_worker(jobs: List[Tuple[dict, Optional[float], float]]) -> List[dict]:
+    """Evaluates a group of jobs. The transform scripts of the jobs that are
+    not cached are applied in one mlir-transform-opt run."""
+    build = worker_state["build"]
+    specialized = [specialize_job(job) for job in jobs]
+    lowered: List[Optional[str]] = [None] * len(jobs)
+    pending = [
+        i
+        for i, (specialized_script, harness_args, _) in enumerate(specialized)
+        if cached_result(build, specialized_script, harness_args) is None
+    ]
+    if len(pending) > 1:
+        modules = build.specialize_batch([specialized[i][0] for i in pending])
+        for i, module in zip(pending, modules):
+            lowered[i] = module
+
+    results = []
+    for i, (config, incumbent, fidelity) in enumerate(jobs):
+        specialized_script, harness_args, work = specialized[i]
+        print(config if fidelity == 1.0 else f"{config} at fidelity {fidelity}")
+        result = evaluate(
+            build,
+            specialized_script,
+            worker_state["measure_lock"],
+            harness_args,
+            incumbent,
+            worker_state["server"],
+            worker_state["roofline"],
+            lowered[i],
+        )
+        results.append(dict(result, fidelity=work))
+    return results
 
-    return optimize_me
+
+def parallel_search(
+    settings: str,
+    template: TransformTemplate,
+    workers: int,
+    pin_cores: bool,
+    cache: Optional[CompileCache] = None,
+    harness_args: Optional[List[str]] = None,
+    race: bool = False,
+    use_server: bool = False,
+    cost_model: Optional[CostModel] = None,
+    log: Optional[MeasurementLog] = None,
+    multi_fidelity: Optional[MultiFidelity] = None,
+    batch_size: Optional[int] = None,
+    seeds: Optional[List[dict]] = None,
+    history: Optional[List[dict]] = None,
+    iterations: Optional[int] = None,
+    roofline: Optional[Roofline] = None,
+    specialize_batch: int = 1,
+):
+    if pin_cores and workers > len(os.sched_getaffinity(0)):
+        raise ValueError(f"Cannot pin {workers} workers to separate cores.")
+
+    worker_ids = multiprocessing.Queue()
+    for worker_id in range(workers):
+        worker_ids.put(worker_id)
+    measure_lock = multiprocessing.Lock()
+    incumbent = Incumbent(race)
+    for result in history or []:
+        incumbent.update(result)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(
+            template,
+            worker_ids,
+            measure_lock,
+            pin_cores,
+            cache,
+            harness_args or [],
+            use_server,
+            multi_fidelity,
+            roofline,
+        ),
+    ) as pool:
+
+        def run_jobs(jobs: List[Tuple[dict, Optional[float], float]]) -> List[dict]:
+            # Every worker gets groups of `specialize_batch` jobs
+            groups = [
+                jobs[i : i + specialize_batch]
+                for i in range(0, len(jobs), specialize_batch)
+            ]
+            results = [
+                result
+                for group in pool.map(evaluate_in_worker, groups)
+                for result in group
+            ]
+            if log is not None:
+                for (config, _, _), result in zip(jobs, results):
+                    log.append(config, result)
+            return results
+
+        def evaluate_batch(configs: List[dict]) -> List[dict]:
+            # Hopeless configurations are answered without a worker
+            results = [prescreen(cost_model, config) for config in configs]
+            pending = [i for i, result in enumerate(results) if result is None]
+            if log is not None:
+                for config, result in zip(configs, results):
+                    if result is not None:
+                        log.append(config, result)
+
+            # Successive halving, configurations that are not promoted keep
+            # the runtime extrapolated from their last reduced problem. Those
+            # whose tiles allow no smaller problem skip the reduced rounds.
+            for fidelity in multi_fidelity.fidelities if multi_fidelity else []:
+                reducible = [
+                    i for i in pending if multi_fidelity.reducible(configs[i], fidelity)
+                ]
+                rung = dict(
+                    zip(
+                        reducible,
+                        run_jobs([(configs[i], None, fidelity) for i in reducible]),
+                    )
+                )
+                promoted = multi_fidelity.promoted(rung)
+                pending = [i for i in pending if i not in rung or i in promoted]
+                for i, result in rung.items():
+                    if i not in promoted:
+                        results[i] = extrapolate(result)
+
+            # All configurations of a batch race against the incumbent from
+            # before the batch.
+            measured = run_jobs([(configs[i], incumbent.get(), 1.0) for i in pending])
+            for i, result in zip(pending, measured):
+                results[i] = result
+            for result in results:
+                incumbent.update(result)
+            return results
+
+        settings = warm_started(settings, evaluate_batch, seeds, history, iterations)
+        run_client_server(settings, evaluate_batch, batch_size or workers)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Autotune batch_matmul with BACO.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of configurations to compile and evaluate at once.",
+    )
+    parser.add_argument(
+        "--pin-cores",
+        action="store_true",
+        help="Pin every worker to its own core instead of serializing the timed runs.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default="/home/results/compile_cache",
+        help="Directory of the compile cache shared by all searches.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=2048,
+        help="Size limit of the compile cache in MB.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Compile and measure every configuration from scratch.",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Sample every configuration until the confidence interval of its median runtime is narrow enough.",
+    )
+    parser.add_argument(
+        "--target-width",
+        type=float,
+        default=0.02,
+        help="Relative width of the confidence interval to reach with --adaptive.",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=10.0,
+        help="Seconds of measurement per configuration with --adaptive.",
+    )
+    parser.add_argument(
+        "--race",
+        action="store_true",
+        help="Stop measuring a configuration once it is clearly slower than the best one so far.",
+    )
+    parser.add_argument(
+        "--measure-server",
+        action="store_true",
+        help="Build shared objects and measure them in one long-lived process instead of linking an executable per configuration.",
+    )
+    parser.add_argument(
+        "--prescreen",
+        action="store_true",
+        help="Skip configurations a cost model deems hopeless: those that would run into the compile timeout are reported as invalid, slow ones with a pessimistic runtime.",
+    )
+    parser.add_argument(
+        "--max-vector-elements",
+        type=int,
+        default=max_vector_elements,
+        help="Largest tile in elements --prescreen lets be vectorized, larger ones run into the compile timeout.",
+    )
+    parser.add_argument(
+        "--fidelities",
+        type=str,
+        help="Comma-separated fractions of the problem size, e.g. 0.1,0.3, to measure every batch of configurations on before the full problem.",
+    )
+    parser.add_argument(
+        "--promote",
+        type=float,
+        default=0.5,
+        help="Fraction of the configurations promoted to the next fidelity with --fidelities.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="Configurations requested from Baco at once, defaults to the number of workers, or 8 with --fidelities.",
+    )
+    parser.add_argument(
+        "--measurement-log",
+        help="CSV file receiving every measurement with its fidelity, by default /home/results/performance_exploration_measurements.csv, with the shape in its name for --shape.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the last search of the measurement log from its evaluations.",
+    )
+    parser.add_argument(
+        "--warm-start",
+        action="append",
+        default=[],
+        help="Measurement log or BACO output of earlier searches, the fastest configurations are evaluated first instead of random samples. May be given several times.",
+    )
+    parser.add_argument(
+        "--warm-start-points",
+        type=int,
+        default=10,
+        help="Number of earlier configurations evaluated with --warm-start.",
+    )
+    parser.add_argument(
+        "--iterations",
+        type=int,
+        help="Optimization iterations instead of those of the settings file.",
+    )
+    parser.add_argument(
+        "--counters",
+        action="store_true",
+        help="Collect hardware performance counters of every kernel (cycles, instructions, cache misses, vector instructions).",
+    )
+    parser.add_argument(
+        "--vector-event",
+        type=str,
+        help="Raw perf event counting vector instructions, e.g. 0xa8c7, by default one for Intel hosts.",
+    )
+    parser.add_argument(
+        "--peak-gflops",
+        type=float,
+        help="Compute peak of the roofline, estimated from the host by default.",
+    )
+    parser.add_argument(
+        "--peak-bandwidth",
+        type=float,
+        help="Memory bandwidth of the roofline in GB/s, only the compute peak is used without it.",
+    )
+    parser.add_argument(
+        "--specialize-batch",
+        type=int,
+        default=1,
+        help="Apply the transform scripts of this many configurations in one mlir-transform-opt run, in one worker, paying parsing and startup once.",
+    )
+    parser.add_argument(
+        "--shape",
+        help="Tune the batch matmul of this shape B,M,N,K instead of the one in parametric_transform.mlir. The payload, the problem size of the harness and the constraints of the tile sizes are generated from it.",
+    )
+    parser.add_argument(
+        "--tuning-db",
+        default=tuning_db.default_path,
+        help="Database of the best configuration per shape. The search starts from the nearest tuned shape and stores its best configuration, empty to not use it.",
+    )
+    parser.add_argument(
+        "--results-db",
+        default=results_store.default_path,
+        help="SQLite results store receiving every complete kernel measurement, empty to not store them.",
+    )
+    args = parser.parse_args()
+    harness_args = []
+    if args.adaptive:
+        harness_args = [
+            "--adaptive",
+            f"--target-width={args.target_width}",
+            f"--time-budget={args.time_budget}",
+        ]
+    if args.counters:
+        harness_args.append("--counters")
+        if args.vector_event:
+            harness_args.append(f"--vector-event={args.vector_event}")
+    roofline = Roofline.from_host(args.peak_gflops, args.peak_bandwidth)
+    cache = (
+        None
+        if args.no_cache
+        else CompileCache(args.cache_dir, args.cache_size * (1 << 20))
+    )
+
     with open(
-        f"{dir}/search_settings.json",
-        "r",
-    ) as settings, open(
         f"{dir}/parametric_transform.mlir",
         "r",
     ) as parametric_script:
-        settings = settings.read()
-        json_settings = json.loads(settings)
-        search(
-            f"{dir}/search_settings.json",
-            get_opt_fun(parametric_script.read()),
+        script = parametric_script.read()
+    settings_file = f"{dir}/search_settings.json"
+    with open(settings_file, "r") as f:
+        settings = json.load(f)
+    measurement_log = (
+        args.measurement_log or "/home/results/performance_exploration_measurements.csv"
+    )
+    shape, element_type = batch_matmul_shape(script)
+    model = "batch_matmul"
+    if args.shape:
+        # Script, settings and harness problem of the shape, the measurements
+        # and BACO's output go to files of their own
+        shape = parse_shape(args.shape)
+        script = shape_script(script, shape)
+        settings = shape_settings(settings, shape)
+        settings_file = write_settings(settings)
+        harness_args.append(f"--shape={','.join(map(str, shape))}")
+        if args.measurement_log is None:
+            measurement_log = suffixed(measurement_log, shape)
+        model = f"batch_matmul_{shape_name(shape)}"
+    # Parsed once, every configuration only fills in its values
+    template = TransformTemplate.from_settings(script, settings_file)
+    cost_model = None
+    if args.prescreen:
+        cost_model = CostModel.from_script(
+            script, max_vector_elements=args.max_vector_elements
+        )
+    multi_fidelity = None
+    if args.fidelities:
+        multi_fidelity = MultiFidelity(
+            shape,
+            [float(fidelity) for fidelity in args.fidelities.split(",")],
+            args.promote,
         )
+    search_id = last_search(measurement_log) if args.resume else None
+    history = []
+    if search_id is not None:
+        history = load_evaluations([measurement_log], settings, search_id)
+        print(f"Resuming search {search_id} from {len(history)} evaluations")
+    # Configurations of earlier searches, moved into this search space if
+    # they were tuned for another shape
+    seeds = warm_start_configs(
+        load_evaluations(args.warm_start, settings),
+        settings,
+        args.warm_start_points,
+        exclude=history,
+    )
+    tuning = tuning_db.open_database(args.tuning_db) if args.tuning_db else None
+    if tuning is not None:
+        # The tuned configuration of the shape, or that of the nearest tuned
+        # shape, is evaluated first
+        suggestion = tuning.suggest(
+            tuning_db.batch_matmul, shape, element_type, settings
+        )
+        parameters = list(settings["input_parameters"])
+        known = [
+            {name: config[name] for name in parameters} for config in history + seeds
+        ]
+        if suggestion is not None and suggestion[0] not in known:
+            config, source = suggestion
+            print(f"Starting from the tuned configuration {config} ({source})")
+            seeds.insert(0, config)
+    store = results_store.open_store(args.results_db) if args.results_db else None
+    log = MeasurementLog(
+        measurement_log, list(template.parameters), search_id, store, model
+    )
+    # Successive halving and batched specialization need batches of
+    # configurations
+    if args.workers > 1 or multi_fidelity is not None or args.specialize_batch > 1:
+        parallel_search(
+            settings_file,
+            template,
+            args.workers,
+            args.pin_cores,
+            cache,
+            harness_args,
+            args.race,
+            args.measure_server,
+            cost_model,
+            log,
+            multi_fidelity,
+            args.batch_size
+            or (8 if multi_fidelity else args.workers * args.specialize_batch),
+            seeds,
+            history,
+            args.iterations,
+            roofline,
+            args.specialize_batch,
+        )
+    else:
+        with get_opt_fun(
+            template,
+            cache,
+            harness_args,
+            args.race,
+            args.measure_server,
+            cost_model,
+            log,
+            history,
+            roofline,
+        ) as optimize_me:
+            search(
+                warm_started(
+                    settings_file,
+                    lambda configs: [optimize_me(config) for config in configs],
+                    seeds,
+                    history,
+                    args.iterations,
+                ),
+                optimize_me,
+            )
+    if tuning is not None:
+        record_best(tuning, measurement_log, settings, log.search, shape, element_type)
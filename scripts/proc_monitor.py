@@ -0,0 +1,228 @@
+from __future__ import annotations
+import errno
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+page_kib = os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def current_rss(pid: int) -> Optional[int]:
+    """Resident set size of a running process in KiB."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * page_kib
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss(pid: int) -> Optional[int]:
+    """Peak resident set size (VmHWM) of a running process in KiB."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def page_faults(pid: int) -> Tuple[int, int]:
+    """Minor and major page faults of a running process so far."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces, the fields follow its ')'
+            fields = f.read().rpartition(")")[2].split()
+        return int(fields[7]), int(fields[9])
+    except (OSError, IndexError, ValueError):
+        return 0, 0
+
+
+def reset_peak(pid: int):
+    """Resets VmHWM of a process to its current RSS, where the kernel allows."""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class RssSampler:
+    """Samples the RSS of a process every `interval` seconds in a thread."""
+
+    def __init__(self, pid: int, interval: float = 0.01):
+        self.pid = pid
+        self.interval = interval
+        self.trace: List[Tuple[float, int]] = []
+        self.peak: Optional[int] = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        start = time.perf_counter()
+        while not self.stopped.is_set():
+            rss = current_rss(self.pid)
+            if rss:
+                self.trace.append((round(time.perf_counter() - start, 4), rss))
+            # VmHWM only grows, the last sample misses at most one interval
+            peak = peak_rss(self.pid)
+            if peak:
+                self.peak = max(self.peak or 0, peak)
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self) -> List[Tuple[float, int]]:
+        self.stopped.set()
+        self.thread.join()
+        return self.trace
+
+
+# Runs the command given after the number of a pipe as its own child, reports
+# its pid on the pipe, waits for it and reports its wait4 status and usage.
+# ru_maxrss of a process includes the peak RSS of the process it was forked
+# from, a child forked from this small interpreter instead of the caller, e.g.
+# a Python process holding Baco or large payloads, reports its own peak.
+spawn_wrapper = """
+import os, signal, sys
+report = int(sys.argv[1])
+os.set_inheritable(report, False)
+try:
+    pid = os.posix_spawnp(
+        sys.argv[2], sys.argv[2:], os.environ,
+        setsigdef=(signal.SIGPIPE, signal.SIGXFSZ),
+    )
+except OSError as e:
+    os.write(report, b"error %d\\n" % e.errno)
+    sys.exit(127)
+os.write(report, b"%d\\n" % pid)
+_, status, usage = os.wait4(pid, 0)
+os.write(report, b"%d %d %d %d\\n" % (
+    status, usage.ru_maxrss, usage.ru_minflt, usage.ru_majflt
+))
+"""
+
+
+def run_monitored(
+    command: List[str],
+    input: Optional[str] = None,
+    timeout: Optional[float] = None,
+    trace: bool = False,
+    interval: float = 0.01,
+    discard_output: bool = False,
+    **popen_args,
+) -> Tuple[int, str, str, dict]:
+    """Runs `command` like subprocess.run and records its memory usage.
+
+    Returns the return code, stdout, stderr and a dict with the peak RSS in
+    KiB and the page faults from the kernel's accounting (wait4), and with
+    `trace` the RSS sampled every `interval` seconds as (seconds, KiB) pairs.
+    A process exceeding `timeout` is killed, which is flagged as `timed_out`.
+
+    The command runs as the child of a small Python interpreter (see
+    `spawn_wrapper`), so that the peak, ru_maxrss of wait4, is its own and not
+    that of the caller. The sampling thread reads /proc while the command
+    runs and disturbs timings, so it is off by default.
+
+    `stdout` and `stderr` may be given like for Popen, e.g. a file to write
+    the output to, only captured streams are returned.
+    """
+    stdout = popen_args.pop(
+        "stdout", subprocess.DEVNULL if discard_output else subprocess.PIPE
+    )
+    stderr = popen_args.pop("stderr", subprocess.PIPE)
+    report_read, report_write = os.pipe()
+    try:
+        process = subprocess.Popen(
+            [sys.executable, "-I", "-S", "-c", spawn_wrapper, str(report_write)]
+            + list(command),
+            stdin=subprocess.DEVNULL if input is None else subprocess.PIPE,
+            stdout=stdout,
+            stderr=stderr,
+            text=True,
+            pass_fds=(*popen_args.pop("pass_fds", ()), report_write),
+            **popen_args,
+        )
+    finally:
+        os.close(report_write)
+    report = os.fdopen(report_read, "rb")
+    spawned = report.readline().split()
+    if spawned[:1] != [b"error"] and len(spawned) == 1:
+        pid = int(spawned[0])
+    else:
+        report.close()
+        process.wait()
+        for stream in [process.stdin, process.stdout, process.stderr]:
+            if stream:
+                stream.close()
+        error = int(spawned[1]) if spawned else errno.ECHILD
+        raise OSError(error, os.strerror(error), command[0])
+
+    sampler = RssSampler(pid, interval) if trace else None
+    if sampler:
+        sampler.start()
+    streams: Dict[str, str] = {"stdout": "", "stderr": ""}
+
+    def read(name: str, stream):
+        streams[name] = stream.read()
+
+    def write():
+        try:
+            process.stdin.write(input)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    threads = [
+        threading.Thread(target=read, args=(name, stream))
+        for name, stream in [("stdout", process.stdout), ("stderr", process.stderr)]
+        if stream is not None
+    ]
+    if input is not None:
+        threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    timer = threading.Timer(timeout, kill) if timeout else None
+    if timer:
+        timer.start()
+    # The wrapper reports the status and usage of the command once it is reaped
+    with report:
+        status, peak, minor_faults, major_faults = map(int, report.read().split())
+    process.wait()
+    if timer:
+        timer.cancel()
+    rss_trace = sampler.stop() if sampler else []
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    for thread in threads:
+        thread.join()
+    for stream in [process.stdout, process.stderr]:
+        if stream:
+            stream.close()
+
+    memory = {
+        "peak_rss_kb": peak,
+        "minor_faults": minor_faults,
+        "major_faults": major_faults,
+        "rss_trace": rss_trace,
+        "timed_out": timed_out.is_set(),
+    }
+    return process.returncode, streams["stdout"], streams["stderr"], memory
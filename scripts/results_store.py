@@ -0,0 +1,247 @@
+from __future__ import annotations
+import argparse
+import hashlib
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+default_path = "/home/results/benchmarks.sqlite"
+llvm_dir = "/home/lib/llvm-project"
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL,
+    kind TEXT,
+    model TEXT,
+    config TEXT,
+    revision TEXT,
+    host TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run INTEGER REFERENCES runs(id),
+    metric TEXT,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS runs_by_revision ON runs (revision, kind, model, config);
+"""
+
+
+def tool_revision(repository: str = llvm_dir) -> str:
+    """Returns the commit of the MLIR build, with a hash of the local changes.
+
+    The patches of this artifact are applied as local changes, different
+    patch sets on the same commit get different revisions.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "-C", repository, "rev-parse", "--short=12", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        diff = subprocess.run(
+            ["git", "-C", repository, "diff", "HEAD"],
+            capture_output=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    if diff:
+        return f"{commit}+{hashlib.sha256(diff).hexdigest()[:8]}"
+    return commit
+
+
+def host_info() -> str:
+    cpu = platform.processor() or platform.machine()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu = line.partition(":")[2].strip()
+                    break
+    except OSError:
+        pass
+    return f"{platform.node()} ({cpu}, {os.cpu_count()} cores)"
+
+
+class ResultsStore:
+    """SQLite database of benchmark samples across LLVM revisions.
+
+    A run is one benchmark of a model and configuration (a pipeline, or the
+    tuning parameters of a kernel) on one revision and host. It has any
+    number of samples per metric, e.g. mlir_time and transform_time.
+    """
+
+    def __init__(self, path: str = default_path, revision: Optional[str] = None):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(schema)
+        self.revision = revision or tool_revision()
+        self.host = host_info()
+
+    def add_run(
+        self, kind: str, model: str, config: str, samples: Dict[str, List[float]]
+    ) -> int:
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (timestamp, kind, model, config, revision, host) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), kind, model, config, self.revision, self.host),
+            )
+            run = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO samples (run, metric, value) VALUES (?, ?, ?)",
+                [
+                    (run, metric, value)
+                    for metric, values in samples.items()
+                    for value in values
+                    if value is not None
+                ],
+            )
+        return run
+
+    def samples(
+        self, revision: str, host: Optional[str] = None
+    ) -> Dict[Tuple[str, str, str, str], List[float]]:
+        """Returns all samples of `revision` by kind, model, config and metric."""
+        query = (
+            "SELECT kind, model, config, metric, value FROM runs "
+            "JOIN samples ON samples.run = runs.id WHERE revision = ?"
+        )
+        parameters: List[str] = [revision]
+        if host is not None:
+            query += " AND host = ?"
+            parameters.append(host)
+        groups: Dict[Tuple[str, str, str, str], List[float]] = {}
+        for kind, model, config, metric, value in self.connection.execute(
+            query, parameters
+        ):
+            groups.setdefault((kind, model, config, metric), []).append(value)
+        return groups
+
+    def revisions(self) -> List[Tuple[str, int, float]]:
+        """Returns every revision with its number of runs and latest time."""
+        return list(
+            self.connection.execute(
+                "SELECT revision, COUNT(*), MAX(timestamp) FROM runs "
+                "GROUP BY revision ORDER BY MAX(timestamp)"
+            )
+        )
+
+    def close(self):
+        self.connection.close()
+
+
+def open_store(path: str = default_path) -> Optional[ResultsStore]:
+    """Opens the store, or returns None if its directory does not exist, e.g.
+    outside of the container."""
+    if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        return None
+    return ResultsStore(path)
+
+
+def compare(
+    before: Dict[tuple, List[float]],
+    after: Dict[tuple, List[float]],
+    alpha: float = 0.01,
+    threshold: float = 0.02,
+) -> List[dict]:
+    """Compares the samples of two revisions with a Mann-Whitney U test.
+
+    A change is significant if the test rejects equal distributions at level
+    `alpha` and the medians differ by more than `threshold`. All metrics are
+    lower-is-better, a significant increase is a regression.
+    """
+    from scipy.stats import mannwhitneyu
+
+    rows = []
+    for key in sorted(set(before) & set(after)):
+        a, b = before[key], after[key]
+        if len(a) < 2 or len(b) < 2:
+            continue
+        change = median(b) / median(a) - 1 if median(a) else 0.0
+        p_value = mannwhitneyu(a, b, alternative="two-sided").pvalue
+        status = "unchanged"
+        if p_value < alpha and abs(change) > threshold:
+            status = "regression" if change > 0 else "improvement"
+        kind, model, config, metric = key
+        rows.append(
+            {
+                "kind": kind,
+                "model": model,
+                "config": config,
+                "metric": metric,
+                "before": median(a),
+                "after": median(b),
+                "change": change,
+                "p_value": p_value,
+                "status": status,
+            }
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inspect the benchmark results store and compare revisions."
+    )
+    parser.add_argument("--db", default=default_path)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("revisions", help="List the revisions with results.")
+    comparison = commands.add_parser(
+        "compare", help="Flag significant changes between two revisions."
+    )
+    comparison.add_argument("before", help="Baseline revision")
+    comparison.add_argument("after", help="Revision to check")
+    comparison.add_argument("--alpha", type=float, default=0.01)
+    comparison.add_argument(
+        "--threshold",
+        type=float,
+        default=0.02,
+        help="Smallest relative change of the median that is reported.",
+    )
+    comparison.add_argument(
+        "--host", help="Only compare samples of this host, as listed by revisions."
+    )
+    comparison.add_argument(
+        "--all", action="store_true", help="Also print unchanged results."
+    )
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db, revision="unknown")
+    if args.command == "revisions":
+        for revision, runs, latest in store.revisions():
+            print(f"{revision}  {runs} runs, latest {time.ctime(latest)}")
+        return
+
+    rows = compare(
+        store.samples(args.before, args.host),
+        store.samples(args.after, args.host),
+        args.alpha,
+        args.threshold,
+    )
+    if not rows:
+        print(f"No results measured on both {args.before} and {args.after}.")
+        return
+    regressions = 0
+    for row in rows:
+        regressions += row["status"] == "regression"
+        if row["status"] == "unchanged" and not args.all:
+            continue
+        print(
+            f"{row['status']:11}  {row['kind']} {row['model']} {row['config']} "
+            f"{row['metric']}: {row['before']:.6g} -> {row['after']:.6g} "
+            f"({100 * row['change']:+.1f}%, p={row['p_value']:.2g})"
+        )
+    print(f"{regressions} regressions in {len(rows)} compared results.")
+    # Fails in scripts, e.g. after rebuilding MLIR
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+import os
+import shutil
+import tempfile
+from typing import Iterable, List, Union
+
+# tmpfs, files written here never touch the disk
+shared_memory = "/dev/shm"
+
+
+class Scratch:
+    """Scratch space of one benchmark run, removed when the run ends.
+
+    `write` puts contents into an anonymous in-memory file (memfd) where the
+    platform supports it. Tools open it through /proc/self/fd, which requires
+    the descriptors in `fds` to be passed to them (`pass_fds` of subprocess).
+    Files that tools write themselves go to a private directory, on tmpfs if
+    available. Nothing is shared between runs, so concurrent runs cannot see
+    each other's or stale files.
+    """
+
+    def __init__(self):
+        root = shared_memory if os.access(shared_memory, os.W_OK) else None
+        self.dir = tempfile.mkdtemp(prefix="bench_", dir=root)
+        self.fds: List[int] = []
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def write(self, name: str, content: Union[str, bytes]) -> str:
+        """Stores `content` and returns a path the tools can read it from."""
+        return self.write_parts(name, [content])
+
+    def write_parts(self, name: str, parts: Iterable[Union[str, bytes]]) -> str:
+        """Like `write` for content given in parts, e.g. by a generator, so
+        that it never has to be held in memory as a whole."""
+        if hasattr(os, "memfd_create"):
+            fd = os.memfd_create(name)
+            self.fds.append(fd)
+            path = f"/proc/self/fd/{fd}"
+            file = open(fd, "wb", closefd=False)
+        else:
+            path = self.path(name)
+            file = open(path, "wb")
+        with file:
+            for part in parts:
+                file.write(part.encode() if isinstance(part, str) else part)
+        return path
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self) -> "Scratch":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
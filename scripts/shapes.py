@@ -0,0 +1,53 @@
+from __future__ import annotations
+import copy
+import os
+from typing import List
+
+from cost_model import batch_matmul_shape
+from fidelity import reshape_payload
+
+# Tile sizes of the loops (b, m, n, k) of the generalized batch matmul
+tile_parameters = ["tile0", "tile1", "tile2", "tile3"]
+
+
+def parse_shape(text: str) -> List[int]:
+    """Parses a shape given as B,M,N,K or BxMxNxK."""
+    shape = [int(size) for size in text.replace("x", ",").split(",")]
+    if len(shape) != 4 or min(shape) <= 0:
+        raise ValueError(f"Not a batch matmul shape B,M,N,K: {text}")
+    return shape
+
+
+def shape_name(shape: List[int]) -> str:
+    return "x".join(map(str, shape))
+
+
+def suffixed(path: str, shape: List[int]) -> str:
+    """Returns `path` with the shape before its extension, e.g. for the output
+    files of the search of one shape."""
+    root, extension = os.path.splitext(path)
+    return f"{root}_{shape_name(shape)}{extension}"
+
+
+def shape_script(script: str, shape: List[int]) -> str:
+    """Returns the parametric transform script with its payload for `shape`."""
+    return reshape_payload(script, batch_matmul_shape(script)[0], shape)
+
+
+def shape_settings(settings: dict, shape: List[int]) -> dict:
+    """Returns BACO settings searching the tile sizes of `shape`.
+
+    Every tile size ranges up to its dimension and divides it, or is 0 to
+    leave the loop untiled. Other parameters keep their range and constraints.
+    The output files get the shape in their name.
+    """
+    settings = copy.deepcopy(settings)
+    for parameter, size in zip(tile_parameters, shape):
+        settings["input_parameters"][parameter].update(
+            values=[0, size],
+            constraints=[f"({size} % {parameter} == 0) | ({parameter} == 0)"],
+        )
+    for file in ["output_data_file", "log_file"]:
+        if file in settings:
+            settings[file] = suffixed(settings[file], shape)
+    return settings
@@ -0,0 +1,278 @@
+from __future__ import annotations
+import argparse
+import csv
+import json
+import os
+from statistics import median, stdev
+from typing import Dict, List, Optional, Tuple
+
+
+def input_of(record: dict) -> str:
+    """Returns the model name of a tool invocation recorded by bench_compile_time.
+
+    That is the payload named in the record, or the first file argument of
+    the command for payloads read from a file.
+    """
+    payload = record.get("payload")
+    if payload is None:
+        command = record.get("command", [record["tool"]])
+        payload = next((arg for arg in command[1:] if not arg.startswith("-")), None)
+    if payload is None:
+        return "<stdin>"
+    name = os.path.basename(payload)
+    for suffix in [".mlir", ".mlirbc", "_tosa"]:
+        if name.endswith(suffix):
+            name = name[: -len(suffix)]
+    return name
+
+
+def load_records(paths: List[str]) -> List[dict]:
+    records = []
+    for path in paths:
+        with open(path, "r") as file:
+            for line in file:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+def per_run_durations(record: dict) -> Dict[Tuple[str, str], float]:
+    """Sums the durations of every pass or transform op over one run.
+
+    A pass scheduled on several functions runs once per function, possibly
+    in parallel, all of them count towards its time.
+    """
+    durations: Dict[Tuple[str, str], float] = {}
+    for action in record.get("actions", []):
+        key = (action["kind"], action["name"])
+        durations[key] = durations.get(key, 0.0) + action["duration"]
+    if "total" in record:
+        durations[("total", record["tool"])] = record["total"]
+    return durations
+
+
+def aggregate(records: List[dict]) -> List[dict]:
+    samples: Dict[Tuple[str, str, str, str], List[float]] = {}
+    for record in records:
+        model = input_of(record)
+        for (kind, name), duration in per_run_durations(record).items():
+            samples.setdefault((model, record["tool"], kind, name), []).append(
+                duration
+            )
+
+    rows = []
+    for (model, tool, kind, name), durations in sorted(samples.items()):
+        rows.append(
+            {
+                "model": model,
+                "tool": tool,
+                "kind": kind,
+                "name": name,
+                "runs": len(durations),
+                "median": median(durations),
+                "min": min(durations),
+                "stdev": stdev(durations) if len(durations) > 1 else 0.0,
+            }
+        )
+    return rows
+
+
+class TimingNode:
+    def __init__(self, kind: str, name: str):
+        self.kind = kind
+        self.name = name
+        self.duration = 0.0
+        self.count = 0
+        self.payload_ops = 0.0
+        self.children: Dict[Tuple[str, str], "TimingNode"] = {}
+
+    def child(self, kind: str, name: str) -> "TimingNode":
+        if (kind, name) not in self.children:
+            self.children[(kind, name)] = TimingNode(kind, name)
+        return self.children[(kind, name)]
+
+
+# Name of the pass that runs a nested pass pipeline, on several threads if
+# threading is enabled
+adaptor_pass = "OpToOpPassAdaptor"
+
+
+def action_end(action: dict) -> float:
+    return action["start"] + action["duration"]
+
+
+def find_parents(actions: List[dict]) -> List[int]:
+    """Returns the index of the enclosing action of every action, -1 for roots.
+
+    `actions` are sorted by start. Actions nest on the thread they run on.
+    Actions at depth 0 of another thread were spawned by a pass manager
+    adaptor and belong to the innermost adaptor of another thread that
+    encloses them, or else to the innermost enclosing action of the main
+    thread, the thread of the first action.
+    """
+    parents = []
+    # The latest action at every depth of every thread
+    latest: Dict[int, Dict[int, int]] = {}
+    # Adaptors that may still be running
+    adaptors: List[int] = []
+    main = actions[0]["thread"] if actions else None
+    for i, action in enumerate(actions):
+        end = action_end(action)
+        depths = latest.setdefault(action["thread"], {})
+        if action["depth"] > 0:
+            parent = depths.get(action["depth"] - 1, -1)
+        else:
+            adaptors = [
+                j for j in adaptors if action_end(actions[j]) >= action["start"]
+            ]
+            parent = next(
+                (
+                    j
+                    for j in reversed(adaptors)
+                    if actions[j]["thread"] != action["thread"]
+                    and action_end(actions[j]) >= end
+                ),
+                -1,
+            )
+            if parent < 0 and action["thread"] != main:
+                main_depths = latest.get(main, {})
+                parent = next(
+                    (
+                        main_depths[depth]
+                        for depth in sorted(main_depths, reverse=True)
+                        if action_end(actions[main_depths[depth]]) >= end
+                    ),
+                    -1,
+                )
+        depths[action["depth"]] = i
+        if action["kind"] == "pass" and action["name"].endswith(adaptor_pass):
+            adaptors.append(i)
+        parents.append(parent)
+    return parents
+
+
+def build_tree(records: List[dict]) -> TimingNode:
+    """Merges the actions of `records` into one tree.
+
+    Like the tree display of -mlir-timing, actions with the same name under
+    the same parent are merged, e.g. a pass running on every function.
+    Durations and counts are averaged over the records.
+    """
+    root = TimingNode("total", records[0]["tool"])
+    for record in records:
+        actions = sorted(record.get("actions", []), key=lambda action: action["start"])
+        nodes: List[TimingNode] = []
+        for action, parent in zip(actions, find_parents(actions)):
+            node = (root if parent < 0 else nodes[parent]).child(
+                action["kind"], action["name"]
+            )
+            node.duration += action["duration"] / len(records)
+            node.count += 1 / len(records)
+            node.payload_ops += action.get("payload_ops", 0) / len(records)
+            nodes.append(node)
+        root.duration += record.get("total", 0.0) / len(records)
+    return root
+
+
+def copy_payload_ops(tree: TimingNode, counted: TimingNode):
+    """Takes the payload op counts of `tree` from the tree of runs that
+    counted them, which are slower and not part of the timings."""
+    tree.payload_ops = counted.payload_ops
+    for key, child in tree.children.items():
+        if key in counted.children:
+            copy_payload_ops(child, counted.children[key])
+
+
+def format_tree(root: TimingNode) -> List[str]:
+    lines = [
+        f"  Total Execution Time: {root.duration:.4f} seconds ({root.name})",
+        "",
+        "  ----Wall Time----  ----Name----",
+    ]
+
+    def visit(node: TimingNode, indent: int):
+        share = 100.0 * node.duration / root.duration if root.duration else 0.0
+        line = f"  {node.duration:8.4f} ({share:5.1f}%)  {'  ' * indent}{node.name}"
+        # A pass may not run equally often in every record
+        if round(node.count, 1) > 1:
+            line += f" (x{round(node.count, 1):g})"
+        if node.payload_ops:
+            line += f" [{node.payload_ops:.0f} payload ops]"
+        lines.append(line)
+        for child in sorted(node.children.values(), key=lambda c: -c.duration):
+            visit(child, indent + 1)
+
+    for child in sorted(root.children.values(), key=lambda c: -c.duration):
+        visit(child, 0)
+    return lines
+
+
+def group_records(records: List[dict]) -> Dict[Tuple[str, str], List[dict]]:
+    """Groups `records` by model and tool."""
+    groups: Dict[Tuple[str, str], List[dict]] = {}
+    for record in records:
+        model = input_of(record)
+        groups.setdefault((model, record["tool"]), []).append(record)
+    return groups
+
+
+def print_trees(records: List[dict], counted: Optional[List[dict]] = None):
+    """Prints a -mlir-timing style tree per model and tool.
+
+    The payload op counts come from the `counted` records if given, runs
+    with MLIR_TIMING_JSON_PAYLOAD_OPS whose times are not reported.
+    """
+    counted_groups = group_records(counted or [])
+    for (model, tool), group in sorted(group_records(records).items()):
+        print(f"===--- {model}: {tool} ({len(group)} runs) ---===")
+        tree = build_tree(group)
+        if (model, tool) in counted_groups:
+            copy_payload_ops(tree, build_tree(counted_groups[(model, tool)]))
+        print("\n".join(format_tree(tree)))
+        print()
+
+
+def write_rows(rows: List[dict], output: str):
+    if output.endswith(".parquet"):
+        # Optional, pandas is only needed for Parquet output.
+        import pandas
+
+        pandas.DataFrame(rows).to_parquet(output)
+        return
+    with open(output, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Aggregate the timing records written with --timing-log."
+    )
+    parser.add_argument("timing_logs", nargs="+", help="JSON lines timing logs")
+    parser.add_argument(
+        "--output",
+        default="/home/results/compile_time_passes.csv",
+        help="CSV file, or Parquet if the name ends with .parquet",
+    )
+    parser.add_argument(
+        "--tree",
+        action="store_true",
+        help="Print a -mlir-timing style tree per model and tool instead.",
+    )
+    args = parser.parse_args()
+
+    if args.tree:
+        print_trees(load_records(args.timing_logs))
+        return
+
+    rows = aggregate(load_records(args.timing_logs))
+    if not rows:
+        print("No timing records found.")
+        return
+    write_rows(rows, args.output)
+    print(f"Wrote {len(rows)} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
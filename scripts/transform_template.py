@@ -0,0 +1,158 @@
+from __future__ import annotations
+import json
+import re
+from typing import Callable, Dict, Iterable, List, Union
+
+# Tiling ops that create one loop per nonzero tile size. Their loop results
+# are a result group like `%loops:3`, whose count and result types depend on
+# the tile sizes of a configuration. Ops with a fixed number of results, like
+# `tile_using_forall`, only need their sizes filled in.
+loop_per_tile_ops = [
+    "transform.structured.tile_using_for",
+    "transform.structured.fuse",
+]
+
+# `%tiled, %loops:N = <op> %target [sizes] ... : (...) -> (...)`
+tiling_op_pattern = re.compile(
+    r"(?P<results>(?P<indent>\s*)%[\w.$-]+,\s*(?P<loops>%[\w.$-]+))(?::\d+)?"
+    r"(?P<op>\s*=\s*(?P<name>[\w.]+)[^\[]*\[)(?P<sizes>[^\]]*)"
+    r"(?P<signature>\].*:\s*\([^)]*\)\s*->\s*\()(?P<types>[^)]*)\)\s*$"
+)
+
+
+def format_integer(value) -> str:
+    return str(int(value))
+
+
+def format_real(value) -> str:
+    return repr(float(value))
+
+
+# How values of each BACO parameter type are printed into the script.
+formatters: Dict[str, Callable[[object], str]] = {
+    "integer": format_integer,
+    "real": format_real,
+    "ordinal": str,
+    "categorical": str,
+}
+
+
+class Slot:
+    def __init__(self, name: str, format: Callable[[object], str]):
+        self.name = name
+        self.format = format
+
+    def fill(self, config: dict) -> str:
+        return self.format(config[self.name])
+
+
+Part = Union[str, Slot]
+
+
+def fill(parts: List[Part], config: dict) -> str:
+    return "".join(part if isinstance(part, str) else part.fill(config) for part in parts)
+
+
+class TilingOp:
+    """A tiling op whose number of loop results depends on its tile sizes."""
+
+    def __init__(self, match: re.Match, split: Callable[[str], List[Part]]):
+        self.results = match.group("results")
+        self.op = split(match.group("op"))
+        self.sizes = [split(size) for size in match.group("sizes").split(",")]
+        self.signature = split(match.group("signature"))
+        types = [type.strip() for type in match.group("types").split(",")]
+        self.tiled_type = types[0]
+        self.loop_type = types[1] if len(types) > 1 else types[0]
+        self.without_loops = match.group("results")[
+            : -len(match.group("loops"))
+        ].rstrip(", \t")
+
+    def fill(self, config: dict) -> str:
+        sizes = [fill(size, config).strip() for size in self.sizes]
+        # Scalable sizes like [4] are not zero either
+        loops = sum(1 for size in sizes if size != "0")
+        types = [self.tiled_type] + [self.loop_type] * loops
+        # Without any loop there is no loop result at all
+        results = f"{self.results}:{loops}" if loops else self.without_loops
+        return (
+            results
+            + fill(self.op, config)
+            + ", ".join(sizes)
+            + fill(self.signature, config)
+            + ", ".join(types)
+            + ")"
+        )
+
+
+class TransformTemplate:
+    """A parametric transform script, parsed once into literal text and slots.
+
+    Parameters are only substituted as whole words, so `tile1` does not match
+    in `tile10` or `%tile1`. Instantiating a configuration joins the parsed
+    parts, and derives the loop results of tiling ops from their sizes.
+    """
+
+    def __init__(self, script: str, parameter_types: Dict[str, str]):
+        self.parameters = {
+            name: Slot(name, formatters.get(type, str))
+            for name, type in parameter_types.items()
+        }
+        # Longest names first, so that no parameter matches a prefix of another
+        names = sorted(self.parameters, key=len, reverse=True)
+        self.pattern = None
+        if names:
+            self.pattern = re.compile(
+                r"(?<![\w%@#^!$.-])("
+                + "|".join(map(re.escape, names))
+                + r")(?![\w.$-])"
+            )
+
+        self.parts: List[Union[Part, TilingOp]] = []
+        for line in script.splitlines(keepends=True):
+            match = tiling_op_pattern.match(line.rstrip("\n"))
+            if match and match.group("name") in loop_per_tile_ops:
+                self.parts.append(TilingOp(match, self.split))
+                if line.endswith("\n"):
+                    self.parts.append("\n")
+            else:
+                self.parts.extend(self.split(line))
+        self.parts = self.merge(self.parts)
+
+    @classmethod
+    def from_settings(cls, script: str, settings_file: str) -> "TransformTemplate":
+        """Takes the parameters and their types from a BACO settings file."""
+        with open(settings_file, "r") as f:
+            settings = json.load(f)
+        return cls(
+            script,
+            {
+                name: parameter.get("parameter_type", "categorical")
+                for name, parameter in settings["input_parameters"].items()
+            },
+        )
+
+    def split(self, text: str) -> List[Part]:
+        if self.pattern is None:
+            return [text]
+        parts: List[Part] = []
+        for i, piece in enumerate(self.pattern.split(text)):
+            # re.split puts the captured parameter names at odd positions
+            parts.append(self.parameters[piece] if i % 2 else piece)
+        return [part for part in parts if part != ""]
+
+    @staticmethod
+    def merge(parts: Iterable) -> List:
+        """Joins adjacent literal parts."""
+        merged: List = []
+        for part in parts:
+            if isinstance(part, str) and merged and isinstance(merged[-1], str):
+                merged[-1] += part
+            else:
+                merged.append(part)
+        return merged
+
+    def instantiate(self, config: dict) -> str:
+        return "".join(
+            part if isinstance(part, str) else part.fill(config) for part in self.parts
+        )
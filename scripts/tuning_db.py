@@ -0,0 +1,326 @@
+from __future__ import annotations
+import argparse
+import json
+import math
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from typing import List, Optional, Tuple
+
+from results_store import tool_revision
+from shapes import (
+    parse_shape,
+    shape_name,
+    shape_settings,
+    suffixed,
+    tile_parameters,
+)
+from warm_start import project
+
+default_path = "/home/results/tuned_configs.sqlite"
+dir = "/home/lib/Performance_Exploration"
+batch_matmul = "linalg.batch_matmul"
+
+schema = """
+CREATE TABLE IF NOT EXISTS tuned (
+    op TEXT,
+    b INTEGER,
+    m INTEGER,
+    n INTEGER,
+    k INTEGER,
+    element_type TEXT,
+    config TEXT,
+    runtime REAL,
+    revision TEXT,
+    timestamp REAL,
+    PRIMARY KEY (op, b, m, n, k, element_type)
+);
+CREATE TABLE IF NOT EXISTS retuning (
+    op TEXT,
+    b INTEGER,
+    m INTEGER,
+    n INTEGER,
+    k INTEGER,
+    element_type TEXT,
+    pid INTEGER,
+    started REAL,
+    PRIMARY KEY (op, b, m, n, k, element_type)
+);
+"""
+
+
+def shape_distance(shape: List[int], other: List[int]) -> float:
+    """Distance of two shapes on a log scale, doubling one dimension is as far
+    as halving it."""
+    return sum(abs(math.log(a / b)) for a, b in zip(shape, other))
+
+
+def interpolate(neighbors: List[Tuple[float, dict]]) -> dict:
+    """Combines the configurations of the nearest shapes, weighted by the
+    inverse of their distance.
+
+    A tile size is the weighted geometric mean of the nonzero sizes, or 0 if
+    most of the weight leaves the loop untiled. Other parameters are those of
+    the nearest shape.
+    """
+    config = dict(neighbors[0][1])
+    weights = [1 / (distance + 1e-3) for distance, _ in neighbors]
+    for parameter in tile_parameters:
+        tiled = [
+            (weight, neighbor[parameter])
+            for weight, (_, neighbor) in zip(weights, neighbors)
+            if neighbor.get(parameter)
+        ]
+        if sum(weight for weight, _ in tiled) * 2 < sum(weights):
+            config[parameter] = 0
+            continue
+        log_size = sum(weight * math.log(size) for weight, size in tiled)
+        config[parameter] = round(math.exp(log_size / sum(w for w, _ in tiled)))
+    return config
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TuningDatabase:
+    """SQLite database of the best configuration found per op and shape.
+
+    Shapes that were never tuned are answered from the nearest tuned shapes,
+    with the configuration moved into their search space, and can be re-tuned
+    in the background starting from that answer.
+    """
+
+    def __init__(self, path: str = default_path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(schema)
+
+    def record(
+        self,
+        op: str,
+        shape: List[int],
+        element_type: str,
+        config: dict,
+        runtime: float,
+        revision: Optional[str] = None,
+    ) -> bool:
+        """Stores `config` for the shape if it is faster than the stored one,
+        or if that was tuned with another LLVM revision. Returns whether it
+        was stored."""
+        revision = revision or tool_revision()
+        stored = self.connection.execute(
+            "SELECT runtime, revision FROM tuned "
+            "WHERE op = ? AND b = ? AND m = ? AND n = ? AND k = ? AND element_type = ?",
+            (op, *shape, element_type),
+        ).fetchone()
+        if stored is not None and stored[1] == revision and stored[0] <= runtime:
+            return False
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tuned "
+                "(op, b, m, n, k, element_type, config, runtime, revision, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    op,
+                    *shape,
+                    element_type,
+                    json.dumps(config, sort_keys=True),
+                    runtime,
+                    revision,
+                    time.time(),
+                ),
+            )
+        return True
+
+    def entries(self, op: str, element_type: Optional[str] = None) -> List[dict]:
+        query = (
+            "SELECT b, m, n, k, element_type, config, runtime, revision FROM tuned "
+            "WHERE op = ?"
+        )
+        parameters: list = [op]
+        if element_type is not None:
+            query += " AND element_type = ?"
+            parameters.append(element_type)
+        entries = []
+        for row in self.connection.execute(query, parameters):
+            b, m, n, k, stored_type, config, runtime, revision = row
+            entries.append(
+                {
+                    "shape": [b, m, n, k],
+                    "element_type": stored_type,
+                    "config": json.loads(config),
+                    "runtime": runtime,
+                    "revision": revision,
+                }
+            )
+        return entries
+
+    def nearest(
+        self, op: str, shape: List[int], element_type: str, count: int = 1
+    ) -> List[Tuple[float, dict]]:
+        """Returns the `count` nearest tuned shapes with their distance."""
+        neighbors = [
+            (shape_distance(shape, entry["shape"]), entry)
+            for entry in self.entries(op, element_type)
+        ]
+        neighbors.sort(key=lambda neighbor: neighbor[0])
+        return neighbors[:count]
+
+    def suggest(
+        self,
+        op: str,
+        shape: List[int],
+        element_type: str,
+        settings: dict,
+        neighbors: int = 1,
+    ) -> Optional[Tuple[dict, str]]:
+        """Returns a configuration for `shape` and where it comes from.
+
+        A tuned shape returns its configuration. Otherwise the configuration
+        of the nearest shape, or interpolated from the `neighbors` nearest
+        ones, is moved into the search space `settings` of the shape.
+        """
+        nearest = self.nearest(op, shape, element_type, neighbors)
+        if not nearest:
+            return None
+        distance, entry = nearest[0]
+        if distance == 0:
+            return entry["config"], "tuned"
+        config = interpolate([(d, e["config"]) for d, e in nearest])
+        config = project(settings, config)
+        if config is None:
+            return None
+        sources = ", ".join(shape_name(e["shape"]) for _, e in nearest)
+        return config, f"from {sources}"
+
+    def retune(
+        self,
+        op: str,
+        shape: List[int],
+        element_type: str,
+        arguments: Optional[List[str]] = None,
+        log_dir: str = "/home/results/logs",
+    ) -> Optional[int]:
+        """Starts a search for `shape` in the background, warm-started from
+        this database, unless one is still running. Returns its pid."""
+        key = (op, *shape, element_type)
+        running = self.connection.execute(
+            "SELECT pid FROM retuning "
+            "WHERE op = ? AND b = ? AND m = ? AND n = ? AND k = ? AND element_type = ?",
+            key,
+        ).fetchone()
+        if running is not None and process_alive(running[0]):
+            return None
+        scripts = os.path.dirname(os.path.abspath(__file__))
+        command = [
+            sys.executable,
+            f"{scripts}/performance_exploration.py",
+            f"--shape={','.join(map(str, shape))}",
+            *(arguments or []),
+        ]
+        os.makedirs(log_dir, exist_ok=True)
+        with open(suffixed(f"{log_dir}/retune.log", shape), "a") as log:
+            process = subprocess.Popen(
+                command,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL,
+                # Keeps running when the caller exits
+                start_new_session=True,
+            )
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO retuning (op, b, m, n, k, element_type, "
+                "pid, started) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, process.pid, time.time()),
+            )
+        return process.pid
+
+    def close(self):
+        self.connection.close()
+
+
+def open_database(path: str = default_path) -> Optional[TuningDatabase]:
+    """Opens the database, or returns None if its directory does not exist,
+    e.g. outside of the container."""
+    if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        return None
+    return TuningDatabase(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Look up tuned batch matmul configurations by shape."
+    )
+    parser.add_argument("--db", default=default_path)
+    parser.add_argument("--element-type", default="f32")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List the tuned shapes.")
+    lookup = commands.add_parser(
+        "lookup", help="Print a configuration for every shape B,M,N,K."
+    )
+    lookup.add_argument("shapes", nargs="+")
+    lookup.add_argument(
+        "--neighbors",
+        type=int,
+        default=1,
+        help="Interpolate the tile sizes of this many nearest tuned shapes.",
+    )
+    lookup.add_argument(
+        "--retune",
+        action="store_true",
+        help="Search the shapes that are not tuned in the background, warm-started from the answer.",
+    )
+    lookup.add_argument(
+        "--iterations",
+        type=int,
+        default=50,
+        help="Optimization iterations of a background search.",
+    )
+    args = parser.parse_args()
+
+    database = TuningDatabase(args.db)
+    if args.command == "list":
+        for entry in database.entries(batch_matmul, args.element_type):
+            print(
+                f"{shape_name(entry['shape'])}: {json.dumps(entry['config'])} "
+                f"{entry['runtime']:.6g} s ({entry['revision']})"
+            )
+        return
+
+    with open(f"{dir}/search_settings.json", "r") as f:
+        settings = json.load(f)
+    for text in args.shapes:
+        shape = parse_shape(text)
+        answer = database.suggest(
+            batch_matmul,
+            shape,
+            args.element_type,
+            shape_settings(settings, shape),
+            args.neighbors,
+        )
+        if answer is None:
+            print(f"{shape_name(shape)}: no tuned shape")
+        else:
+            print(f"{shape_name(shape)}: {json.dumps(answer[0])} ({answer[1]})")
+        if args.retune and (answer is None or answer[1] != "tuned"):
+            pid = database.retune(
+                batch_matmul,
+                shape,
+                args.element_type,
+                [f"--iterations={args.iterations}"],
+            )
+            if pid is not None:
+                print(f"  re-tuning in the background (pid {pid})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+from __future__ import annotations
+import csv
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy
+
+
+def load_evaluations(
+    paths: List[str], settings: dict, search: Optional[str] = None
+) -> List[dict]:
+    """Reads the evaluated configurations of earlier searches.
+
+    `paths` are measurement logs or output files of BACO. Every configuration
+    appears once, with its measurement at the highest fidelity, and reduced
+    runtimes extrapolated like BACO got them. With `search`, only that search
+    of a measurement log is read.
+    """
+    parameters = list(settings["input_parameters"])
+    evaluations: Dict[tuple, dict] = {}
+    for path in paths:
+        with open(path, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                if search is not None and row.get("search", search) != search:
+                    continue
+                try:
+                    config = {
+                        name: parse_parameter(settings, name, row[name])
+                        for name in parameters
+                    }
+                    fidelity = float(row.get("fidelity") or 1.0)
+                    evaluation = dict(
+                        config,
+                        runtime=float(row["runtime"]) / fidelity,
+                        Valid=int(float(row["Valid"])),
+                        fidelity=fidelity,
+                        censored=bool(int(row.get("censored") or 0)),
+                        estimated=bool(int(row.get("estimated") or 0)),
+                    )
+                except (KeyError, ValueError):
+                    continue
+                key = tuple(config[name] for name in parameters)
+                if key not in evaluations or fidelity >= evaluations[key]["fidelity"]:
+                    evaluations[key] = evaluation
+    return list(evaluations.values())
+
+
+def last_search(path: str) -> Optional[str]:
+    """Returns the id of the last search in a measurement log."""
+    if not os.path.exists(path):
+        return None
+    search = None
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            search = row.get("search", search)
+    return search
+
+
+def parse_parameter(settings: dict, name: str, value: str):
+    if settings["input_parameters"][name]["parameter_type"] == "real":
+        return float(value)
+    return int(float(value))
+
+
+def satisfies(settings: dict, name: str, config: dict) -> bool:
+    """Evaluates the constraints of parameter `name` for `config`.
+
+    Like BACO, on numpy values: `6 % tile0` is 0 instead of an error for a
+    tile size of 0, which the constraints allow separately.
+    """
+    values = {key: numpy.asarray(value) for key, value in config.items()}
+    with numpy.errstate(all="ignore"):
+        for constraint in settings["input_parameters"][name].get("constraints", []):
+            if not eval(constraint, {"where": numpy.where}, values):
+                return False
+    return True
+
+
+def project(settings: dict, config: dict) -> Optional[dict]:
+    """Moves a configuration of another shape into the current search space.
+
+    Every integer parameter that violates its range or constraints is replaced
+    by the closest value that satisfies them, e.g. a tile size that does not
+    divide the new dimension by the closest divisor. An ordinal parameter
+    only takes its listed values. Parameters are fixed in the order of the
+    settings, later ones may depend on earlier ones.
+    """
+    projected = dict(config)
+    for name, parameter in settings["input_parameters"].items():
+        values = parameter["values"]
+        value = projected[name]
+        if parameter["parameter_type"] in ("ordinal", "categorical"):
+            in_range = value in values
+        else:
+            in_range = values[0] <= value <= values[-1]
+        if in_range and satisfies(settings, name, projected):
+            continue
+        if parameter["parameter_type"] == "integer":
+            candidates = range(values[0], values[-1] + 1)
+        elif parameter["parameter_type"] == "ordinal":
+            candidates = values
+        else:
+            return None
+        candidates = sorted(candidates, key=lambda v: (abs(v - value), v))
+        for candidate in candidates:
+            if satisfies(settings, name, dict(projected, **{name: candidate})):
+                projected[name] = candidate
+                break
+        else:
+            return None
+    return projected
+
+
+def warm_start_configs(
+    evaluations: List[dict],
+    settings: dict,
+    points: int,
+    exclude: Optional[List[dict]] = None,
+) -> List[dict]:
+    """Returns the `points` fastest earlier configurations, projected into the
+    current search space, skipping those in `exclude`."""
+    parameters = list(settings["input_parameters"])
+    seen = {tuple(e[name] for name in parameters) for e in exclude or []}
+    configs = []
+    valid = [e for e in evaluations if e["Valid"]]
+    # Complete measurements first, censored runtimes are only lower bounds and
+    # estimated ones come from the cost model
+    def order(evaluation: dict) -> tuple:
+        return (
+            evaluation.get("estimated", False),
+            evaluation["censored"],
+            evaluation["runtime"],
+        )
+
+    for evaluation in sorted(valid, key=order):
+        config = project(settings, {name: evaluation[name] for name in parameters})
+        if config is None:
+            continue
+        key = tuple(config[name] for name in parameters)
+        if key in seen:
+            continue
+        seen.add(key)
+        configs.append(config)
+        if len(configs) == points:
+            break
+    return configs
+
+
+def resume_settings(
+    settings_file: str, evaluations: List[dict], iterations: Optional[int] = None
+) -> str:
+    """Writes settings that let BACO continue from `evaluations` and returns
+    their path.
+
+    The evaluations replace as many samples of the design of experiment as
+    there are, the remaining ones count against the optimization iterations,
+    so a resumed search ends with the budget of an uninterrupted one.
+    """
+    with open(settings_file, "r") as f:
+        settings = json.load(f)
+    if iterations is not None:
+        settings["optimization_iterations"] = iterations
+    if not evaluations:
+        return write_settings(settings)
+
+    outputs = list(settings["optimization_objectives"])
+    feasible = settings.get("feasible_output", {})
+    if feasible.get("enable_feasible_predictor"):
+        outputs.append(feasible["name"])
+    resume_file = os.path.splitext(settings["output_data_file"])[0] + "_resume.csv"
+    parameters = list(settings["input_parameters"])
+    with open(resume_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(parameters + outputs)
+        for evaluation in evaluations:
+            writer.writerow([evaluation[name] for name in parameters + outputs])
+
+    doe = settings["design_of_experiment"]["number_of_samples"]
+    settings["resume_optimization"] = True
+    settings["resume_optimization_file"] = resume_file
+    settings["design_of_experiment"]["number_of_samples"] = max(0, doe - len(evaluations))
+    settings["optimization_iterations"] = max(
+        0, settings["optimization_iterations"] - max(0, len(evaluations) - doe)
+    )
+    return write_settings(settings)
+
+
+def write_settings(settings: dict) -> str:
+    # Next to the output of BACO, the settings of the repository stay as they are
+    path = os.path.splitext(settings["output_data_file"])[0] + "_settings.json"
+    with open(path, "w") as f:
+        json.dump(settings, f, indent=4)
+    return path
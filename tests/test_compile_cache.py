@@ -0,0 +1,39 @@
+import os
+
+from compile_cache import CompileCache
+
+
+def artifact(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_store_and_lookup(tmp_path):
+    cache = CompileCache(str(tmp_path / "cache"))
+    cache.store("ab12", {"output": artifact(tmp_path, "a.o", 10)}, {"Valid": 1})
+    entry = cache.lookup("ab12")
+    assert entry.meta["Valid"] == 1
+    assert entry.meta["size"] == 10
+    assert os.path.getsize(entry.file("output")) == 10
+    assert cache.lookup("cd34") is None
+
+
+def test_evicts_least_recently_used_over_limit(tmp_path, monkeypatch):
+    cache = CompileCache(str(tmp_path / "cache"), max_bytes=250)
+    scans = []
+    scan = cache.scan
+    monkeypatch.setattr(cache, "scan", lambda: scans.append(1) or scan())
+    for i, key in enumerate(["aa", "bb"]):
+        cache.store(key, {"output": artifact(tmp_path, f"{key}.o", 100)}, {})
+        os.utime(cache.entry_path(key) + "/meta.json", (i, i))
+    # Within the limit the entries are listed once, to learn the size
+    assert len(scans) == 1
+    assert cache.size == 200
+
+    cache.store("cc", {"output": artifact(tmp_path, "cc.o", 100)}, {})
+    assert len(scans) == 2
+    assert cache.lookup("aa") is None
+    assert cache.lookup("bb") is not None
+    assert cache.lookup("cc") is not None
+    assert cache.size == 200
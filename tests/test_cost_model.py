@@ -0,0 +1,35 @@
+from cost_model import CostModel
+
+caches = {1: 32 << 10, 2: 1 << 20, 3: 8 << 20}
+
+
+def config(tile0, tile1, tile2, tile3, do_vect=0):
+    tiles = {"tile0": tile0, "tile1": tile1, "tile2": tile2, "tile3": tile3}
+    return dict(tiles, do_vect=do_vect)
+
+
+def test_screen_slow_tiling_still_compiles():
+    model = CostModel([6, 196, 256, 2304], "f32", caches)
+    # Untiled, about 25 MiB of operands
+    reason, compiles = model.screen(config(0, 0, 0, 0))
+    assert compiles
+    assert "last level cache" in reason
+    assert model.screen(config(1, 4, 16, 0)) is None
+
+
+def test_screen_large_vectorization_does_not_compile():
+    model = CostModel(
+        [6, 196, 256, 2304], "f32", caches, max_vector_elements=1 << 10
+    )
+    _, compiles = model.screen(config(1, 4, 16, 32, do_vect=1))
+    assert not compiles
+    assert model.screen(config(1, 4, 16, 8, do_vect=1)) is None
+
+
+def test_pessimistic_runtime_is_slower_than_scalar_peak():
+    model = CostModel([6, 196, 256, 2304], "f32", caches)
+    flops = 2 * 6 * 196 * 256 * 2304
+    assert model.pessimistic_runtime(config(0, 0, 0, 0)) >= flops / 1e9
+    # More tiles reload more data
+    fine = model.pessimistic_runtime(config(1, 1, 1, 1))
+    assert fine > model.pessimistic_runtime(config(1, 4, 16, 0))
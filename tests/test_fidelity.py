@@ -0,0 +1,138 @@
+import os
+import re
+
+import pytest
+
+from cost_model import batch_matmul_shape
+from fidelity import MultiFidelity, reduced_shape, reshape_payload
+
+payload_dir = os.path.join(
+    os.path.dirname(__file__), "..", "lib", "Performance_Exploration"
+)
+
+
+def parametric_script() -> str:
+    with open(os.path.join(payload_dir, "parametric_transform.mlir")) as f:
+        return f.read()
+
+
+def payload_types(script: str) -> dict:
+    """Returns the memref types of A, B and C wherever they appear."""
+    signature = re.search(
+        r"func\.func @matmul_mlir\(%A: (memref<[^>]*>), %B: (memref<[^>]*>)\)"
+        r" -> \((memref<[^>]*>)\)",
+        script,
+    )
+    operands = re.search(
+        r"linalg\.batch_matmul.*ins\(%A, %B : (memref<[^>]*>), (memref<[^>]*>)\)"
+        r" outs\(%C : (memref<[^>]*>)\)",
+        script,
+    )
+    alloc = re.search(r"%C = memref\.alloc\(\) : (memref<[^>]*>)", script)
+    dims = re.findall(r"memref\.dim (%[AB]), %c\d : (memref<[^>]*>)", script)
+    returned = re.search(r"return %C : (memref<[^>]*>)", script)
+    return {
+        "A": {signature.group(1), operands.group(1)}
+        | {type for value, type in dims if value == "%A"},
+        "B": {signature.group(2), operands.group(2)}
+        | {type for value, type in dims if value == "%B"},
+        "C": {
+            signature.group(3),
+            operands.group(3),
+            alloc.group(1),
+            returned.group(1),
+        },
+    }
+
+
+def expected_types(shape):
+    b, m, n, k = shape
+    return {
+        "A": {f"memref<{b}x{m}x{k}xf32>"},
+        "B": {f"memref<{b}x{k}x{n}xf32>"},
+        "C": {f"memref<{b}x{m}x{n}xf32>"},
+    }
+
+
+@pytest.mark.parametrize(
+    "new_shape",
+    [[3, 196, 256, 1152], [1, 256, 256, 256], [4, 64, 64, 64], [2, 8, 8, 16]],
+)
+def test_reshape_payload(new_shape):
+    script = parametric_script()
+    shape = batch_matmul_shape(script)[0]
+    reshaped = reshape_payload(script, shape, new_shape)
+    assert payload_types(reshaped) == expected_types(new_shape)
+    assert batch_matmul_shape(reshaped)[0] == new_shape
+
+
+def test_reshape_payload_from_equal_dimensions():
+    # Operands with the same type before reshaping get different types
+    script = reshape_payload(
+        parametric_script(), [6, 196, 256, 2304], [1, 256, 256, 256]
+    )
+    reshaped = reshape_payload(script, [1, 256, 256, 256], [1, 256, 256, 64])
+    assert payload_types(reshaped) == expected_types([1, 256, 256, 64])
+
+
+def test_reshape_payload_keeps_other_types():
+    script = parametric_script()
+    reshaped = reshape_payload(script, [6, 196, 256, 2304], [3, 196, 256, 2304])
+    assert "@printMemrefF32(memref<*xf32>)" in reshaped
+    assert "!transform.any_op" in reshaped
+
+
+@pytest.mark.parametrize(
+    "tiles,fidelity,expected",
+    [
+        # The batch first, then K, in multiples of their tiles
+        ([1, 4, 16, 0], 0.5, [3, 196, 256, 2304]),
+        ([1, 4, 16, 64], 0.1, [1, 196, 256, 1408]),
+        ([2, 4, 16, 64], 0.1, [2, 196, 256, 704]),
+        ([0, 0, 0, 0], 0.1, [1, 196, 256, 1382]),
+        # Tiles of the whole batch and K leave nothing to reduce
+        ([6, 4, 16, 2304], 0.1, [6, 196, 256, 2304]),
+    ],
+)
+def test_reduced_shape(tiles, fidelity, expected):
+    assert reduced_shape([6, 196, 256, 2304], tiles, fidelity) == expected
+
+
+def test_reduced_shape_equal_dimensions():
+    assert reduced_shape([1, 256, 256, 256], [1, 8, 8, 8], 0.25) == [1, 256, 256, 64]
+
+
+def config(tile0, tile1, tile2, tile3):
+    tiles = {"tile0": tile0, "tile1": tile1, "tile2": tile2, "tile3": tile3}
+    return dict(tiles, do_vect=0)
+
+
+def test_multi_fidelity_reduce_equal_dimensions():
+    shape = [1, 256, 256, 256]
+    script = reshape_payload(parametric_script(), [6, 196, 256, 2304], shape)
+    multi_fidelity = MultiFidelity(shape, [0.25])
+    reduced, args, work = multi_fidelity.reduce(script, config(1, 8, 8, 8), 0.25)
+    assert args == ["--shape=1,256,256,64"]
+    assert work == 0.25
+    assert payload_types(reduced) == expected_types([1, 256, 256, 64])
+
+
+def test_multi_fidelity_not_reducible():
+    shape = [6, 196, 256, 2304]
+    multi_fidelity = MultiFidelity(shape, [0.1, 0.3])
+    whole = config(6, 4, 16, 2304)
+    assert not multi_fidelity.reducible(whole, 0.1)
+    assert multi_fidelity.reducible(config(1, 4, 16, 0), 0.1)
+    with pytest.raises(ValueError):
+        multi_fidelity.reduce(parametric_script(), whole, 0.1)
+
+
+def test_promoted():
+    multi_fidelity = MultiFidelity([6, 196, 256, 2304], [0.5], promote=0.5)
+    results = {
+        0: {"runtime": 1.0, "Valid": 1, "fidelity": 0.5},
+        1: {"runtime": 0.4, "Valid": 1, "fidelity": 0.5},
+        2: {"runtime": 0.1, "Valid": 0, "fidelity": 0.5},
+        3: {"runtime": 0.2, "Valid": 1, "fidelity": 0.25},
+    }
+    assert multi_fidelity.promoted(results) == [1, 3]
@@ -0,0 +1,50 @@
+import subprocess
+import sys
+
+import pytest
+
+from measure_server import MeasureServer
+
+# Answers every request like the harness, hangs on "hang" and exits on "crash"
+fake_server = """
+import sys, time
+for line in sys.stdin:
+    path = line.split()[0]
+    if path == "hang":
+        time.sleep(60)
+    if path == "crash":
+        sys.exit(3)
+    print(f"time:0.5 {path}", flush=True)
+"""
+
+
+def server(tmp_path, timeout):
+    script = tmp_path / "server.py"
+    script.write_text(fake_server)
+    return MeasureServer(sys.executable, ["-u", str(script)], timeout)
+
+
+def test_answers_requests(tmp_path):
+    measure_server = server(tmp_path, 10)
+    assert measure_server.measure("a.so") == "time:0.5 a.so\n"
+    assert measure_server.measure("b.so", ["--adaptive"]) == "time:0.5 b.so\n"
+    measure_server.close()
+    assert measure_server.process is None
+
+
+def test_hanging_kernel_times_out_and_restarts(tmp_path):
+    measure_server = server(tmp_path, 0.5)
+    with pytest.raises(subprocess.TimeoutExpired):
+        measure_server.measure("hang")
+    assert measure_server.process is None
+    assert measure_server.measure("a.so") == "time:0.5 a.so\n"
+    measure_server.close()
+
+
+def test_crashing_kernel_restarts(tmp_path):
+    measure_server = server(tmp_path, 10)
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        measure_server.measure("crash")
+    assert error.value.returncode == 3
+    assert measure_server.measure("a.so") == "time:0.5 a.so\n"
+    measure_server.close()
@@ -0,0 +1,36 @@
+import sys
+
+import pytest
+
+from proc_monitor import run_monitored
+
+
+def test_peak_excludes_caller_memory():
+    held = bytearray(200 * 1024 * 1024)
+    held[::4096] = b"x" * len(held[::4096])
+    _, _, _, memory = run_monitored(["true"])
+    assert memory["peak_rss_kb"] < 100 * 1024
+    _, _, _, memory = run_monitored(["true"], trace=True)
+    assert memory["peak_rss_kb"] < 100 * 1024
+
+
+def test_peak_of_command():
+    allocate = "x = bytearray(150 * 1024 * 1024); x[::4096] = b'x' * len(x[::4096])"
+    command = [sys.executable, "-c", allocate]
+    _, _, _, memory = run_monitored(command)
+    assert memory["peak_rss_kb"] > 150 * 1024
+
+
+def test_output_status_and_timeout():
+    returncode, output, errors, memory = run_monitored(
+        ["sh", "-c", "cat; echo error >&2; exit 3"], input="payload"
+    )
+    assert (returncode, output, errors) == (3, "payload", "error\n")
+    assert not memory["timed_out"]
+    returncode, _, _, memory = run_monitored(["sleep", "10"], timeout=0.2)
+    assert returncode < 0 and memory["timed_out"]
+
+
+def test_missing_command():
+    with pytest.raises(FileNotFoundError):
+        run_monitored(["no-such-tool-here"])
@@ -0,0 +1,38 @@
+import json
+import random
+
+from measurement_log import MeasurementLog
+from results_store import ResultsStore, compare
+
+
+def kernel_times(median, count=15, seed=0):
+    """Synthetic samples of a kernel run with 1% noise."""
+    rng = random.Random(seed)
+    return [median * (1 + rng.gauss(0, 0.01)) for _ in range(count)]
+
+
+def test_compare_flags_kernel_regression(tmp_path):
+    config = {"tile0": 1, "tile1": 4}
+    for revision, median in [("before", 1e-3), ("after", 1.1e-3)]:
+        store = ResultsStore(str(tmp_path / "benchmarks.sqlite"), revision)
+        path = str(tmp_path / f"{revision}.csv")
+        log = MeasurementLog(path, list(config), store=store)
+        times = kernel_times(median, seed=len(revision))
+        log.append(config, {"runtime": sorted(times)[7], "Valid": 1, "times": times})
+        store.close()
+
+    store = ResultsStore(str(tmp_path / "benchmarks.sqlite"), "unknown")
+    before, after = store.samples("before"), store.samples("after")
+    key = ("kernel", "batch_matmul", json.dumps(config, sort_keys=True), "runtime")
+    # Every sample of the run is stored, not only its median
+    assert len(before[key]) == len(after[key]) == 15
+    rows = {row["metric"]: row for row in compare(before, after)}
+    assert rows["runtime"]["status"] == "regression"
+    assert abs(rows["runtime"]["change"] - 0.1) < 0.02
+
+
+def test_compare_ignores_noise():
+    key = ("kernel", "batch_matmul", "{}", "runtime")
+    before = {key: kernel_times(1e-3, seed=1)}
+    after = {key: kernel_times(1e-3, seed=2)}
+    assert compare(before, after)[0]["status"] == "unchanged"
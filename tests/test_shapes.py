@@ -0,0 +1,46 @@
+import json
+import os
+
+import pytest
+
+from cost_model import batch_matmul_shape
+from shapes import parse_shape, shape_script, shape_settings, suffixed
+from warm_start import satisfies
+from test_fidelity import expected_types, parametric_script, payload_dir, payload_types
+
+
+def search_settings() -> dict:
+    with open(os.path.join(payload_dir, "search_settings.json")) as f:
+        return json.load(f)
+
+
+def test_parse_shape():
+    assert parse_shape("8,128,64,512") == [8, 128, 64, 512]
+    assert parse_shape("8x128x64x512") == [8, 128, 64, 512]
+    with pytest.raises(ValueError):
+        parse_shape("8,128,64")
+    with pytest.raises(ValueError):
+        parse_shape("0,128,64,512")
+
+
+@pytest.mark.parametrize(
+    "shape", [[1, 256, 256, 256], [8, 128, 64, 512], [2, 64, 64, 32]]
+)
+def test_shape_script(shape):
+    script = shape_script(parametric_script(), shape)
+    assert batch_matmul_shape(script)[0] == shape
+    assert payload_types(script) == expected_types(shape)
+
+
+def test_shape_settings():
+    settings = shape_settings(search_settings(), [1, 256, 256, 64])
+    parameters = settings["input_parameters"]
+    assert parameters["tile3"]["values"] == [0, 64]
+    config = {"tile0": 1, "tile1": 8, "tile2": 8, "tile3": 16, "do_vect": 1}
+    assert satisfies(settings, "tile3", config)
+    assert not satisfies(settings, "tile3", dict(config, tile3=48))
+    # Other parameters keep their constraints
+    assert parameters["do_vect"] == search_settings()["input_parameters"]["do_vect"]
+    assert settings["output_data_file"] == suffixed(
+        search_settings()["output_data_file"], [1, 256, 256, 64]
+    )
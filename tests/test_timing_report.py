@@ -0,0 +1,101 @@
+from timing_report import (
+    build_tree,
+    copy_payload_ops,
+    find_parents,
+    format_tree,
+    input_of,
+)
+
+
+def action(name, start, duration, depth=0, payload_ops=None, thread=0):
+    action = {
+        "kind": "pass",
+        "name": name,
+        "start": start,
+        "duration": duration,
+        "depth": depth,
+        "thread": thread,
+    }
+    if payload_ops is not None:
+        action["payload_ops"] = payload_ops
+    return action
+
+
+def record(actions, total=1.0):
+    return {"tool": "mlir-opt", "total": total, "actions": actions}
+
+
+def test_counts_are_averaged_over_records():
+    # The pass runs on two functions in every record
+    records = [
+        record(
+            [
+                action("pipeline", 0.0, 1.0),
+                action("cse", 0.1, 0.2, 1),
+                action("cse", 0.5, 0.2, 1),
+            ]
+        )
+        for _ in range(3)
+    ]
+    tree = build_tree(records)
+    pipeline = tree.children[("pass", "pipeline")]
+    assert pipeline.count == 1
+    assert abs(pipeline.children[("pass", "cse")].count - 2) < 1e-9
+    lines = format_tree(tree)
+    assert any(line.endswith("cse (x2)") for line in lines)
+    assert not any("pipeline (x" in line for line in lines)
+
+
+def test_payload_ops_come_from_counted_records():
+    timed = [record([action("pipeline", 0.0, 1.0)])]
+    counted = [record([action("pipeline", 0.0, 3.0, payload_ops=42)], total=3.0)]
+    tree = build_tree(timed)
+    copy_payload_ops(tree, build_tree(counted))
+    pipeline = tree.children[("pass", "pipeline")]
+    assert pipeline.duration == 1.0
+    assert pipeline.payload_ops == 42
+
+
+def test_input_of_names_payloads_in_memory():
+    command = ["mlir-transform-opt", "/proc/self/fd/7", "--transform=/proc/self/fd/8"]
+    record = {"tool": "mlir-transform-opt", "command": command}
+    record["payload"] = "/home/tests/ops_3.mlir"
+    assert input_of(record) == "ops_3"
+    path = "/home/models/bert_tosa.mlir"
+    assert input_of({"tool": "mlir-opt", "command": ["mlir-opt", path]}) == "bert"
+    assert input_of({"tool": "mlir-opt", "command": ["mlir-opt", "-"]}) == "<stdin>"
+
+
+def test_worker_threads_belong_to_the_adaptor():
+    adaptor = "mlir::detail::OpToOpPassAdaptor"
+    actions = [
+        action("inline", 0.0, 0.05),
+        action(adaptor, 0.05, 10.0),
+        action("canonicalize", 0.1, 4.0, thread=1),
+        action("canonicalize", 0.2, 3.0, thread=2),
+        action("cse", 3.3, 0.5, thread=2),
+        action("cse", 4.2, 0.5, thread=1),
+        action("canonicalize", 5.0, 1.0, depth=1),
+        action("symbol-dce", 10.1, 0.1),
+    ]
+    assert find_parents(actions) == [-1, -1, 1, 1, 1, 1, 1, -1]
+    tree = build_tree([record(actions, total=10.2)])
+    assert set(tree.children) == {
+        ("pass", "inline"),
+        ("pass", adaptor),
+        ("pass", "symbol-dce"),
+    }
+    children = tree.children[("pass", adaptor)].children
+    assert set(children) == {("pass", "canonicalize"), ("pass", "cse")}
+    assert children[("pass", "canonicalize")].count == 3
+    assert not children[("pass", "canonicalize")].children
+
+
+def test_worker_threads_without_adaptor_belong_to_the_main_thread():
+    actions = [
+        action("pipeline", 0.0, 2.0),
+        action("nested", 0.1, 1.5, depth=1),
+        action("cse", 0.2, 0.5, thread=1),
+        action("cse", 0.3, 0.5, thread=2),
+    ]
+    assert find_parents(actions) == [-1, 0, 1, 1]
@@ -0,0 +1,59 @@
+from measurement_log import MeasurementLog
+from warm_start import load_evaluations, project, warm_start_configs
+
+
+def settings(**parameters):
+    return {"input_parameters": parameters}
+
+
+def tile(size):
+    return {
+        "parameter_type": "integer",
+        "values": [0, size],
+        "constraints": [f"({size} % tile == 0) | (tile == 0)"],
+    }
+
+
+def test_project_integer_to_closest_divisor():
+    assert project(settings(tile=tile(196)), {"tile": 64}) == {"tile": 49}
+    assert project(settings(tile=tile(196)), {"tile": 300}) == {"tile": 196}
+
+
+def test_project_ordinal_to_listed_values():
+    unroll = {"parameter_type": "ordinal", "values": [1, 2, 4, 8]}
+    # 3 and 5 lie in the range of the values but are not among them
+    assert project(settings(unroll=unroll), {"unroll": 3}) == {"unroll": 2}
+    assert project(settings(unroll=unroll), {"unroll": 5}) == {"unroll": 4}
+    assert project(settings(unroll=unroll), {"unroll": 16}) == {"unroll": 8}
+    assert project(settings(unroll=unroll), {"unroll": 4}) == {"unroll": 4}
+
+
+def test_project_categorical_outside_values():
+    order = {"parameter_type": "categorical", "values": [0, 1]}
+    assert project(settings(order=order), {"order": 2}) is None
+
+
+def test_warm_start_configs_skips_excluded():
+    space = settings(tile=tile(6))
+    evaluations = [
+        {"tile": 3, "runtime": 1.0, "Valid": 1, "censored": False},
+        {"tile": 2, "runtime": 2.0, "Valid": 1, "censored": False},
+    ]
+    assert warm_start_configs(evaluations, space, 1) == [{"tile": 3}]
+    assert warm_start_configs(evaluations, space, 1, exclude=[{"tile": 3}]) == [
+        {"tile": 2}
+    ]
+
+
+def test_screened_configurations_are_resumed(tmp_path):
+    space = settings(tile=tile(6))
+    path = str(tmp_path / "measurements.csv")
+    log = MeasurementLog(path, ["tile"], search="s")
+    log.append({"tile": 3}, {"runtime": 1.0, "Valid": 1})
+    log.append({"tile": 2}, {"runtime": 0.5, "Valid": 1, "estimated": True})
+    log.append({"tile": 4}, {"runtime": 0.0, "Valid": 0})
+    evaluations = load_evaluations([path], space, "s")
+    assert len(evaluations) == 3
+    assert [e["estimated"] for e in evaluations] == [False, True, False]
+    # Estimated runtimes come after measured ones
+    assert warm_start_configs(evaluations, space, 2) == [{"tile": 3}, {"tile": 2}]